@@ -0,0 +1,278 @@
+"""
+ASGI entry point serving the same API as manager.py.
+
+Streams are backed by async generators, so an open SSE stream costs a
+coroutine instead of a server thread. Run with:
+
+    python asgi_manager.py
+    # or: uvicorn asgi_manager:app --workers 4
+"""
+
+import contextlib
+import json
+import os
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from config.chatgpt_config import config_dict
+from tools import metrics
+from tools.cfg_wrapper import load_config
+from tools.log import configure_logging, get_logger
+from tools.session_store import new_session_id
+from tools.stream_coalescer import StreamCoalescer
+from tools.tracing import configure_tracing, TracingMiddleware
+from web_api.dialogue_api import dialogue_api_handler
+
+cfg = load_config(config_dict)
+server_config = cfg.Server_config
+configure_logging(cfg.Logging_config)
+configure_tracing(cfg.Tracing_config)
+metrics.configure_metrics(cfg.Metrics_config)
+log = get_logger(__name__)
+
+dialogue_api_hl = dialogue_api_handler()
+session_config = dialogue_api_hl.session_config
+# batches deltas into frames and stops the upstream for slow or gone clients
+stream_coalescer = StreamCoalescer.from_config(cfg.Stream_config.downstream)
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+
+class _UploadedAudio(object):
+    """Expose a starlette UploadFile with the werkzeug FileStorage attributes the requestor reads"""
+
+    def __init__(self, upload):
+        super().__init__()
+        self.filename = upload.filename
+        self.stream = upload.file
+        self.mimetype = upload.content_type
+        self.content_length = upload.size
+
+
+def _error(message, status_code):
+    return JSONResponse({'code': 1, 'message': message}, status_code=status_code)
+
+
+def _session_id(request):
+    """Resolve the conversation id from the session header or cookie, see manager.get_session_id"""
+    session_id = request.headers.get(session_config.header) or request.cookies.get(session_config.cookie)
+    if session_id:
+        return session_id, False
+    return new_session_id(), True
+
+
+def _event_stream(frames, session_id=None, is_new_session=False):
+    headers = dict(SSE_HEADERS)
+    if session_id:
+        headers[session_config.header] = session_id
+    response = StreamingResponse(frames, media_type='text/event-stream', headers=headers)
+    if is_new_session:
+        response.set_cookie(session_config.cookie, session_id, httponly=True, samesite='lax')
+    return response
+
+
+async def request_openai(request: Request):
+    try:
+        body = await request.json()
+        user_request_input = body.get('user_input')
+        model = body.get('model', 'gpt-4o')  # 默认使用gpt-4o
+        session_id, is_new_session = _session_id(request)
+
+        chunks = dialogue_api_hl.agenerate_massage_stream(user_request_input, model, session_id)
+        return _event_stream(stream_coalescer.aframes(chunks, 'call failed', 'request_openai'), session_id, is_new_session)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def request_smart(request: Request):
+    """
+    Smart multimodal API endpoint - Automatically detect intent and select appropriate model
+    """
+    try:
+        body = await request.json()
+        user_input = body.get('user_input')
+        image_url = body.get('image_url')
+        model = body.get('model', 'gpt-4o')  # 默认使用gpt-4o
+
+        if not user_input:
+            return _error('Missing user_input', 400)
+
+        session_id, is_new_session = _session_id(request)
+        chunks = dialogue_api_hl.adetect_intent_and_generate(user_input, image_url, model, session_id)
+        return _event_stream(stream_coalescer.aframes(chunks, 'smart call failed', 'request_smart'), session_id, is_new_session)
+    except Exception as e:
+        return _error(str(e), 500)
+
+
+async def speech_to_text(request: Request):
+    try:
+        form = await request.form()
+        if 'audio' not in form:
+            return _error('Missing audio file', 400)
+
+        file_obj = _UploadedAudio(form['audio'])
+        language = form.get('language')  # 可选的语言参数
+
+        # 检查文件大小
+        if file_obj.content_length and file_obj.content_length > 25 * 1024 * 1024:  # 25MB限制
+            return _error('Audio file too large (max 25MB)', 400)
+
+        text = await dialogue_api_hl.atranscribe_audio(file_obj, language)
+        if text is None:
+            return _error('Speech recognition failed', 500)
+
+        # 过滤掉过短的结果
+        if len(text.strip()) < 2:
+            return _error('No valid speech detected', 400)
+
+        return JSONResponse({'code': 0, 'text': text})
+    except Exception as e:
+        log.exception("asr.error", error=str(e))
+        return _error(str(e), 500)
+
+
+async def text_to_speech(request: Request):
+    try:
+        body = await request.json()
+        text = body.get('text')
+        voice = body.get('voice', 'alloy')  # 默认使用alloy语音
+
+        if not text:
+            return _error('Missing text', 400)
+
+        # 文本长度限制
+        if len(text) > 4000:
+            return _error('Text too long (max 4000 characters)', 400)
+
+        audio_data = await dialogue_api_hl.atext_to_speech(text, voice)
+        if audio_data is None:
+            return _error('TTS generation failed', 500)
+
+        return Response(
+            audio_data,
+            media_type='audio/mpeg',
+            headers={'Content-Disposition': 'attachment; filename="speech.mp3"'}
+        )
+    except Exception as e:
+        log.exception("tts.error", error=str(e))
+        return _error(str(e), 500)
+
+
+async def text_to_speech_stream(request: Request):
+    """
+    Streaming TTS endpoint for real-time audio generation
+    """
+    try:
+        body = await request.json()
+        text = body.get('text')
+        voice = body.get('voice', 'alloy')
+
+        if not text:
+            return _error('Missing text', 400)
+
+        # Text length limit
+        if len(text) > 4000:
+            return _error('Text too long (max 4000 characters)', 400)
+
+        async def generate():
+            try:
+                async for chunk_data in dialogue_api_hl.atext_to_speech_stream(text, voice):
+                    response_data = json.dumps({
+                        'code': 0,
+                        'message': 'success',
+                        **chunk_data
+                    })
+                    yield f"data: {response_data}\n\n"
+            except Exception as e:
+                error_data = json.dumps({
+                    'code': 1,
+                    'message': 'streaming TTS failed',
+                    'type': 'error',
+                    'error': str(e)
+                })
+                yield f"data: {error_data}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return _event_stream(generate())
+    except Exception as e:
+        log.exception("tts.stream_error", error=str(e))
+        return _error(str(e), 500)
+
+
+async def serve_background(request: Request):
+    """Serve background images"""
+    background_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'backgrounds')
+    file_path = os.path.join(background_path, os.path.basename(request.path_params['filename']))
+    if not os.path.exists(file_path):
+        return PlainTextResponse("Background image not found", status_code=404)
+    return FileResponse(file_path)
+
+
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint"""
+    return Response(metrics.exposition(), media_type=metrics.CONTENT_TYPE)
+
+
+async def index(request: Request):
+    return JSONResponse({
+        'name': 'ChatFlow API',
+        'version': '1.0.0',
+        'description': 'Modern AI Chat API with multimodal support',
+        'endpoints': {
+            'POST /request_openai': 'Standard OpenAI chat completion',
+            'POST /request_smart': 'Smart multimodal requests with auto intent detection',
+            'POST /speech_to_text': 'Speech recognition via Whisper',
+            'POST /text_to_speech': 'Text-to-speech generation',
+            'POST /text_to_speech_stream': 'Streaming text-to-speech'
+        },
+        'frontend': {
+            'development': 'cd frontend && npm run dev',
+            'production': 'cd frontend && npm run build && npm run preview'
+        }
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    # runs after uvicorn's graceful shutdown (timeout_graceful_shutdown) has let the open streams
+    # finish or cancelled them, so no stream still needs the transport
+    await dialogue_api_hl.async_requestor.transport.aclose()
+
+
+routes = [
+    Route("/request_openai", request_openai, methods=['POST']),
+    Route("/request_smart", request_smart, methods=['POST']),
+    Route("/speech_to_text", speech_to_text, methods=['POST']),
+    Route("/text_to_speech", text_to_speech, methods=['POST']),
+    Route("/text_to_speech_stream", text_to_speech_stream, methods=['POST']),
+    Route("/static/backgrounds/{filename}", serve_background),
+    Route("/", index),
+]
+if cfg.Metrics_config.enabled:
+    routes.append(Route(cfg.Metrics_config.path, metrics_endpoint))
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+                Middleware(TracingMiddleware), Middleware(metrics.MetricsMiddleware)],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    uvicorn.run(
+        "asgi_manager:app",
+        host=server_config.host,
+        port=server_config.port,
+        workers=server_config.workers,
+        timeout_graceful_shutdown=server_config.drain_timeout,
+    )
@@ -4,6 +4,9 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+# base URL of the OpenAI compatible API, e.g. http://127.0.0.1:8900/v1 for tests/mock_openai_server.py
+API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+
 config_dict = dict(
 
     Acess_config = dict(
@@ -12,10 +15,60 @@ config_dict = dict(
 
     Model_config = dict(
         model_name = "gpt-3.5-turbo",
-        request_address = "https://api.openai.com/v1/chat/completions",
+        request_address = f"{API_BASE}/chat/completions",
         vision_model_name = "gpt-4o",
         dalle_model_name = "dall-e-3",
-        dalle_request_address = "https://api.openai.com/v1/images/generations",
+        dalle_request_address = f"{API_BASE}/images/generations",
+        transcription_request_address = f"{API_BASE}/audio/transcriptions",
+        tts_request_address = f"{API_BASE}/audio/speech",
+    ),
+
+    # ASGI server (asgi_manager.py)
+    Server_config = dict(
+        host = "0.0.0.0",
+        port = 9200,
+        workers = int(os.getenv("WEB_CONCURRENCY", "1")),
+        drain_timeout = 30,      # seconds open streams get to finish on shutdown (uvicorn timeout_graceful_shutdown)
+    ),
+
+    # structured logs (tools/log.py), written by a background thread
+    Logging_config = dict(
+        level = os.getenv("LOG_LEVEL", "INFO"),
+        format = "text",           # "text" or "json" (one object per line)
+        queue_size = 10000,        # records waiting for the writer thread, more are dropped and counted
+        log_bodies = False,        # log conversation text instead of its size
+        debug_sample_rate = 0.01,  # fraction of per-chunk debug events kept
+        sample_rates = dict(),     # per event overrides, e.g. {"stream.delta": 0.1}
+    ),
+
+    # Prometheus text endpoint (tools/metrics.py); turning the endpoint off also stops recording
+    Metrics_config = dict(
+        enabled = True,            # serve the endpoint; off: metrics are not recorded either
+        path = "/metrics",
+    ),
+
+    # per-request spans (intent, context, tokenize, connection, upstream, stream, trim)
+    Tracing_config = dict(
+        enabled = os.getenv("TRACING_ENABLED", "false").lower() == "true",
+        exporter = "log",          # "log" (structured log), "otlp" (OTLP/HTTP JSON) or "memory"
+        otlp_endpoint = os.getenv("OTLP_ENDPOINT", "http://localhost:4318/v1/traces"),
+        service_name = "chatflow-api",
+        sample_rate = 1.0,         # fraction of requests traced
+        batch_size = 512,          # spans per export
+        export_interval = 5,       # seconds between exports
+    ),
+
+    # pooled keep-alive HTTP transport shared by every OpenAI request
+    Transport_config = dict(
+        pool_connections = 10,   # number of per-host connection pools kept
+        pool_maxsize = 20,       # keep-alive connections kept per host
+        pool_block = False,
+        max_retries = 0,
+        connect_timeout = 5,
+        read_timeout = 60,
+        http2 = True,            # used by the asyncio engine when `h2` is installed
+        # open connections of the asyncio engine; on HTTP/1.1 (no `h2`) each concurrent stream needs one
+        max_connections = 4000,
     ),
 
     Context_manage_config = dict(
@@ -26,7 +79,94 @@ config_dict = dict(
         role_weights=1,
         sys_role_ratio=3,
         del_ratio = 0.4,
-        max_keep_turns=30)
+        max_keep_turns=30,
+        truncate_mode = "tokens"),  # "tokens": cut exact token ids, "chars": legacy character estimate
+        # summarize old turns into one system message in the background instead of cutting them
+        compaction = dict(
+        enabled = False,
+        threshold = 0.75,      # fraction of max_context that triggers a compaction
+        compact_turns = 6,     # oldest messages summarized per compaction
+        keep_turns = 4,        # recent messages never summarized
+        max_words = 150,
+        workers = 1),
+        # keep request prefixes stable so the API can serve them from its prompt cache
+        prefix_cache = dict(
+        enabled = False,
+        system_prompt = "default_assistant",  # key of PromptTemplates.SYSTEM_PROMPTS, pinned in front
+        block_size = 8),       # oldest messages evicted together when the context overflows
+    ),
+
+    # streamed completions
+    Stream_config = dict(
+        include_usage = True,          # request the final usage chunk (stream_options.include_usage)
+        max_completion_tokens = None,  # abort a stream once it produced this many tokens
+        # SSE frames sent to the client (manager.py, asgi_manager.py)
+        downstream = dict(
+            coalesce_ms = 20,            # deltas arriving within this window share one frame
+            coalesce_bytes = 256,        # ... unless this much text is pending
+            max_pending_chunks = 1024,   # upstream chunks read ahead of the client
+            slow_client_timeout = 10,    # seconds a full read-ahead may wait before the upstream is closed
+        ),
+    ),
+
+    # memoized token counting
+    Tokenizer_config = dict(
+        cache_entries = 4096,
+        cache_bytes = 4 * 1024 * 1024,
+        batch_threads = 4,       # threads used by Tokennizer.count_many
+        prewarm = True,          # load the encoding in the background at startup instead of on the first request
+        # local tiktoken cache, so the BPE files are not downloaded at boot (offline deploys)
+        encoding_cache_dir = os.getenv("TIKTOKEN_CACHE_DIR"),
+        encoding_files = dict(),  # e.g. cl100k_base = "/opt/tiktoken/cl100k_base.tiktoken"
+        # model name -> tiktoken encoding, for models the built-in prefix table does not know
+        model_encodings = dict(),  # e.g. {"my-finetune": "o200k_base"}
+    ),
+
+    # cache of chat completions for repeated requests (same model, messages and parameters)
+    Response_cache_config = dict(
+        enabled = False,
+        ttl = 3600,              # seconds
+        max_entries = 1024,
+        max_mb = 16,             # memory tier size
+        disk_path = None,        # e.g. "data/response_cache.db" adds a SQLite tier shared by workers
+        disk_max_mb = 256,
+        # routes that may be answered from the cache
+        routes = dict(
+            request_openai = False,
+            request_smart = False,
+            intent_detection = True,
+        ),
+    ),
+
+    # intent routing of /request_smart (thresholds and tiers are in config/prompt_config.yaml)
+    Intent_detection_config = dict(
+        prewarm = True,          # train the local classifier in the background at startup instead of on the first request
+        # threads running the LLM intent checks and the reads of speculative text streams (speculative
+        # in prompt_config.yaml); a speculating request uses two of them until its intent is known
+        speculative_workers = 8,
+    ),
+
+    # decisions of the LLM intent check of /request_smart, keyed on the normalized input
+    Intent_cache_config = dict(
+        max_entries = 4096,
+        ttl = 24 * 3600,         # seconds
+    ),
+
+    # per-conversation contexts, keyed by the X-Session-Id header or session_id cookie
+    Session_config = dict(
+        max_sessions = 1000,
+        idle_ttl = 1800,         # seconds before an idle conversation is dropped
+        max_memory_mb = 256,     # cap on the summed size of all stored contexts
+        header = "X-Session-Id",
+        cookie = "session_id",
+        storage = None,          # None (no persistence) | memory | sqlite | append_log
+        storage_path = None,     # defaults to data/sessions.db or data/sessions.log
+        lazy_load = True,        # load stored sessions on first access only
+        # compare the stored version on every access and pick up turns other workers wrote;
+        # None: on for the sqlite and append_log storages, off with session affinity
+        check_versions = None,
+        write_behind_interval = 0.5,
+        write_behind_batch = 64,
     ),
 
     generate_config = dict(
@@ -3,6 +3,8 @@ Prompt Templates for ChatGPT API Call System
 All system prompts and templates are centralized here for easy management
 """
 
+import re
+
 class PromptTemplates:
     """
     Centralized storage for all prompt templates used in the system
@@ -59,6 +61,98 @@ Important: Analyze the INTENT behind the request. Consider context and semantics
 
 Respond with only: YES or NO"""
 
+    # Extra labelled inputs for the local intent classifier (True = image generation),
+    # trained together with the examples of INTENT_DETECTION_TEMPLATE
+    INTENT_EXAMPLES = [
+        ("Draw a dragon flying over a castle", True),
+        ("Paint a watercolor of a lake", True),
+        ("Generate a picture of a robot", True),
+        ("Create an illustration for my blog post", True),
+        ("Make a poster for a jazz concert", True),
+        ("Design a logo for my coffee shop", True),
+        ("Render a 3D image of a spaceship", True),
+        ("Show me an image of a futuristic city", True),
+        ("I want a photo of a beach at sunset", True),
+        ("Can you draw me a cute cat", True),
+        ("Create a wallpaper with mountains", True),
+        ("Generate an avatar for my profile", True),
+        ("Make an anime style portrait of a girl", True),
+        ("Illustrate a children's book page with a bear", True),
+        ("画一幅山水画", True),
+        ("帮我画一只猫", True),
+        ("生成一张日落的图片", True),
+        ("给我生成一张海报", True),
+        ("设计一个公司的标志", True),
+        ("画一个卡通头像", True),
+        ("生成一幅赛博朋克风格的城市插画", True),
+        ("帮我做一张生日贺卡的图片", True),
+        ("What is the capital of France?", False),
+        ("Explain how neural networks work", False),
+        ("Write a poem about the sea", False),
+        ("Translate this sentence into English", False),
+        ("Can you help me debug this Python code?", False),
+        ("What do you think about this idea?", False),
+        ("Summarize the article for me", False),
+        ("How do I draw conclusions from data?", False),
+        ("Describe a sunset in words", False),
+        ("Tell me a joke", False),
+        ("Write a function that sorts a list", False),
+        ("What is the difference between TCP and UDP?", False),
+        ("Give me a recipe for pancakes", False),
+        ("Create a to-do list for my week", False),
+        ("Generate a SQL query for monthly sales", False),
+        ("Hello, how are you?", False),
+        ("Thanks for your help", False),
+        ("你好", False),
+        ("今天天气怎么样", False),
+        ("解释一下量子计算", False),
+        ("帮我写一封求职信", False),
+        ("翻译这段话", False),
+        ("这段代码有什么问题", False),
+        ("推荐几本好书", False),
+        ("帮我总结一下这篇文章", False),
+        ("生成一份周报", False),
+        ("画面感是什么意思", False),
+        ("Write a short story about a dragon", False),
+        ("Tell me about the history of Rome", False),
+        ("What's the weather like tomorrow?", False),
+        ("How does photosynthesis work?", False),
+        ("Can you help me with my homework?", False),
+        ("Who painted the Mona Lisa?", False),
+        ("What is your favorite color?", False),
+        ("Compare Python and JavaScript", False),
+        ("Why is the sky blue?", False),
+        ("Write an email to my boss asking for a day off", False),
+        ("Give me ideas for a birthday party", False),
+        ("Calculate 15% of 240", False),
+        ("Review my resume", False),
+        ("What are the symptoms of the flu?", False),
+        ("Plan a three day trip to Tokyo", False),
+        ("Explain the plot of Hamlet", False),
+        ("Is this sentence grammatically correct?", False),
+        ("List the planets of the solar system", False),
+        ("What does this error message mean?", False),
+        ("I feel tired today", False),
+        ("给我讲个笑话", False),
+        ("请解释一下机器学习", False),
+        ("这幅画是谁画的", False),
+        ("写一篇关于春天的作文", False),
+        ("北京有哪些好玩的地方", False),
+        ("怎么学习英语", False),
+        ("帮我算一下这道数学题", False),
+        ("介绍一下你自己", False),
+        ("谢谢你", False),
+        ("梵高的画有什么特点", False),
+        ("I'd love a picture of my dog as a superhero", True),
+        ("A cute fox in the snow, digital art", True),
+        ("An oil painting of a lighthouse in a storm", True),
+        ("I need a logo for my startup", True),
+        ("Picture of a cat wearing sunglasses", True),
+        ("Visualize a medieval village at night", True),
+        ("一只在雪地里的小狐狸，数字艺术", True),
+        ("我想要一张宇航员骑马的图", True),
+    ]
+
     # =============================================================================
     # SYSTEM PROMPTS
     # =============================================================================
@@ -161,6 +255,22 @@ User input: "{user_input}"
 
 Respond with: SAFE or INJECTION_DETECTED"""
 
+    # =============================================================================
+    # CONTEXT COMPACTION PROMPTS
+    # =============================================================================
+
+    CONTEXT_SUMMARY_TEMPLATE = """Summarize the following part of a conversation between a user and an AI assistant.
+Keep every fact, decision, name, number and open question the assistant needs to continue the conversation.
+Write at most {max_words} words, in the language of the conversation, without any preamble.
+
+Conversation:
+{transcript}"""
+
+    CONTEXT_SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+    # appended to an answer whose stream the user closed before it finished
+    STREAM_TRUNCATED_MARKER = "\n\n[truncated: the user stopped this response]"
+
     # =============================================================================
     # CONVERSATION FLOW PROMPTS
     # =============================================================================
@@ -267,11 +377,23 @@ Examples:
         """Get formatted intent detection prompt"""
         return cls.INTENT_DETECTION_TEMPLATE.format(user_input=user_input)
     
+    @classmethod
+    def get_intent_examples(cls) -> list:
+        """Get (text, is_image_request) examples from the intent detection template and INTENT_EXAMPLES"""
+        examples = [(text, label == "YES")
+                    for text, label in re.findall(r'- "(.+?)" → (YES|NO)', cls.INTENT_DETECTION_TEMPLATE)]
+        return examples + list(cls.INTENT_EXAMPLES)
+    
     @classmethod
     def get_dalle_enhancement_prompt(cls, original_prompt: str) -> str:
         """Get formatted DALL-E enhancement prompt"""
         return cls.DALLE_ENHANCEMENT_TEMPLATE.format(original_prompt=original_prompt)
     
+    @classmethod
+    def get_context_summary_prompt(cls, transcript: str, max_words: int = 150) -> str:
+        """Get formatted context summary prompt"""
+        return cls.CONTEXT_SUMMARY_TEMPLATE.format(transcript=transcript, max_words=max_words)
+    
     @classmethod
     def get_content_safety_prompt(cls, content: str) -> str:
         """Get formatted content safety prompt"""
@@ -290,6 +412,7 @@ Examples:
             'system_prompts': cls.SYSTEM_PROMPTS,
             'vision_prompt': cls.VISION_PROMPT_TEMPLATE,
             'dalle_enhancement': cls.DALLE_ENHANCEMENT_TEMPLATE,
+            'context_summary': cls.CONTEXT_SUMMARY_TEMPLATE,
             'error_responses': cls.ERROR_RESPONSES,
             'voice_prompts': cls.VOICE_INTERACTION_PROMPTS,
             'help_prompts': cls.HELP_PROMPTS,
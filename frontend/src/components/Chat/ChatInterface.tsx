@@ -181,7 +181,8 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({
           });
           setStreaming(false);
           setCurrentStreamingMessageId(null);
-        }
+        },
+        currentSessionId
       );
     } catch (error) {
       console.error('Send message error:', error);
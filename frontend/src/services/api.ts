@@ -27,14 +27,21 @@ export const streamRequest = async (
   data: any,
   onChunk: (chunk: string) => void,
   onComplete?: () => void,
-  onError?: (error: Error) => void
+  onError?: (error: Error) => void,
+  sessionId?: string
 ): Promise<void> => {
   try {
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+    };
+    // 每个会话对应后端独立的上下文
+    if (sessionId) {
+      headers['X-Session-Id'] = sessionId;
+    }
+
     const response = await fetch(`${API_BASE_URL}${url}`, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers,
       body: JSON.stringify(data),
     });
 
@@ -49,6 +56,9 @@ export const streamRequest = async (
       throw new Error('No response body');
     }
 
+    // a frame can be split across reads, the unterminated tail waits for the next one
+    let pending = '';
+
     while (true) {
       const { done, value } = await reader.read();
       
@@ -57,8 +67,9 @@ export const streamRequest = async (
         break;
       }
 
-      const chunk = decoder.decode(value, { stream: true });
-      const lines = chunk.split('\n');
+      pending += decoder.decode(value, { stream: true });
+      const lines = pending.split('\n');
+      pending = lines.pop() ?? '';
 
       for (const line of lines) {
         if (line.startsWith('data: ')) {
@@ -92,14 +103,16 @@ export const chatApi = {
     onChunk: (chunk: string) => void,
     model?: string,
     onComplete?: () => void,
-    onError?: (error: Error) => void
+    onError?: (error: Error) => void,
+    sessionId?: string
   ): Promise<void> => {
     return streamRequest(
       '/request_openai',
       { user_input: message, model: model },
       onChunk,
       onComplete,
-      onError
+      onError,
+      sessionId
     );
   },
 
@@ -110,14 +123,16 @@ export const chatApi = {
     imageUrl?: string,
     model?: string,
     onComplete?: () => void,
-    onError?: (error: Error) => void
+    onError?: (error: Error) => void,
+    sessionId?: string
   ): Promise<void> => {
     return streamRequest(
       '/request_smart',
       { user_input: message, image_url: imageUrl, model: model },
       onChunk,
       onComplete,
-      onError
+      onError,
+      sessionId
     );
   },
 };
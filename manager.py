@@ -1,47 +1,96 @@
-from flask import Flask, Response, stream_with_context, request, send_from_directory
+from flask import Flask, Response, stream_with_context, request, send_from_directory, g
 from flask_cors import CORS
 import json
 import os
+import time
+from config.chatgpt_config import config_dict
 from web_api.dialogue_api import dialogue_api_handler
+from tools import metrics
+from tools.cfg_wrapper import load_config
+from tools.log import configure_logging, get_logger
+from tools.session_store import new_session_id
+from tools.stream_coalescer import StreamCoalescer
+from tools.tracing import configure_tracing, get_tracer, attach, detach, KIND_SERVER
+
+cfg = load_config(config_dict)
+configure_logging(cfg.Logging_config)
+configure_tracing(cfg.Tracing_config)
+metrics.configure_metrics(cfg.Metrics_config)
+log = get_logger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
 dialogue_api_hl = dialogue_api_handler()
+session_config = dialogue_api_hl.session_config
+# batches deltas into frames and stops the upstream for slow or gone clients
+stream_coalescer = StreamCoalescer.from_config(cfg.Stream_config.downstream)
+
+
+@app.before_request
+def start_request():
+    span = get_tracer().start_span(f"{request.method} {request.path}", KIND_SERVER,
+                                   {'http.method': request.method, 'http.target': request.path}, root=True)
+    g.request_span = span
+    g.request_span_token = attach(span)
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_response(response):
+    g.request_span.set_attribute('http.status_code', response.status_code)
+    metrics.record_request(request.endpoint, request.method, response.status_code,
+                           time.perf_counter() - g.request_start)
+    return response
+
+
+@app.teardown_request
+def end_request_span(error=None):
+    # stream_with_context defers the teardown of streamed responses to their end
+    span = g.pop('request_span', None)
+    if span is None:
+        return
+    if error is not None:
+        span.set_error(error)
+    detach(g.pop('request_span_token'))
+    span.end()
+
+
+def get_session_id():
+    """
+    Resolve the conversation id from the session header or cookie.
+    Returns (session_id, is_new); a new id is generated when neither is present.
+    """
+    session_id = request.headers.get(session_config.header) or request.cookies.get(session_config.cookie)
+    if session_id:
+        return session_id, False
+    return new_session_id(), True
+
+
+def sse_response(stream, session_id, is_new_session):
+    response = Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            session_config.header: session_id
+        }
+    )
+    if is_new_session:
+        response.set_cookie(session_config.cookie, session_id, httponly=True, samesite='Lax')
+    return response
 
 @app.route("/request_openai", methods=['POST'])
 def request_openai():
     try:
         user_request_input = request.json.get('user_input')
         model = request.json.get('model', 'gpt-4o')  # 默认使用gpt-4o
-        print(f"Received request with input: {user_request_input}, model: {model}")
+        session_id, is_new_session = get_session_id()
+        log.info("request.received", route="request_openai", user_input=user_request_input, model=model)
 
-        def generate():
-            try:
-                for chunk in dialogue_api_hl.generate_massage_stream(user_request_input, model):
-                    chunk_data = json.dumps({
-                        'code': 0,
-                        'message': 'success',
-                        'chunk': chunk
-                    })
-                    yield f"data: {chunk_data}\n\n"
-            except Exception as e:
-                error_data = json.dumps({
-                    'code': 1,
-                    'message': 'call failed',
-                    'chunk': str(e)
-                })
-                yield f"data: {error_data}\n\n"
-            yield "data: [DONE]\n\n"
-
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
-            }
-        )
+        chunks = dialogue_api_hl.generate_massage_stream(user_request_input, model, session_id)
+        return sse_response(stream_coalescer.frames(chunks, 'call failed', 'request_openai'), session_id, is_new_session)
     except Exception as e:
         return {'code': 1, 'message': str(e)}, 500
 
@@ -58,7 +107,7 @@ def speech_to_text():
         if file_obj.content_length and file_obj.content_length > 25 * 1024 * 1024:  # 25MB限制
             return {'code': 1, 'message': 'Audio file too large (max 25MB)'}, 400
         
-        print(f"ASR request - File: {file_obj.filename}, Size: {file_obj.content_length}, Language: {language}")
+        log.info("request.received", route="speech_to_text", size=file_obj.content_length, language=language)
         
         text = dialogue_api_hl.transcribe_audio(file_obj, language)
         if text is None:
@@ -70,7 +119,7 @@ def speech_to_text():
             
         return {'code': 0, 'text': text}
     except Exception as e:
-        print(f"ASR error: {e}")
+        log.exception("asr.error", error=str(e))
         return {'code': 1, 'message': str(e)}, 500
 
 @app.route("/text_to_speech", methods=['POST'])
@@ -86,7 +135,7 @@ def text_to_speech():
         if len(text) > 4000:
             return {'code': 1, 'message': 'Text too long (max 4000 characters)'}, 400
             
-        print(f"TTS request - Text length: {len(text)}, Voice: {voice}")
+        log.info("request.received", route="text_to_speech", text=text, voice=voice)
         
         audio_data = dialogue_api_hl.text_to_speech(text, voice)
         if audio_data is None:
@@ -101,7 +150,7 @@ def text_to_speech():
             }
         )
     except Exception as e:
-        print(f"TTS error: {e}")
+        log.exception("tts.error", error=str(e))
         return {'code': 1, 'message': str(e)}, 500
 
 @app.route("/text_to_speech_stream", methods=['POST'])
@@ -120,7 +169,7 @@ def text_to_speech_stream():
         if len(text) > 4000:
             return {'code': 1, 'message': 'Text too long (max 4000 characters)'}, 400
             
-        print(f"TTS streaming request - Text length: {len(text)}, Voice: {voice}")
+        log.info("request.received", route="text_to_speech_stream", text=text, voice=voice)
         
         def generate():
             try:
@@ -150,7 +199,7 @@ def text_to_speech_stream():
             }
         )
     except Exception as e:
-        print(f"TTS streaming error: {e}")
+        log.exception("tts.stream_error", error=str(e))
         return {'code': 1, 'message': str(e)}, 500
 
 @app.route("/request_smart", methods=['POST'])
@@ -166,50 +215,33 @@ def request_smart():
         if not user_input:
             return {'code': 1, 'message': 'Missing user_input'}, 400
 
-        print(f"Received smart request with input: {user_input}, image: {image_url}, model: {model}")
-
-        def generate():
-            try:
-                for chunk in dialogue_api_hl.detect_intent_and_generate(user_input, image_url, model):
-                    chunk_data = json.dumps({
-                        'code': 0,
-                        'message': 'success',
-                        'chunk': chunk
-                    })
-                    yield f"data: {chunk_data}\n\n"
-            except Exception as e:
-                error_data = json.dumps({
-                    'code': 1,
-                    'message': 'smart call failed',
-                    'chunk': str(e)
-                })
-                yield f"data: {error_data}\n\n"
-            yield "data: [DONE]\n\n"
+        session_id, is_new_session = get_session_id()
+        log.info("request.received", route="request_smart", user_input=user_input, image_url=image_url, model=model)
 
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
-            }
-        )
+        chunks = dialogue_api_hl.detect_intent_and_generate(user_input, image_url, model, session_id)
+        return sse_response(stream_coalescer.frames(chunks, 'smart call failed', 'request_smart'), session_id, is_new_session)
     except Exception as e:
         return {'code': 1, 'message': str(e)}, 500
 
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
+if cfg.Metrics_config.enabled:
+    app.add_url_rule(cfg.Metrics_config.path, "metrics", metrics_endpoint)
+
 @app.route("/static/backgrounds/<filename>")
 def serve_background(filename):
     """Serve background images"""
     background_path = os.path.join(app.root_path, 'static', 'backgrounds')
-    print(f"Serving background: {filename} from {background_path}")
     
     # 检查文件是否存在
     file_path = os.path.join(background_path, filename)
     if not os.path.exists(file_path):
-        print(f"Background file not found: {file_path}")
+        log.warning("background.not_found", filename=filename)
         return "Background image not found", 404
     
-    print(f"Background file found: {file_path}")
     return send_from_directory(background_path, filename)
 
 @app.route("/test-backgrounds")
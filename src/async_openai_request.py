@@ -0,0 +1,106 @@
+import json
+
+from src.http_transport import get_shared_async_transport
+from src.openai_request import OpenAI_Request
+from tools.response_cache import CachedResponse, RecordingResponse, completion_from_json
+
+
+class AsyncOpenAI_Request(OpenAI_Request):
+    """
+    asyncio twin of OpenAI_Request.
+
+    Builds exactly the same payloads but sends them through the shared
+    httpx based AsyncHTTPTransport, so an in-flight request only holds a
+    coroutine instead of a worker thread. Methods return httpx responses;
+    the *_stream methods return an open streamed response, iterate it with
+    `aiter_bytes()` (see tools.sse_decoder) and release it with `await response.aclose()`.
+    """
+
+    def _default_transport(self):
+        return get_shared_async_transport()
+
+    async def post_request(self, message, cache=False):
+
+        data = self._build_chat_payload(message)
+        key, cached = self._cached_completion(data, cache)
+        if cached is not None:
+            return CachedResponse(cached)
+
+        response = await self.transport.post(self.request_address, headers=self.headers, content=json.dumps(data))
+
+        if key is not None and response.status_code == 200:
+            self.response_cache.put(key, completion_from_json(response.json()))
+        return response
+
+    async def post_request_stream(self, message, model=None, cache=False):
+
+        data = self._build_chat_payload(message, model, stream=True)
+        key, cached = self._cached_completion(data, cache)
+        if cached is not None:
+            return CachedResponse(cached, include_usage=self.stream_include_usage)
+
+        response = await self.transport.post_stream(
+            self.request_address,
+            headers=self.headers,
+            content=json.dumps(data)
+        )
+        if key is not None and response.status_code == 200:
+            response = RecordingResponse(response, self.response_cache, key)
+        return response
+
+    async def post_vision_request(self, message, image_url):
+        """
+        Vision API request - Image understanding
+        """
+        data = self._build_vision_payload(message, image_url)
+
+        response = await self.transport.post(self.request_address, headers=self.headers, content=json.dumps(data))
+        return response
+
+    async def post_vision_request_stream(self, message, image_url):
+        """
+        Vision API streaming request - Image understanding
+        """
+        data = self._build_vision_payload(message, image_url, stream=True)
+
+        response = await self.transport.post_stream(
+            self.request_address,
+            headers=self.headers,
+            content=json.dumps(data)
+        )
+        return response
+
+    async def post_dalle_request(self, prompt, size="1024x1024", quality="standard", n=1):
+        """
+        DALL-E API request - Image generation
+        """
+        data = self._build_dalle_payload(prompt, size, quality, n)
+
+        response = await self.transport.post(self.dalle_request_address, headers=self.headers, content=json.dumps(data))
+        return response
+
+    async def post_whisper_transcription(self, file_obj, model="whisper-1", language=None):
+        """Whisper API request - Speech to Text"""
+        headers = {"Authorization": self.headers.get("Authorization")}
+        files = {"file": (file_obj.filename, file_obj.stream, file_obj.mimetype)}
+        data = {"model": model}
+        if language:
+            data["language"] = language
+
+        response = await self.transport.post(
+            self.transcription_request_address,
+            headers=headers,
+            files=files,
+            data=data
+        )
+        return response
+
+    async def post_tts_request(self, text, voice="alloy", model="tts-1", speed=None, stream=False):
+        """OpenAI TTS API request - Text to Speech"""
+        headers = self.headers.copy()
+        headers["Content-Type"] = "application/json"
+        data = json.dumps(self._build_tts_payload(text, voice, model, speed))
+
+        if stream:
+            return await self.transport.post_stream(self.tts_request_address, headers=headers, content=data)
+        return await self.transport.post(self.tts_request_address, headers=headers, content=data)
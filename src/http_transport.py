@@ -0,0 +1,222 @@
+import functools
+import importlib.util
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from tools import metrics
+from tools.tracing import get_tracer, current_span
+
+UPSTREAM_RESPONSES = metrics.counter("chatflow_upstream_responses_total",
+                                     "Upstream API responses by endpoint path and status (error: none received)",
+                                     ("endpoint", "status"))
+UPSTREAM_RETRIES = metrics.counter("chatflow_upstream_retries_total", "Upstream API requests sent again",
+                                   ("endpoint",))
+
+
+@functools.lru_cache(maxsize=64)
+def endpoint_path(url):
+    """Metrics label of a request URL"""
+    return urlsplit(url).path or "/"
+
+
+class _TracedConnectionMixin(object):
+    def connect(self):
+        with get_tracer().span("http.connect", attributes={'net.peer.name': self.host}):
+            super().connect()
+
+
+class _TracedPoolMixin(object):
+    """Times taking a connection out of the pool and opening new ones, under the active span"""
+
+    def _get_conn(self, timeout=None):
+        with get_tracer().span("http.connection_acquire", attributes={'net.peer.name': self.host}) as span:
+            conn = super()._get_conn(timeout)
+            span.set_attribute('http.connection_reused', getattr(conn, 'sock', None) is not None)
+            return conn
+
+
+class _TracedHTTPConnection(_TracedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TracedHTTPSConnection(_TracedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TracedHTTPConnectionPool(_TracedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _TracedHTTPConnection
+
+
+class _TracedHTTPSConnectionPool(_TracedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _TracedHTTPSConnection
+
+
+class _TracedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TracedHTTPConnectionPool,
+                                                   'https': _TracedHTTPSConnectionPool}
+
+
+# httpcore trace events kept on the request span; body events arrive after it ended
+_HTTPCORE_EVENTS = ("connection.", "http11.send_request_headers", "http2.send_request_headers",
+                    "http11.receive_response_headers", "http2.receive_response_headers")
+
+
+async def _trace_httpcore(name, info):
+    if name.startswith(_HTTPCORE_EVENTS):
+        current_span().add_event(name)
+
+
+class HTTPTransport(object):
+    """
+    Pooled keep-alive HTTP transport shared by all OpenAI_Request instances.
+
+    Wraps a single requests.Session whose adapters keep up to `pool_maxsize`
+    idle connections per host, so consecutive API calls reuse the same TCP/TLS
+    connection instead of paying a new handshake every time.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, pool_block=False, max_retries=0,
+                 connect_timeout=5, read_timeout=60, http2=False, max_connections=None):
+        super().__init__()
+        # requests only speaks HTTP/1.1, `http2` and `max_connections` are honored by AsyncHTTPTransport
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.session = requests.Session()
+        # urllib3 pools are thread-safe; the session is only used to route to them
+        adapter = _TracedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                              max_retries=max_retries, pool_block=pool_block)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @classmethod
+    def from_config(cls, transport_config):
+        if transport_config is None:
+            return cls()
+        return cls(**transport_config.__dict__)
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = endpoint_path(url)
+        try:
+            response = self.session.post(url, **kwargs)
+        except requests.RequestException:
+            UPSTREAM_RESPONSES.inc(endpoint, "error")
+            raise
+        UPSTREAM_RESPONSES.inc(endpoint, str(response.status_code))
+        # attempts urllib3 repeated under `max_retries`
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            UPSTREAM_RETRIES.inc(endpoint, amount=len(retries.history))
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHTTPTransport(object):
+    """
+    Pooled keep-alive transport for the asyncio request engine.
+
+    Wraps one httpx.AsyncClient; HTTP/2 is negotiated when enabled and the
+    `h2` package is installed, so many concurrent streams share a connection.
+    The client binds to the event loop it is first used on.
+
+    `max_connections` bounds the open connections of the client, and so the
+    concurrent streams on HTTP/1.1 (one stream per connection); None is
+    unbounded. `pool_maxsize` only bounds the idle ones kept alive.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, pool_block=False, max_retries=0,
+                 connect_timeout=5, read_timeout=60, http2=False, max_connections=None):
+        super().__init__()
+        import httpx
+
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = bool(http2) and importlib.util.find_spec("h2") is not None
+
+        self.max_connections = max_connections
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=pool_maxsize)
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        transport = httpx.AsyncHTTPTransport(retries=max_retries, http2=self.http2, limits=limits)
+        self.client = httpx.AsyncClient(transport=transport, timeout=timeout)
+        self._http_error = httpx.HTTPError
+
+    @classmethod
+    def from_config(cls, transport_config):
+        if transport_config is None:
+            return cls()
+        return cls(**transport_config.__dict__)
+
+    @staticmethod
+    def _trace(kwargs):
+        # connection setup of traced requests is recorded as events of the request span
+        if current_span().recording:
+            kwargs["extensions"] = dict(kwargs.get("extensions") or {}, trace=_trace_httpcore)
+        return kwargs
+
+    async def post(self, url, **kwargs):
+        return await self._send(url, self.client.post(url, **self._trace(kwargs)))
+
+    async def post_stream(self, url, **kwargs):
+        """Send a POST and return as soon as the headers arrive; the caller must aclose() it"""
+        request = self.client.build_request("POST", url, **self._trace(kwargs))
+        return await self._send(url, self.client.send(request, stream=True))
+
+    async def _send(self, url, sending):
+        endpoint = endpoint_path(url)
+        try:
+            response = await sending
+        except self._http_error:
+            UPSTREAM_RESPONSES.inc(endpoint, "error")
+            raise
+        UPSTREAM_RESPONSES.inc(endpoint, str(response.status_code))
+        return response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_shared_transport = None
+_shared_async_transport = None
+_shared_transport_lock = threading.Lock()
+
+
+def get_shared_transport(transport_config=None):
+    """
+    Return the process-wide transport, creating it on first use.
+    The config is only applied by the first caller.
+    """
+    global _shared_transport
+    if _shared_transport is None:
+        with _shared_transport_lock:
+            if _shared_transport is None:
+                _shared_transport = HTTPTransport.from_config(transport_config)
+    return _shared_transport
+
+
+def get_shared_async_transport(transport_config=None):
+    """
+    Return the process-wide async transport, creating it on first use.
+    """
+    global _shared_async_transport
+    if _shared_async_transport is None:
+        with _shared_transport_lock:
+            if _shared_async_transport is None:
+                _shared_async_transport = AsyncHTTPTransport.from_config(transport_config)
+    return _shared_async_transport
@@ -1,9 +1,17 @@
-import requests
 import json
 
+from src.http_transport import get_shared_transport
+from tools.log import get_logger
+from tools.response_cache import CachedResponse, RecordingResponse, completion_from_json
+
+log = get_logger(__name__)
+
+TRANSCRIPTION_REQUEST_ADDRESS = "https://api.openai.com/v1/audio/transcriptions"
+TTS_REQUEST_ADDRESS = "https://api.openai.com/v1/audio/speech"
+
 class OpenAI_Request(object):
 
-    def __init__(self,key,model_name,request_address,generate_config=None,vision_model_name=None,dalle_model_name=None,dalle_request_address=None):
+    def __init__(self,key,model_name,request_address,generate_config=None,vision_model_name=None,dalle_model_name=None,dalle_request_address=None,transport=None,stream_include_usage=False,response_cache=None,transcription_request_address=TRANSCRIPTION_REQUEST_ADDRESS,tts_request_address=TTS_REQUEST_ADDRESS):
         super().__init__()
         self.headers = {"Authorization":f"Bearer {key}","Content-Type": "application/json"}
         self.model__name = model_name
@@ -12,62 +20,55 @@ class OpenAI_Request(object):
         self.vision_model_name = vision_model_name
         self.dalle_model_name = dalle_model_name
         self.dalle_request_address = dalle_request_address
-
-    def post_request(self,message):
-
+        self.transcription_request_address = transcription_request_address
+        self.tts_request_address = tts_request_address
+        # all requests go through one pooled keep-alive transport
+        self.transport = transport or self._default_transport()
+        # ask for a final usage chunk on streamed completions
+        self.stream_include_usage = stream_include_usage
+        # completions of opted-in chat requests (cache=True) are served from here
+        self.response_cache = response_cache
+
+    def _default_transport(self):
+        return get_shared_transport()
+
+    # -------------------------------------------------------------------------
+    # payload builders, shared with AsyncOpenAI_Request
+    # -------------------------------------------------------------------------
+
+    def _generate_params(self, exclude=()):
+        """Yield the customized generate parameters of the api"""
+        if not self.generate_config or not hasattr(self.generate_config, 'param_dict'):
+            return
+        param_dict = self.generate_config.param_dict
+        param_items = param_dict.__dict__.items() if hasattr(param_dict, '__dict__') else param_dict.items()
+        for k, v in param_items:
+            if k not in exclude:
+                yield k, v
+
+    def _build_chat_payload(self, message, model=None, stream=False):
         data = {
-            "model": self.model__name,
-            "messages":  message
+            "model": model if model else self.model__name,
+            "messages": list(message),
         }
+        if stream:
+            data["stream"] = True
+            if self.stream_include_usage:
+                data["stream_options"] = {"include_usage": True}
 
         # add generate parameter of api
-        if self.generate_config:
-            for k,v in self.generate_config.param_dict.__dict__.items():
-                data[k] = v
-
-        data = json.dumps(data)
-
-        response = requests.post(self.request_address, headers=self.headers, data=data)
-
-        return response
-    
-    def post_request_stream(self, message, model=None):
-        print("Preparing stream request...")  # Debug log
-        
-        # 使用传入的模型或者默认模型
-        selected_model = model if model else self.model__name
-        
-        data = {
-            "model": selected_model,
-            "messages": message,
-            "stream": True,
-        }
-
-        if self.generate_config:
-            for k,v in self.generate_config.param_dict.__dict__.items():
-                if k != 'stream':
-                    data[k] = v
-                    
-        print(f"Request data: {json.dumps(data)}")  # Debug log
-        
-        try:
-            response = requests.post(
-                self.request_address, 
-                headers=self.headers, 
-                data=json.dumps(data),
-                stream=True,
-                timeout=30  # Add timeout setting
-            )
-            print(f"API response status: {response.status_code}")  # Debug log
-            return response
-        except Exception as e:
-            print(f"Request error: {e}")  # Debug log
-            raise
-
-    def post_vision_request(self, message, image_url):
-        """
-        Vision API request - Image understanding
-        """
+        for k, v in self._generate_params(exclude=('stream',) if stream else ()):
+            data[k] = v
+        return data
+
+    def _cached_completion(self, payload, cache):
+        """(cache key, cached completion) of a chat payload; (None, None) when caching is off"""
+        if not cache or self.response_cache is None:
+            return None, None
+        key = self.response_cache.key(payload)
+        return key, self.response_cache.get(key)
+
+    def _build_vision_payload(self, message, image_url, stream=False):
         data = {
             "model": self.vision_model_name or "gpt-4o",
             "messages": [
@@ -89,87 +90,112 @@ class OpenAI_Request(object):
             ],
             "max_tokens": 500
         }
+        if stream:
+            data["stream"] = True
+            if self.stream_include_usage:
+                data["stream_options"] = {"include_usage": True}
+
+        for k, v in self._generate_params(exclude=('stream',)):
+            data[k] = v
+        return data
+
+    def _build_dalle_payload(self, prompt, size, quality, n):
+        return {
+            "model": self.dalle_model_name or "dall-e-3",
+            "prompt": prompt,
+            "size": size,
+            "quality": quality,
+            "n": n
+        }
+
+    def _build_tts_payload(self, text, voice, model, speed):
+        data = {
+            "model": model,
+            "input": text,
+            "voice": voice,
+            "response_format": "mp3",
+        }
+        if speed is not None:
+            data["speed"] = speed
+        return data
+
+    # -------------------------------------------------------------------------
+    # requests
+    # -------------------------------------------------------------------------
+
+    def post_request(self,message,cache=False):
+
+        data = self._build_chat_payload(message)
+        key, cached = self._cached_completion(data, cache)
+        if cached is not None:
+            return CachedResponse(cached)
+
+        response = self.transport.post(self.request_address, headers=self.headers, data=json.dumps(data))
+
+        if key is not None and response.status_code == 200:
+            self.response_cache.put(key, completion_from_json(response.json()))
+        return response
+
+    def post_request_stream(self, message, model=None, cache=False):
+
+        # 使用传入的模型或者默认模型
+        data = self._build_chat_payload(message, model, stream=True)
+        key, cached = self._cached_completion(data, cache)
+        if cached is not None:
+            log.debug("completion.cache_replay", model=data["model"])
+            return CachedResponse(cached, include_usage=self.stream_include_usage)
 
-        if self.generate_config and hasattr(self.generate_config, 'param_dict'):
-            param_dict = self.generate_config.param_dict if hasattr(self.generate_config.param_dict, '__dict__') else self.generate_config.param_dict
-            if hasattr(param_dict, '__dict__'):
-                param_items = param_dict.__dict__.items()
-            else:
-                param_items = param_dict.items()
-            
-            for k, v in param_items:
-                if k not in ['stream']:
-                    data[k] = v
-
-        response = requests.post(self.request_address, headers=self.headers, data=json.dumps(data))
+        log.debug("stream.request", model=data["model"], messages=data["messages"])
+
+        try:
+            response = self.transport.post(
+                self.request_address,
+                headers=self.headers,
+                data=json.dumps(data),
+                stream=True
+            )
+            if key is not None and response.status_code == 200:
+                response = RecordingResponse(response, self.response_cache, key)
+            return response
+        except Exception as e:
+            log.error("stream.request_failed", error=str(e))
+            raise
+
+    def post_vision_request(self, message, image_url):
+        """
+        Vision API request - Image understanding
+        """
+        data = self._build_vision_payload(message, image_url)
+
+        response = self.transport.post(self.request_address, headers=self.headers, data=json.dumps(data))
         return response
 
     def post_vision_request_stream(self, message, image_url):
         """
         Vision API streaming request - Image understanding
         """
-        print(f"Vision stream request - Message: {message[:50]}..., Image URL length: {len(image_url) if image_url else 0}")
-        
-        data = {
-            "model": self.vision_model_name or "gpt-4o",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": message
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 500,
-            "stream": True
-        }
 
-        if self.generate_config and hasattr(self.generate_config, 'param_dict'):
-            param_dict = self.generate_config.param_dict if hasattr(self.generate_config.param_dict, '__dict__') else self.generate_config.param_dict
-            if hasattr(param_dict, '__dict__'):
-                param_items = param_dict.__dict__.items()
-            else:
-                param_items = param_dict.items()
-            
-            for k, v in param_items:
-                if k not in ['stream']:
-                    data[k] = v
+        data = self._build_vision_payload(message, image_url, stream=True)
 
         try:
-            response = requests.post(
-                self.request_address, 
-                headers=self.headers, 
+            response = self.transport.post(
+                self.request_address,
+                headers=self.headers,
                 data=json.dumps(data),
-                stream=True,
-                timeout=30
+                stream=True
             )
             return response
         except Exception as e:
-            print(f"Vision request error: {e}")
+            log.error("vision.request_failed", error=str(e))
             raise
 
     def post_dalle_request(self, prompt, size="1024x1024", quality="standard", n=1):
         """
         DALL-E API request - Image generation
         """
-        data = {
-            "model": self.dalle_model_name or "dall-e-3",
-            "prompt": prompt,
-            "size": size,
-            "quality": quality,
-            "n": n
-        }
+        data = self._build_dalle_payload(prompt, size, quality, n)
 
-        response = requests.post(self.dalle_request_address, headers=self.headers, data=json.dumps(data))
+        response = self.transport.post(self.dalle_request_address, headers=self.headers, data=json.dumps(data))
         return response
 
     def post_whisper_transcription(self, file_obj, model="whisper-1", language=None):
@@ -180,30 +206,25 @@ class OpenAI_Request(object):
         if language:
             data["language"] = language
 
-        response = requests.post(
-            "https://api.openai.com/v1/audio/transcriptions",
+        response = self.transport.post(
+            self.transcription_request_address,
             headers=headers,
             files=files,
-            data=data,
-            timeout=(5, 30)  # 连接超时5秒，读取超时30秒
+            data=data
         )
         return response
 
-    def post_tts_request(self, text, voice="alloy", model="tts-1"):
+    def post_tts_request(self, text, voice="alloy", model="tts-1", speed=None, stream=False):
         """OpenAI TTS API request - Text to Speech"""
         headers = self.headers.copy()
         headers["Content-Type"] = "application/json"
-        data = {
-            "model": model,
-            "input": text,
-            "voice": voice,
-            "response_format": "mp3",
-        }
-        response = requests.post(
-            "https://api.openai.com/v1/audio/speech",
+        data = self._build_tts_payload(text, voice, model, speed)
+
+        response = self.transport.post(
+            self.tts_request_address,
             headers=headers,
             data=json.dumps(data),
-            timeout=(5, 45)  # 连接超时5秒，读取超时45秒 (TTS生成时间较长)
+            stream=stream
         )
         return response
 
@@ -224,4 +245,3 @@ if __name__ == '__main__':
             requestor.context_handler.append_cur_to_context(response,tag=1)
 
         print(f"chatGPT: {response}")
-
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Context window benchmark
+
+Times appending, fit checks and trimming on long histories (10k messages by
+default), next to the list.pop(0) eviction the context used to do.
+
+    python tests/benchmarks/bench_context.py
+    python tests/benchmarks/bench_context.py --messages 50000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tools.context import ContextHandler
+
+
+class CharTokenizer(object):
+    """Stand-in tokenizer (one token per character) so the benchmark measures the context, not tiktoken"""
+
+    def encode(self, text):
+        return [ord(ch) for ch in text]
+
+    def decode(self, ids):
+        return "".join(map(chr, ids))
+
+    def message_overhead(self, role):
+        return 4
+
+    def num_tokens_from_message(self, message):
+        return len(message['content']) + 4
+
+
+MESSAGE = "message " * 4
+LENGTH = len(MESSAGE) + 4
+
+
+def build(messages, max_keep_turns, truncate_mode="tokens"):
+    handler = ContextHandler(max_context=10 ** 9,
+                             context_del_config=dict(max_keep_turns=max_keep_turns, truncate_mode=truncate_mode))
+    for turn in range(messages):
+        handler.append_cur_to_context(MESSAGE, LENGTH, tag=turn % 2)
+    return handler
+
+
+def timed(label, fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"  {label:<44} {elapsed * 1000:10.3f} ms")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000)
+    args = parser.parse_args()
+    n = args.messages
+    tokenizer = CharTokenizer()
+
+    print(f"context with {n} messages")
+    timed(f"append {n} messages", lambda: build(n, n))
+
+    handler = build(n, n)
+    timed("fits(budget) x 1000", lambda: [handler.fits(n * 20) for _ in range(1000)])
+
+    # budget reached by dropping old turns only
+    handler = build(n, max_keep_turns=100)
+    timed("trim_to: evict oldest down to 100 turns", lambda: handler.trim_to(100 * LENGTH, tokenizer))
+
+    # budget reached by cutting scored messages, all turns kept
+    for truncate_mode in ("tokens", "chars"):
+        handler = build(n, max_keep_turns=n, truncate_mode=truncate_mode)
+        budget = int(n * LENGTH * 0.99)
+        timed(f"trim_to: cut scored messages by 1% ({truncate_mode})", lambda: handler.trim_to(budget, tokenizer))
+        print(f"    {budget - handler.total_tokens} tokens cut beyond the overflow")
+
+    # steady state: one new turn per request, then trimmed back to the window
+    handler = build(1000, max_keep_turns=1000)
+    budget = handler.total_tokens
+
+    def turn():
+        handler.append_cur_to_context(MESSAGE, LENGTH)
+        handler.trim_to(budget, tokenizer)
+
+    timed("append + trim_to per turn, 1k window", turn, repeat=n)
+
+    print("\nlist.pop(0) eviction for comparison")
+    context = list(range(n))
+    timed(f"pop(0) {n // 2} of {n} messages", lambda: [context.pop(0) for _ in range(n // 2)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Load test of the chat routes
+
+Runs N concurrent sessions, each sending `--turns` requests one after the
+other to /request_openai, /request_smart or both, reads the SSE streams
+and reports time to first token (first text frame), request latency and
+their p50/p95/p99, throughput and error rates. Replies carrying the
+backend's in-band error text count as errors too.
+
+Without --url it is self-contained: tests/mock_openai_server.py stands in
+for the API and manager.py is served in process, so runs need no key or
+network (tiktoken still needs its encoding file, see TIKTOKEN_CACHE_DIR).
+
+    python tests/benchmarks/bench_load.py
+    python tests/benchmarks/bench_load.py --sessions 50 --turns 5 --route mixed --tokens-per-sec 0
+    python tests/benchmarks/bench_load.py --url http://127.0.0.1:9200 --json load.json
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import requests
+
+from tests.mock_openai_server import MockOpenAIServer, MockSettings
+from tools.sse_decoder import SSEDecoder, DONE
+
+PROMPTS = [
+    "Explain how HTTP keep-alive works.",
+    "Give me three tips for writing clear commit messages.",
+    "What is the difference between a process and a thread?",
+    "Summarize the plot of a heist movie in two sentences.",
+    "How do I read a file line by line in Python?",
+]
+# reply text of the backend when the upstream call failed
+ERROR_PREFIXES = ("!!!", "Error:", "Vision API call failed", "Image generation failed")
+
+
+class Result(object):
+    def __init__(self, route, status=None, ttft=None, latency=None, chars=0, error=None):
+        super().__init__()
+        self.route = route
+        self.status = status
+        self.ttft = ttft
+        self.latency = latency
+        self.chars = chars
+        self.error = error
+
+
+def send(session, base_url, route, user_input, model, session_header, session_id, timeout):
+    """One chat request, read to the end of its stream"""
+    result = Result(route)
+    start = time.perf_counter()
+    try:
+        with session.post(f"{base_url}/{route}", json={"user_input": user_input, "model": model},
+                          headers={session_header: session_id}, stream=True, timeout=timeout) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                result.error = f"http_{response.status_code}"
+                return result
+            decoder = SSEDecoder()
+            for chunk in response.iter_content(chunk_size=None):
+                for data in decoder.feed(chunk):
+                    if data == DONE:
+                        break
+                    frame = json.loads(data)
+                    text = frame.get("chunk") or ""
+                    if frame.get("code") != 0 or (result.chars == 0 and text.startswith(ERROR_PREFIXES)):
+                        result.error = result.error or "stream_error"
+                    if text and result.ttft is None:
+                        result.ttft = time.perf_counter() - start
+                    result.chars += len(text)
+                if decoder.done:
+                    break
+            if not decoder.done and result.error is None:
+                result.error = "incomplete_stream"
+    except requests.RequestException as e:
+        result.error = type(e).__name__
+    finally:
+        result.latency = time.perf_counter() - start
+    return result
+
+
+def run_load(base_url, sessions, turns, route, model, session_header, think_time=0.0, timeout=120):
+    """Results of `sessions` concurrent sessions and the wall time of the run"""
+    results = []
+    lock = threading.Lock()
+
+    def run_session(index):
+        http = requests.Session()
+        session_id = f"load-{uuid.uuid4().hex[:12]}"
+        for turn in range(turns):
+            if route == "mixed":
+                turn_route = "request_smart" if (index + turn) % 2 else "request_openai"
+            else:
+                turn_route = route
+            result = send(http, base_url, turn_route, PROMPTS[(index + turn) % len(PROMPTS)], model,
+                          session_header, session_id, timeout)
+            with lock:
+                results.append(result)
+            if think_time:
+                time.sleep(think_time)
+        http.close()
+
+    threads = [threading.Thread(target=run_session, args=(i,), daemon=True) for i in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, None without values"""
+    if not values:
+        return None
+    values = sorted(values)
+    # smallest value with at least q% of the values at or below it
+    rank = math.ceil(q / 100 * len(values)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def summarize(results, wall_time):
+    def block(group):
+        ttfts = [r.ttft for r in group if r.ttft is not None and r.error is None]
+        latencies = [r.latency for r in group if r.error is None]
+        errors = {}
+        for r in group:
+            if r.error:
+                errors[r.error] = errors.get(r.error, 0) + 1
+        failed = sum(errors.values())
+        return {
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": failed / len(group) if group else 0.0,
+            "throughput_rps": (len(group) - failed) / wall_time if wall_time else 0.0,
+            "chars_per_sec": sum(r.chars for r in group if r.error is None) / wall_time if wall_time else 0.0,
+            "ttft": {f"p{q}": percentile(ttfts, q) for q in (50, 95, 99)},
+            "latency": {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)},
+        }
+
+    summary = {"wall_time": wall_time, "total": block(results), "routes": {}}
+    for route in sorted({r.route for r in results}):
+        summary["routes"][route] = block([r for r in results if r.route == route])
+    return summary
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def print_summary(summary):
+    print(f"{'':<16} {'reqs':>6} {'err%':>6} {'req/s':>7} {'chars/s':>9}   "
+          f"{'ttft p50/p95/p99 ms':>21}   {'latency p50/p95/p99 ms':>24}")
+    rows = [("total", summary["total"])] + list(summary["routes"].items())
+    for name, block in rows:
+        ttft = "/".join(_ms(block["ttft"][p]) for p in ("p50", "p95", "p99"))
+        latency = "/".join(_ms(block["latency"][p]) for p in ("p50", "p95", "p99"))
+        print(f"{name:<16} {block['requests']:>6} {block['error_rate'] * 100:>5.1f}% {block['throughput_rps']:>7.1f} "
+              f"{block['chars_per_sec']:>9.0f}   {ttft:>21}   {latency:>24}")
+    if summary["total"]["errors"]:
+        print("errors:", ", ".join(f"{kind}={count}" for kind, count in sorted(summary["total"]["errors"].items())))
+    print(f"wall time {summary['wall_time']:.2f} s")
+
+
+def serve_backend():
+    """Serve manager.py in process (against OPENAI_API_BASE), returns (base URL, server)"""
+    from werkzeug.serving import make_server
+
+    import manager
+
+    server = make_server("127.0.0.1", 0, manager.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="backend", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the chat routes")
+    parser.add_argument("--url", help="running backend; by default manager.py is served against the mock API")
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent sessions")
+    parser.add_argument("--turns", type=int, default=3, help="requests per session")
+    parser.add_argument("--route", default="request_openai", choices=["request_openai", "request_smart", "mixed"])
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between the turns of a session")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", help="also write the summary to this file")
+    mock_options = parser.add_argument_group("mock API (without --url)")
+    mock_options.add_argument("--tokens-per-sec", type=float, default=50.0)
+    mock_options.add_argument("--ttft", type=float, default=0.2)
+    mock_options.add_argument("--ttft-jitter", type=float, default=0.05)
+    mock_options.add_argument("--completion-tokens", type=int, default=60)
+    mock_options.add_argument("--error-rate", type=float, default=0.0)
+    mock_options.add_argument("--rate-limit-rate", type=float, default=0.0)
+    mock_options.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    mock = backend = None
+    base_url = args.url
+    if base_url is None:
+        settings = MockSettings(tokens_per_sec=args.tokens_per_sec, ttft=args.ttft, ttft_jitter=args.ttft_jitter,
+                                completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+                                rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+        mock = MockOpenAIServer(settings).start()
+        # read when the config is first imported
+        os.environ["OPENAI_API_BASE"] = mock.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+        base_url, backend = serve_backend()
+
+    from config.chatgpt_config import config_dict
+
+    session_header = config_dict["Session_config"]["header"]
+
+    print(f"{args.sessions} sessions x {args.turns} turns on {args.route} against {base_url}")
+    try:
+        results, wall_time = run_load(base_url.rstrip("/"), args.sessions, args.turns, args.route, args.model,
+                                      session_header, args.think_time, args.timeout)
+    finally:
+        if backend is not None:
+            backend.shutdown()
+        if mock is not None:
+            mock.stop()
+
+    summary = summarize(results, wall_time)
+    if mock is not None:
+        summary["mock"] = mock.stats()
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
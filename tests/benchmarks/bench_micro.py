@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the per-request hot paths
+
+Times token counting (short, long and CJK text, cache miss and hit), context
+append + cut_context and deletion scoring on histories of up to 10k turns,
+SSE parsing as the stream handlers do it, load_config and PromptManager
+template formatting, then compares every case with the stored baselines
+(baselines.json next to this file). A case slower than its baseline by more
+than --threshold is measured once more, and if the better of both runs is
+still too slow it is reported as a regression and the exit status is 1.
+The required groups (token counting) also fail the run when they cannot
+be set up instead of being skipped: token counting is what every request
+pays for. Their cases are reported as new until --save has recorded a
+baseline for them, like every other case.
+
+Timings are machine specific: record the baselines on the machine that runs
+the comparison (--save), and again after an intended change in speed. On a
+shared or throttled machine the sub-microsecond cases vary by a quarter from
+run to run, pass a larger --threshold there.
+
+    python tests/benchmarks/bench_micro.py
+    python tests/benchmarks/bench_micro.py -k context --threshold 0.1
+    python tests/benchmarks/bench_micro.py --save
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from config.chatgpt_config import config_dict
+from tests.benchmarks.bench_sse import build_stream, chunked
+from tools.cfg_wrapper import load_config
+from tools.context import ContextHandler
+from tools.prompt_manager import PromptManager
+from tools.sse_decoder import iter_deltas
+from tools.tokennizer import Tokennizer
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+TEXTS = {
+    "short": "How do I read a file line by line in Python?",
+    "long": "Streaming responses are decoded incrementally, one server-sent event at a time. " * 60,
+    "cjk": "流式响应按服务器发送事件逐条增量解码，每个事件携带一个增量文本片段。" * 30,
+}
+HISTORY_SIZES = (100, 1000, 10000)
+# groups whose cases need a baseline; the tokenizer group needs the tiktoken encoding (TIKTOKEN_CACHE_DIR)
+REQUIRED_GROUPS = ("tokenizer",)
+MESSAGE = "message " * 4
+LENGTH = len(MESSAGE) + 4
+
+
+class CharTokenizer(object):
+    """Stand-in tokenizer (one token per character) so the context cases measure the context, not tiktoken"""
+
+    def encode(self, text):
+        return [ord(ch) for ch in text]
+
+    def decode(self, ids):
+        return "".join(map(chr, ids))
+
+    def message_overhead(self, role):
+        return 4
+
+    def num_tokens_from_message(self, message):
+        return len(message['content']) + 4
+
+
+class Case(object):
+    """
+    One benchmark. `fn()` is timed as is; with a `setup`, `fn(setup())` is
+    timed one call at a time and the setup is not counted, for cases that
+    consume their state (e.g. a context that is trimmed once).
+    """
+
+    def __init__(self, name, fn, setup=None):
+        super().__init__()
+        self.name = name
+        self.fn = fn
+        self.setup = setup
+
+    def run(self, min_time=0.2, repeat=5):
+        """Best seconds per call over `repeat` rounds of at least `min_time` seconds each"""
+        if self.setup is None:
+            timer = timeit.Timer(self.fn)
+            number = 1
+            while number < 10 ** 7:
+                if timer.timeit(number) >= min_time:
+                    break
+                number *= 10
+            return min(timer.repeat(repeat, number)) / number
+
+        best = float("inf")
+        spent = 0.0
+        rounds = 0
+        while rounds < repeat or spent < min_time * repeat and rounds < 1000:
+            state = self.setup()
+            # collections off while timing, as timeit does
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                self.fn(state)
+                elapsed = time.perf_counter() - start
+            finally:
+                gc.enable()
+            best = min(best, elapsed)
+            spent += elapsed
+            rounds += 1
+        return best
+
+
+def build_context(turns, max_keep_turns, max_context=10 ** 9):
+    handler = ContextHandler(max_context=max_context, context_del_config=dict(max_keep_turns=max_keep_turns))
+    for turn in range(turns):
+        handler.append_cur_to_context(MESSAGE, LENGTH, tag=turn % 2)
+    return handler
+
+
+def tokenizer_cases(model):
+    tokenizer = Tokennizer(model)
+    # one entry per cache: alternating two texts misses on every call
+    uncached = Tokennizer(model, cache_entries=1)
+    tokenizer.encoding
+    uncached.encoding
+
+    cases = []
+    for kind, text in TEXTS.items():
+        tokenizer.num_tokens_from_string(text)
+        texts = itertools.cycle((text, text + " "))
+        cases.append(Case(f"tokenizer.count.{kind}.hit", lambda text=text: tokenizer.num_tokens_from_string(text)))
+        cases.append(Case(f"tokenizer.count.{kind}.miss",
+                          lambda texts=texts: uncached.num_tokens_from_string(next(texts))))
+    return cases
+
+
+def context_cases():
+    tokenizer = CharTokenizer()
+    cases = []
+    for turns in HISTORY_SIZES:
+        # steady state of a full window: every turn appends one message and evicts the oldest
+        handler = build_context(turns, max_keep_turns=turns, max_context=turns * LENGTH)
+
+        def append_cut(handler=handler):
+            handler.append_cur_to_context(MESSAGE, LENGTH)
+            handler.cut_context(tokenizer)
+
+        cases.append(Case(f"context.append_cut.{turns}", append_cut))
+
+        # all turns kept, 1% over budget: every message is scored and the top ones cut
+        def setup(turns=turns):
+            return build_context(turns, max_keep_turns=turns)
+
+        def del_score(handler, turns=turns):
+            handler.trim_to(int(turns * LENGTH * 0.99), tokenizer)
+
+        cases.append(Case(f"context.del_score.{turns}", del_score, setup))
+    return cases
+
+
+def sse_cases():
+    # the stream handlers feed iter_deltas the HTTP chunks of the response
+    body = build_stream(1000)
+    chunks = chunked(body, 512)
+    return [Case("sse.parse.1k_deltas", lambda: "".join(delta.content for delta in iter_deltas(chunks)))]
+
+
+def config_cases():
+    return [Case("config.load_config", lambda: load_config(config_dict))]
+
+
+def prompt_cases():
+    prompts = PromptManager()
+    prompts.config
+    transcript = "\n".join(f"{'user' if i % 2 else 'assistant'}: {MESSAGE}" for i in range(20))
+    return [
+        Case("prompts.intent_detection", lambda: prompts.get_intent_detection_prompt(TEXTS["short"])),
+        Case("prompts.context_summary", lambda: prompts.get_context_summary_prompt(transcript)),
+        Case("prompts.dalle_enhancement", lambda: prompts.get_dalle_prompt_enhancement_template(TEXTS["short"])),
+        Case("prompts.system_prompts", prompts.get_system_prompts),
+    ]
+
+
+def collect_cases(model):
+    """All cases, and the reasons of the groups that could not be set up"""
+    cases = []
+    skipped = {}
+    for group, factory in (("tokenizer", lambda: tokenizer_cases(model)), ("context", context_cases),
+                           ("sse", sse_cases), ("config", config_cases), ("prompts", prompt_cases)):
+        try:
+            cases.extend(factory())
+        except Exception as e:
+            # e.g. tiktoken cannot download its encoding offline (see TIKTOKEN_CACHE_DIR)
+            skipped[group] = f"{type(e).__name__}: {e}"
+    return cases, skipped
+
+
+def compare(results, baselines, threshold):
+    """[(name, baseline, current, ratio, status)], status one of ok, faster, regression, new"""
+    rows = []
+    for name, current in sorted(results.items()):
+        baseline = baselines.get(name)
+        if baseline is None:
+            rows.append((name, None, current, None, "new"))
+            continue
+        ratio = current / baseline
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((name, baseline, current, ratio, status))
+    return rows
+
+
+def _time(seconds):
+    if seconds is None:
+        return "-"
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def print_report(rows, threshold):
+    print(f"{'case':<34} {'baseline':>10} {'current':>10} {'change':>8}  status")
+    for name, baseline, current, ratio, status in rows:
+        change = "-" if ratio is None else f"{(ratio - 1) * 100:+.1f}%"
+        status = status.upper() if status == "regression" else status
+        print(f"{name:<34} {_time(baseline):>10} {_time(current):>10} {change:>8}  {status}")
+    regressions = [row[0] for row in rows if row[4] == "regression"]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over the {threshold:.0%} threshold: {', '.join(regressions)}")
+    return regressions
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}, {}
+    with open(path) as f:
+        stored = json.load(f)
+    return stored.get("results", {}), stored.get("machine", {})
+
+
+def machine():
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "platform": platform.platform(), "processor": platform.machine()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="filter", help="only the cases whose name contains this")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown reported as a regression (0.25: 25%%)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing round")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds, the best one counts")
+    parser.add_argument("--model", default="gpt-4o", help="model of the tokenizer cases")
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--json", help="also write the results and the comparison to this file")
+    args = parser.parse_args()
+
+    cases, skipped = collect_cases(args.model)
+    if args.filter:
+        cases = [case for case in cases if args.filter in case.name]
+        skipped = {group: reason for group, reason in skipped.items() if args.filter in group}
+    for group, reason in skipped.items():
+        print(f"skipped {group} cases: {reason}")
+    unavailable = [group for group in skipped if group in REQUIRED_GROUPS]
+
+    results = {}
+    for case in cases:
+        results[case.name] = case.run(args.min_time, args.repeat)
+
+    baselines, baseline_machine = load_baselines(args.baselines)
+    if baselines and baseline_machine != machine():
+        print(f"baselines were recorded on {baseline_machine}, timings may not be comparable")
+    rows = compare(results, baselines, args.threshold)
+    # a regression has to show in a second measurement too, a single slow round is usually noise
+    for case in cases:
+        if any(row[0] == case.name and row[4] == "regression" for row in rows):
+            results[case.name] = min(results[case.name], case.run(args.min_time, args.repeat))
+    rows = compare(results, baselines, args.threshold)
+    regressions = print_report(rows, args.threshold)
+    if unavailable:
+        print(f"required group(s) could not run: {', '.join(unavailable)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"machine": machine(), "threshold": args.threshold, "skipped": skipped,
+                       "cases": [dict(zip(("name", "baseline", "current", "ratio", "status"), row)) for row in rows]},
+                      f, indent=2)
+    if args.save:
+        # cases that were not run (filtered, skipped) keep their stored baseline
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump({"machine": machine(), "results": dict(sorted(baselines.items()))}, f, indent=2)
+            f.write("\n")
+        print(f"baselines saved to {args.baselines}")
+        if unavailable:
+            sys.exit(1)
+        return
+    if regressions or unavailable:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+SSE parsing benchmark
+
+Times the shared incremental decoder (tools/sse_decoder.py) against the
+per-line loop the stream handlers used before (iter_lines, decode,
+startswith, json.loads, a print per line and per delta), on a synthetic
+chat completion stream cut into socket sized chunks.
+
+    python tests/benchmarks/bench_sse.py
+    python tests/benchmarks/bench_sse.py --deltas 50000 --chunk-size 1024
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from tools import sse_decoder
+from tools.sse_decoder import iter_deltas
+
+
+def build_stream(deltas):
+    words = ["Hello", " world", ",", " 你好", " streaming", " tokens", " \"quoted\"", "\n"]
+    events = []
+    for i in range(deltas):
+        events.append({"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1700000000,
+                       "model": "gpt-4o-mini", "system_fingerprint": "fp_1",
+                       "choices": [{"index": 0, "delta": {"content": words[i % len(words)]},
+                                    "logprobs": None, "finish_reason": None}],
+                       "usage": None})
+    events.append({"id": "chatcmpl-1", "object": "chat.completion.chunk", "model": "gpt-4o-mini",
+                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": None})
+    events.append({"id": "chatcmpl-1", "object": "chat.completion.chunk", "model": "gpt-4o-mini",
+                   "choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": deltas}})
+    body = "".join("data: " + json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n\n"
+                   for event in events)
+    return (body + "data: [DONE]\n\n").encode("utf-8")
+
+
+def chunked(body, size):
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+def iter_lines(chunks):
+    """requests.Response.iter_lines over the same chunks"""
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def legacy(chunks, log=True):
+    parts = []
+    for line in iter_lines(chunks):
+        if not line:
+            continue
+        line = line.decode('utf-8')
+        if log:
+            print(f"Raw line: {line}")
+        if line.startswith('data: '):
+            line = line[6:]
+            if line.strip() == "[DONE]":
+                continue
+            json_line = json.loads(line)
+            if len(json_line['choices']) > 0:
+                content = json_line['choices'][0].get('delta', {}).get('content', '')
+                if content:
+                    if log:
+                        print(f"Yielding content: {content}")
+                    parts.append(content)
+    return "".join(parts)
+
+
+def decoder(chunks):
+    return "".join(delta.content for delta in iter_deltas(chunks))
+
+
+def timed(label, fn, deltas, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<40} {best * 1000:9.2f} ms  {deltas / best / 1000:8.1f}k deltas/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deltas", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = build_stream(args.deltas)
+    chunks = chunked(body, args.chunk_size)
+    assert legacy(chunks, log=False) == decoder(chunks)
+    print(f"{args.deltas} deltas, {len(body) / 1024:.0f} KiB in {len(chunks)} chunks of {args.chunk_size} bytes, "
+          f"json backend: {sse_decoder._loads.__module__}")
+
+    def legacy_logged():
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy(chunks)
+
+    baseline = timed("per-line loop with debug prints", legacy_logged, args.deltas, args.repeat)
+    timed("per-line loop without prints", lambda: legacy(chunks, log=False), args.deltas, args.repeat)
+    best = timed("SSEDecoder + parse_delta", lambda: decoder(chunks), args.deltas, args.repeat)
+    print(f"  speedup over the logged loop: {baseline / best:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
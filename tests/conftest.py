@@ -0,0 +1,65 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from web_api.dialogue_api import dialogue_api_handler
+
+
+class CharTokenizer(object):
+    """One token per character, no tiktoken encoding needed"""
+    encoding = SimpleNamespace(encode=list)
+
+    def num_tokens_from_string(self, text):
+        return len(text)
+
+    def num_tokens_from_message(self, message):
+        return len(message["content"]) + 4
+
+    def message_overhead(self, role):
+        return 4
+
+
+class StreamResponse(object):
+    """Streamed chat completion answering `words`, one delta each"""
+    status_code = 200
+
+    def __init__(self, words):
+        self.words = words
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        for word in self.words:
+            chunk = {"choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            yield b"data: " + json.dumps(chunk).encode() + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def stream_response():
+    """Factory of StreamResponses: stream_response(["one ", "two"])"""
+    return StreamResponse
+
+
+@pytest.fixture
+def make_handler():
+    """
+    Builds dialogue_api_handlers from the default config whose streamed
+    completions answer with `response` and whose tokenizer counts characters
+    """
+    handlers = []
+
+    def make(response=None, context_max=10 ** 6):
+        handler = dialogue_api_handler(context_max=context_max)
+        handler.tokenizers = SimpleNamespace(for_model=lambda model: CharTokenizer())
+        handler.requestor = SimpleNamespace(post_request_stream=lambda *args, **kwargs: response)
+        handlers.append(handler)
+        return handler
+
+    yield make
+    for handler in handlers:
+        handler.intent_executor.shutdown(wait=True)
+        handler.sessions.close()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API
+
+Serves the endpoints the backend calls, with synthetic answers and
+controllable timing, so the app can be exercised and load tested without a
+key or network:
+
+    POST /v1/chat/completions      plain and streamed (SSE, chunked), text and vision
+    POST /v1/images/generations    an image URL after `image_latency`
+    POST /v1/audio/transcriptions  a fixed transcript
+    POST /v1/audio/speech          `audio_bytes` of fake MP3, chunked
+
+Streams start after `ttft` +- `ttft_jitter` seconds and then send
+`tokens_per_sec` deltas per second (0: as fast as possible). A share of
+requests fails with 500 (`error_rate`) or 429 (`rate_limit_rate`). Intent
+detection prompts ("Respond with only: YES or NO") are answered with
+`intent_answer`. Everything is stdlib; `seed` makes runs repeatable.
+
+    python tests/mock_openai_server.py --port 8900 --tokens-per-sec 40 --ttft 0.3
+    OPENAI_API_BASE=http://127.0.0.1:8900/v1 python manager.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris.").split()
+
+
+class MockSettings(object):
+    """Behaviour of the mock API; every field can be changed while it runs"""
+
+    def __init__(self, tokens_per_sec=50.0, ttft=0.2, ttft_jitter=0.05, completion_tokens=60,
+                 error_rate=0.0, rate_limit_rate=0.0, intent_answer="NO", image_latency=0.5,
+                 audio_bytes=16 * 1024, transcript="This is a mock transcription.", seed=None):
+        super().__init__()
+        self.tokens_per_sec = tokens_per_sec
+        self.ttft = ttft
+        self.ttft_jitter = ttft_jitter
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.intent_answer = intent_answer
+        self.image_latency = image_latency
+        self.audio_bytes = audio_bytes
+        self.transcript = transcript
+        self.seed = seed
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, the backend's connection pool should be exercised as with the real API
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        routes = {
+            "/v1/chat/completions": self._chat_completions,
+            "/v1/images/generations": self._images,
+            "/v1/audio/transcriptions": self._transcriptions,
+            "/v1/audio/speech": self._speech,
+        }
+        path = self.path.split("?", 1)[0]
+        route = routes.get(path)
+        if route is None:
+            self._error(404, "invalid_request_error", f"Unknown path {path}")
+            return
+        if self._injected_failure(path):
+            return
+        try:
+            route(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client closed the connection mid response
+            self.mock.count(path, "cancelled")
+            self.close_connection = True
+
+    # -------------------------------------------------------------------------
+    # endpoints
+    # -------------------------------------------------------------------------
+
+    def _chat_completions(self, body):
+        request = json.loads(body or b"{}")
+        messages = request.get("messages") or []
+        model = request.get("model", "gpt-mock")
+        kind = "vision" if _has_image(messages) else "chat"
+        prompt_tokens = max(len(json.dumps(messages)) // 4, 1)
+        tokens = self._completion_tokens(messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+
+        time.sleep(self.mock.first_token_delay())
+        if not request.get("stream"):
+            self.mock.pace(len(tokens))
+            self._json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            self.mock.count("/v1/chat/completions", kind)
+            return
+
+        self._start_chunked(200, "text/event-stream")
+        self._chunk(_sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                          "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                       "finish_reason": None}]}))
+        delay = 1.0 / self.mock.settings.tokens_per_sec if self.mock.settings.tokens_per_sec else 0.0
+        for i, token in enumerate(tokens):
+            if i and delay:
+                time.sleep(delay)
+            self._chunk(_sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                              "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}))
+        self._chunk(_sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                          "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._chunk(_sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": model,
+                              "choices": [], "usage": usage}))
+        self._chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+        self.mock.count("/v1/chat/completions", kind + "_stream", tokens=len(tokens))
+
+    def _images(self, body):
+        request = json.loads(body or b"{}")
+        time.sleep(self.mock.settings.image_latency)
+        number = self.mock.count("/v1/images/generations", "image")
+        self._json(200, {"created": int(time.time()), "data": [{
+            "url": f"https://mock.invalid/images/{number}.png",
+            "revised_prompt": request.get("prompt", ""),
+        }]})
+
+    def _transcriptions(self, body):
+        self.mock.count("/v1/audio/transcriptions", "transcription")
+        self._json(200, {"text": self.mock.settings.transcript})
+
+    def _speech(self, body):
+        audio = b"ID3" + bytes(max(self.mock.settings.audio_bytes - 3, 0))
+        self._start_chunked(200, "audio/mpeg")
+        for start in range(0, len(audio), 4096):
+            self._chunk(audio[start:start + 4096])
+        self._end_chunked()
+        self.mock.count("/v1/audio/speech", "speech")
+
+    # -------------------------------------------------------------------------
+    # helpers
+    # -------------------------------------------------------------------------
+
+    def _completion_tokens(self, messages):
+        last = messages[-1].get("content") if messages else ""
+        if isinstance(last, str) and "YES or NO" in last:
+            return [self.mock.settings.intent_answer]
+        count = self.mock.settings.completion_tokens
+        return [(" " if i else "") + WORDS[i % len(WORDS)] for i in range(count)]
+
+    def _injected_failure(self, path):
+        roll = self.mock.roll()
+        settings = self.mock.settings
+        if roll < settings.error_rate:
+            self.mock.count(path, "500")
+            self._error(500, "server_error", "Injected server error")
+            return True
+        if roll < settings.error_rate + settings.rate_limit_rate:
+            self.mock.count(path, "429")
+            self._error(429, "rate_limit_exceeded", "Injected rate limit", {"Retry-After": "1"})
+            return True
+        return False
+
+    def _json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, error_type, message, headers=None):
+        self._json(status, {"error": {"message": message, "type": error_type, "code": error_type}}, headers)
+
+    def _start_chunked(self, status, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data):
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def _sse(chunk):
+    return b"data: " + json.dumps(chunk).encode() + b"\n\n"
+
+
+def _has_image(messages):
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return True
+    return False
+
+
+class MockOpenAIServer(object):
+    """
+    The mock API on a background thread. `port=0` picks a free port; the
+    API base URL for OPENAI_API_BASE is `base_url` once started.
+    """
+
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        super().__init__()
+        self.settings = settings or MockSettings()
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+        self._counts = {}
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def first_token_delay(self):
+        settings = self.settings
+        with self._lock:
+            jitter = self._random.uniform(-settings.ttft_jitter, settings.ttft_jitter) if settings.ttft_jitter else 0.0
+        return max(settings.ttft + jitter, 0.0)
+
+    def pace(self, tokens):
+        """Generation time of a non-streamed completion"""
+        if self.settings.tokens_per_sec:
+            time.sleep(tokens / self.settings.tokens_per_sec)
+
+    def count(self, path, outcome, tokens=0):
+        """Count a served request, returns how many of (path, outcome) were served"""
+        with self._lock:
+            key = (path, outcome)
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if tokens:
+                self._counts[(path, "tokens")] = self._counts.get((path, "tokens"), 0) + tokens
+            return self._counts[key]
+
+    def stats(self):
+        """{path: {outcome: count}}"""
+        with self._lock:
+            stats = {}
+            for (path, outcome), count in self._counts.items():
+                stats.setdefault(path, {})[outcome] = count
+            return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--ttft-jitter", type=float, default=0.05)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests failing with 429")
+    parser.add_argument("--intent-answer", default="NO", choices=["YES", "NO"])
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    settings = MockSettings(tokens_per_sec=args.tokens_per_sec, ttft=args.ttft, ttft_jitter=args.ttft_jitter,
+                            completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+                            rate_limit_rate=args.rate_limit_rate, intent_answer=args.intent_answer, seed=args.seed)
+    server = MockOpenAIServer(settings, args.host, args.port)
+    print(f"mock OpenAI API on {server.base_url}  (OPENAI_API_BASE={server.base_url})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,7 @@ def chat_test(keys,model_name,request_address,context_handler,tokenizer,log_time
 
         st_time = time.time()
 
-        res = requestor.post_request(context_handler.context)
+        res = requestor.post_request(context_handler.messages())
         ed_time = time.time()
 
         if res.status_code == 200:
@@ -33,12 +33,11 @@ def chat_test(keys,model_name,request_address,context_handler,tokenizer,log_time
             response = response.lstrip("\n")
 
             completion_length = res.json()['usage']['completion_tokens']
-            total_length = res.json()['usage']['total_tokens']
             print(f"\nresponse : {response}")
 
             context_handler.append_cur_to_context(response,completion_length,tag=1)
-            if total_length > context_max:
-                context_handler.cut_context(total_length,tokenizer)
+            if not context_handler.fits(context_max):
+                context_handler.cut_context(tokenizer)
 
         else:
             status_code = res.status_code
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.async_openai_request import AsyncOpenAI_Request
+from src.http_transport import AsyncHTTPTransport
+
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if payload.get("stream"):
+            body = b"".join(
+                b"data: " + json.dumps({"choices": [{"delta": {"content": word}}]}).encode() + b"\n\n"
+                for word in ["Hello", " async", " world"]
+            ) + b"data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            body = json.dumps({"choices": [{"message": {"content": payload["model"]}}]}).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+async def _run_requests(address):
+    requestor = AsyncOpenAI_Request("test-key", "gpt-3.5-turbo", address,
+                                    transport=AsyncHTTPTransport(connect_timeout=1, read_timeout=5))
+    messages = [{"role": "user", "content": "hello"}]
+
+    res = await requestor.post_request(messages)
+    model = res.json()["choices"][0]["message"]["content"]
+
+    chunks = []
+    response = await requestor.post_request_stream(messages, model="gpt-4o")
+    try:
+        async for line in response.aiter_lines():
+            if line.startswith("data: ") and line[6:] != "[DONE]":
+                chunks.append(json.loads(line[6:])["choices"][0]["delta"]["content"])
+    finally:
+        await response.aclose()
+    await requestor.transport.aclose()
+    return model, "".join(chunks)
+
+
+def test_async_chat_and_stream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        address = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+        model, text = asyncio.run(_run_requests(address))
+        assert model == "gpt-3.5-turbo"
+        assert text == "Hello async world"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_connection_limit_is_configured_separately():
+    from config.chatgpt_config import config_dict
+    from tools.cfg_wrapper import load_config
+
+    transport_config = load_config(config_dict).Transport_config
+    transport = AsyncHTTPTransport.from_config(transport_config)
+    pool = transport.client._transport._pool
+
+    # on HTTP/1.1 every concurrent stream holds a connection, the idle pool size must not cap them
+    assert pool._max_connections == transport_config.max_connections
+    assert pool._max_connections > transport_config.pool_connections * transport_config.pool_maxsize
+    assert pool._max_keepalive_connections == transport_config.pool_maxsize
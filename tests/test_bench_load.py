@@ -0,0 +1,10 @@
+from tests.benchmarks.bench_load import percentile
+
+
+def test_nearest_rank_percentile():
+    assert percentile([], 50) is None
+    assert percentile([2, 1], 50) == 1
+    assert percentile(list(range(1, 11)), 50) == 5
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile(list(range(1, 101)), 100) == 100
+    assert percentile([7], 0) == 7
@@ -0,0 +1,18 @@
+from tests.benchmarks.bench_micro import collect_cases, compare
+
+
+def test_regressions_are_flagged_over_the_threshold():
+    rows = compare({"a": 1.2, "b": 1.3, "c": 0.7, "d": 1.0}, {"a": 1.0, "b": 1.0, "c": 1.0}, threshold=0.25)
+
+    assert [(name, status) for name, _, _, _, status in rows] == [
+        ("a", "ok"), ("b", "regression"), ("c", "faster"), ("d", "new")]
+
+
+def test_every_case_runs():
+    cases, skipped = collect_cases("gpt-4o")
+
+    # the tokenizer cases need the tiktoken encoding, which may not be available offline
+    assert set(skipped) <= {"tokenizer"}
+    assert len({case.name for case in cases}) == len(cases)
+    for case in cases:
+        assert case.run(min_time=0, repeat=1) > 0
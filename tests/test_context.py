@@ -0,0 +1,125 @@
+from tools.context import ContextHandler
+
+
+class _CharTokenizer(object):
+    """One token per character, plus 4 for the message overhead"""
+
+    def __init__(self):
+        self.decodes = 0
+
+    def encode(self, text):
+        return [ord(ch) for ch in text]
+
+    def decode(self, ids):
+        self.decodes += 1
+        return "".join(chr(i) for i in ids)
+
+    def message_overhead(self, role):
+        return 4
+
+    def num_tokens_from_message(self, message):
+        return len(message['content']) + 4
+
+
+def _context(turns, length=10, **del_config):
+    handler = ContextHandler(max_context=1000, context_del_config=del_config or None)
+    for turn in range(turns):
+        handler.append_cur_to_context("x" * (length - 4), length, tag=turn % 2)
+    return handler
+
+
+def test_running_total():
+    handler = _context(5)
+    assert handler.total_tokens == 50
+    assert handler.fits(50) and not handler.fits(49)
+
+    handler.clear()
+    assert handler.total_tokens == 0
+
+
+def test_trim_drops_oldest_turns_beyond_max_keep_turns():
+    handler = _context(10, max_keep_turns=4)
+    handler.append_cur_to_context("newest", 10)
+
+    handler.trim_to(60, _CharTokenizer())
+
+    assert handler.fits(60)
+    assert len(handler.context) == 6
+    assert handler.context[-1]["content"] == "newest"
+    assert handler.total_tokens == sum(handler.role_lengths)
+
+
+def test_trim_cuts_messages_when_turns_are_kept():
+    handler = _context(4, length=40, truncate_mode="chars")
+
+    handler.trim_to(140, _CharTokenizer())
+
+    assert handler.fits(140)
+    assert len(handler.context) == 4
+    assert handler.total_tokens == sum(handler.role_lengths)
+    # the oldest assistant message has the highest deletion score
+    assert handler.role_lengths[1] < 40
+
+
+def test_restore_rebuilds_totals():
+    handler = _context(3)
+    restored = ContextHandler()
+    restored.restore(handler.snapshot())
+
+    assert restored.total_tokens == 30
+    assert list(restored.context) == list(handler.context)
+
+
+def test_token_truncation_is_exact():
+    handler = _context(4, length=40)
+    tokenizer = _CharTokenizer()
+
+    handler.trim_to(151, tokenizer)
+
+    # 9 tokens over, all cut from the highest scored message with one decode
+    assert handler.total_tokens == 151
+    assert list(handler.role_lengths) == [40, 31, 40, 40]
+    assert handler.context[1]["content"] == "x" * 27
+    assert tokenizer.decodes == 1
+
+
+def test_prefix_stable_layout_evicts_whole_blocks():
+    handler = ContextHandler(max_context=1000, system_prompt="be brief", system_prompt_length=6, block_size=3)
+    for turn in range(8):
+        handler.append_cur_to_context(f"turn {turn}", 10, tag=turn % 2)
+    assert handler.total_tokens == 86
+
+    handler.trim_to(75, _CharTokenizer())
+
+    messages = handler.messages()
+    assert messages[0] == {"role": "system", "content": "be brief"}
+    assert [m["content"] for m in messages[1:]] == [f"turn {turn}" for turn in range(3, 8)]
+    assert handler.total_tokens == 56
+
+    handler.clear()
+    assert handler.total_tokens == 6 and len(handler.messages()) == 1
+
+
+def test_prefix_stable_layout_cuts_the_last_message_when_it_alone_is_too_long():
+    handler = ContextHandler(max_context=1000, system_prompt="be brief", system_prompt_length=6, block_size=3)
+    for turn in range(4):
+        handler.append_cur_to_context(f"turn {turn}", 10, tag=turn % 2)
+    handler.append_cur_to_context("y" * 96, 100, tag=1)
+
+    handler.trim_to(50, _CharTokenizer())
+
+    # the older turns are evicted, then the latest message is cut from the front in del_ratio rounds
+    assert [m["content"] for m in handler.messages()[1:]] == ["y" * 40]
+    assert handler.total_tokens == 50
+
+
+def test_usage_report_counts_cached_prompt_tokens():
+    handler = ContextHandler()
+    handler.record_usage({"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 0}}, latency=1.0)
+    handler.record_usage({"prompt_tokens": 120, "prompt_tokens_details": {"cached_tokens": 64}}, latency=0.5)
+
+    report = handler.usage_report()
+    assert report["requests"] == 2
+    assert report["cached_tokens"] == 64
+    assert report["cached_ratio"] == 64 / 220
+    assert report["avg_latency"] == 0.75
@@ -0,0 +1,93 @@
+import io
+import json
+
+from tools.context import ContextHandler
+from tools.context_compactor import ContextCompactor
+from tools.prompt_manager import PromptManager
+from tests.test_log import _configure, _records
+
+
+class _Response(object):
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    def json(self):
+        return {"choices": [{"message": {"content": self.content}}]}
+
+
+class _Requestor(object):
+    def __init__(self):
+        self.messages = []
+
+    def post_request(self, message):
+        self.messages.append(message)
+        return _Response("they talked")
+
+
+class _WordTokenizer(object):
+    def num_tokens_from_message(self, message):
+        return len(message["content"].split()) + 4
+
+
+def _context(turns):
+    handler = ContextHandler(max_context=100)
+    for turn in range(turns):
+        handler.append_cur_to_context(f"turn {turn}", 10, tag=turn % 2)
+    return handler
+
+
+def test_old_turns_are_replaced_by_a_summary():
+    requestor = _Requestor()
+    compactor = ContextCompactor(requestor, PromptManager(), threshold=0.75, compact_turns=6, keep_turns=2)
+    handler = _context(8)
+
+    saved = compactor.maybe_compact(handler, _WordTokenizer()).result()
+
+    assert "turn 5" in requestor.messages[0][0]["content"]
+    assert len(handler.context) == 3
+    assert handler.context[0]["role"] == "system"
+    assert handler.context[0]["content"].endswith("they talked")
+    assert saved == 60 - handler.role_lengths[0]
+    assert handler.total_tokens == sum(handler.role_lengths)
+    assert handler.compacted_tokens == saved and compactor.stats()["saved_tokens"] == saved
+    compactor.close()
+
+
+def test_below_threshold_nothing_is_scheduled():
+    compactor = ContextCompactor(_Requestor(), PromptManager(), threshold=0.75, compact_turns=6, keep_turns=2)
+    assert compactor.maybe_compact(_context(7), _WordTokenizer()) is None
+    compactor.close()
+
+
+def test_summary_is_discarded_when_turns_changed():
+    handler = _context(8)
+    first_seq, last_seq, _ = handler.oldest_messages(6)
+    handler.clear()
+    handler.append_cur_to_context("new", 10)
+
+    assert handler.compact(first_seq, last_seq, "summary", 5) == 0
+    assert [dia["content"] for dia in handler.context] == ["new"]
+
+
+def test_failed_request_is_logged_without_the_transcript():
+    class _Failing(_Requestor):
+        def post_request(self, message):
+            response = _Response(None)
+            response.status_code = 400
+            response.text = f"bad request: {message[0]['content']}"
+            return response
+
+    stream = io.StringIO()
+    _configure(stream)
+    compactor = ContextCompactor(_Failing(), PromptManager(), threshold=0.75, compact_turns=6, keep_turns=2)
+    handler = _context(8)
+
+    assert compactor.maybe_compact(handler, _WordTokenizer()).result() == 0
+    compactor.close()
+    record = [record for record in _records(stream) if record["event"] == "compaction.failed"][0]
+
+    assert record["status"] == 400
+    assert "turn 5" not in json.dumps(record)
+    assert compactor.stats()["failures"] == 1
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from tools.context import ContextHandler
+from tools.context_storage import AppendLogContextStorage, MemoryContextStorage, SQLiteContextStorage, WriteBehindWriter
+from tools.session_store import SessionStore
+
+
+def _storages(tmp_path):
+    return [
+        MemoryContextStorage(),
+        SQLiteContextStorage(str(tmp_path / "sessions.db")),
+        AppendLogContextStorage(str(tmp_path / "sessions.log")),
+    ]
+
+
+@pytest.mark.parametrize("index", range(3))
+def test_storage_roundtrip(tmp_path, index):
+    storage = _storages(tmp_path)[index]
+    state = {"context": [{"role": "user", "content": "你好"}], "role_lengths": [2]}
+
+    storage.save_many({"a": state, "b": state})
+    storage.delete("b")
+
+    assert storage.load("a") == state
+    assert storage.load("b") is None
+    assert storage.session_ids() == ["a"]
+    storage.close()
+
+
+def test_append_log_reopen_and_compact(tmp_path):
+    path = str(tmp_path / "sessions.log")
+    storage = AppendLogContextStorage(path)
+    for turn in range(3):
+        storage.save("a", {"context": [], "role_lengths": [turn]})
+    storage.close()
+
+    reopened = AppendLogContextStorage(path)
+    assert reopened.load("a")["role_lengths"] == [2]
+    reopened.compact()
+    assert reopened.load("a")["role_lengths"] == [2]
+    assert sum(1 for _ in open(path)) == 1
+    reopened.close()
+
+
+def test_sessions_survive_eviction_and_restart(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    def factory():
+        return ContextHandler(max_context=100)
+
+    writer = WriteBehindWriter(SQLiteContextStorage(path), flush_interval=60)
+    store = SessionStore(factory, max_sessions=1, writer=writer)
+    store.get("a").append_cur_to_context("remember me", 2)
+    store.get("b")  # evicts a before anything was flushed
+
+    assert "a" not in store
+    assert store.get("a").context[0]["content"] == "remember me"
+    store.close()
+
+    restarted = SessionStore(factory, writer=WriteBehindWriter(SQLiteContextStorage(path)), lazy_load=False)
+    assert "a" in restarted
+    assert list(restarted.get("a").role_lengths) == [2]
+    restarted.close()
+
+
+def test_workers_sharing_storage_see_each_others_turns(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    def worker():
+        writer = WriteBehindWriter(SQLiteContextStorage(path), flush_interval=60)
+        return SessionStore(lambda: ContextHandler(max_context=1000), writer=writer)
+
+    first, second = worker(), worker()
+    first.get("a").append_cur_to_context("turn 1", 2)
+    first.writer.flush()
+    second.get("a").append_cur_to_context("turn 2", 2)
+    second.writer.flush()
+    # resident in the first worker, which has to pick up turn 2 before appending
+    first.get("a").append_cur_to_context("turn 3", 2)
+    first.writer.flush()
+
+    # both append to a stale context before either flushes: the later write is rebased, not lost
+    second.get("a").append_cur_to_context("turn 4", 2)
+    first.get("a").append_cur_to_context("turn 5", 2)
+    second.writer.flush()
+    first.writer.flush()
+    first.writer.flush()
+
+    stored = [message["content"] for message in SQLiteContextStorage(path).load("a")["context"]]
+    assert stored == ["turn 1", "turn 2", "turn 3", "turn 4", "turn 5"]
+    first.close()
+    second.close()
+
+
+def test_concurrent_first_access_loads_once_outside_the_lock():
+    loads = []
+    release = threading.Event()
+
+    class SlowStorage(MemoryContextStorage):
+        def load(self, session_id):
+            loads.append(session_id)
+            if session_id == "a":
+                release.wait(5)
+            return super().load(session_id)
+
+    storage = SlowStorage()
+    storage.save("a", {"context": [{"role": "user", "content": "hi"}], "role_lengths": [1]})
+    store = SessionStore(lambda: ContextHandler(max_context=100), writer=WriteBehindWriter(storage))
+    handlers = []
+    threads = [threading.Thread(target=lambda: handlers.append(store.get("a"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+
+    while "a" not in loads:
+        time.sleep(0.001)
+
+    # another session is served while "a" is still loading
+    store.get("other")
+    assert not release.is_set()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert loads.count("a") == 1
+    assert len(handlers) == 4 and all(handler is handlers[0] for handler in handlers)
+    assert handlers[0].context[0]["content"] == "hi"
+    store.close()
@@ -0,0 +1,47 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.http_transport import HTTPTransport
+from src.openai_request import OpenAI_Request
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.client_ports.append(self.client_address[1])
+        body = json.dumps({"choices": [{"message": {"content": "hi"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_requests_reuse_pooled_connection():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ChatHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        address = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+        transport = HTTPTransport(pool_maxsize=2, connect_timeout=1, read_timeout=5)
+        requestor = OpenAI_Request("test-key", "gpt-3.5-turbo", address, transport=transport)
+
+        for _ in range(3):
+            res = requestor.post_request([{"role": "user", "content": "hello"}])
+            assert res.status_code == 200
+            assert res.json()["choices"][0]["message"]["content"] == "hi"
+
+        # keep-alive: every call went over the same client socket
+        assert len(_ChatHandler.client_ports) == 3
+        assert len(set(_ChatHandler.client_ports)) == 1
+        transport.close()
+    finally:
+        server.shutdown()
+        server.server_close()
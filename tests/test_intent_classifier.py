@@ -0,0 +1,61 @@
+from config.prompt_templates import PromptTemplates
+import time
+
+from tools.intent_classifier import IntentCache, IntentClassifier
+
+
+def test_rule_tiers():
+    classifier = IntentClassifier()
+    assert classifier.classify("Generate image of a red car").tier == "keyword"
+    assert classifier.classify("Draw a cat").tier == "regex"
+    assert classifier.classify("帮我画一只狗").tier == "regex"
+    assert classifier.classify("make me a poster for a jazz night").is_image
+
+
+def test_questions_mentioning_image_nouns_are_not_image_requests():
+    classifier = IntentClassifier()
+    for text in ("How do I make an icon in CSS?",
+                 "Show me how to render images in React",
+                 "I want to make a poster about climate, what text should it have?",
+                 "Make a list of image formats",
+                 "What is the best picture format for the web?"):
+        decision = classifier.classify(text)
+        # never decided by the rules; the model tier may still escalate to the LLM check
+        assert decision.tier == "model", text
+        assert not (decision.is_image and classifier.is_confident(decision)), text
+
+
+def test_image_requests_with_a_polite_prefix():
+    classifier = IntentClassifier()
+    for text in ("Can you design a cute cartoon avatar", "please create a logo for my bakery",
+                 "Generate an image of a dog", "give me a picture of the sea"):
+        assert classifier.classify(text).tier == "regex", text
+
+
+def test_model_tier_fits_template_examples():
+    classifier = IntentClassifier()
+    examples = PromptTemplates.get_intent_examples()
+    correct = sum(classifier.classify(text).is_image == label for text, label in examples)
+    assert correct == len(examples)
+
+
+def test_uncertain_inputs_escalate():
+    classifier = IntentClassifier(confidence_threshold=0.8)
+    confident = classifier.classify("how are you today")
+    assert confident.tier == "model" and not confident.is_image
+    assert classifier.is_confident(confident)
+    assert not classifier.is_confident(classifier.classify("a dragon made of clouds"))
+
+
+def test_intent_cache_normalizes_inputs(monkeypatch):
+    cache = IntentCache(max_entries=2, ttl=60)
+    cache.put("Draw a cat!", True)
+
+    assert cache.get("  draw A  CAT ") is True
+    assert cache.get("ＤＲＡＷ　ａ ｃａｔ？") is True
+    assert cache.get("画一只狗。") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get("draw a cat") is None
@@ -0,0 +1,64 @@
+import io
+import json
+import logging
+import queue
+
+from tools.cfg_wrapper import load_config
+from tools.log import DroppingQueueHandler, configure_logging, get_logger, mask_secrets, shutdown_logging
+
+
+def _configure(stream, **overrides):
+    settings = dict(level="DEBUG", format="json", queue_size=100, log_bodies=False,
+                    debug_sample_rate=1.0, sample_rates={})
+    settings.update(overrides)
+    configure_logging(load_config(settings), stream=stream)
+
+
+def _records(stream):
+    shutdown_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_json_records_redact_bodies_and_mask_keys():
+    stream = io.StringIO()
+    _configure(stream)
+    log = get_logger("test")
+
+    log.info("stream.request", model="gpt-4o", messages=[{"role": "user", "content": "secret"}] * 3,
+             error="401 for key sk-abcdef1234567890XYZ")
+    record = _records(stream)[0]
+
+    assert record["event"] == "stream.request" and record["level"] == "INFO"
+    assert record["model"] == "gpt-4o"
+    assert record["messages"] == "<list of 3>"
+    assert "secret" not in json.dumps(record)
+    assert record["error"] == "401 for key sk-ab***"
+
+
+def test_bodies_are_logged_when_enabled():
+    stream = io.StringIO()
+    _configure(stream, log_bodies=True)
+    get_logger("test").debug("completion.response", response="hello")
+    assert _records(stream)[0]["response"] == "hello"
+
+
+def test_sampled_events_follow_their_rate():
+    stream = io.StringIO()
+    _configure(stream, debug_sample_rate=0.0, sample_rates={"kept": 1.0})
+    log = get_logger("test")
+    for _ in range(50):
+        log.sampled("stream.delta", chars=3)
+    log.sampled("kept", chars=1)
+    assert [record["event"] for record in _records(stream)] == ["kept"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord("chatflow.test", logging.INFO, __file__, 1, "event", None, None)
+    handler.handle(record)
+    handler.handle(record)
+    assert handler.dropped == 1
+
+
+def test_mask_bearer_tokens():
+    assert mask_secrets("Authorization: Bearer abcdefghijklmnop") == "Authorization: Bearer ***"
@@ -0,0 +1,101 @@
+import threading
+
+from tools.cfg_wrapper import load_config
+from tools.metrics import Counter, Gauge, Histogram, MetricsRegistry, CallbackMetric, configure_metrics
+from tools.stream_coalescer import StreamCoalescer, TIME_TO_FIRST_TOKEN, STREAMS_ACTIVE
+
+
+def _samples(metric):
+    return {(suffix, labels): value for suffix, labels, value in metric.collect()}
+
+
+def test_counts_from_many_threads_add_up():
+    counter = Counter("test_total", "test", ("route",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc("a")
+        counter.inc("b", amount=5)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("a")
+
+    # shards of the finished threads are folded in, scraping twice does not count them twice
+    assert _samples(counter) == {("", (("route", "a"),)): 8001, ("", (("route", "b"),)): 40}
+    assert _samples(counter) == {("", (("route", "a"),)): 8001, ("", (("route", "b"),)): 40}
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "test", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    samples = _samples(histogram)
+    assert samples[("_bucket", (("le", "0.1"),))] == 2
+    assert samples[("_bucket", (("le", "1"),))] == 3
+    assert samples[("_bucket", (("le", "+Inf"),))] == 4
+    assert samples[("_count", ())] == 4
+    assert abs(samples[("_sum", ())] - 3.65) < 1e-9
+
+
+def test_exposition_format():
+    registry = MetricsRegistry()
+    gauge = registry.register(Gauge("test_open", "Open things", ("route",)))
+    gauge.inc('say "hi"')
+    registry.register(CallbackMetric("test_sessions", "Sessions", "gauge", lambda: 3))
+    registry.register(CallbackMetric("test_broken", "Broken", "gauge", lambda: 1 / 0))
+
+    assert registry.exposition() == (
+        "# HELP test_open Open things\n"
+        "# TYPE test_open gauge\n"
+        'test_open{route="say \\"hi\\""} 1\n'
+        "# HELP test_sessions Sessions\n"
+        "# TYPE test_sessions gauge\n"
+        "test_sessions 3\n"
+    )
+
+
+def test_streams_record_time_to_first_token():
+    def count(route):
+        samples = {labels: value for suffix, labels, value in TIME_TO_FIRST_TOKEN.collect() if suffix == "_count"}
+        return samples.get((("route", route),), 0)
+
+    def chunks():
+        yield from ["a", "b"]
+
+    list(StreamCoalescer().frames(chunks(), "failed", route="test_route"))
+
+    assert count("test_route") == 1
+    assert _samples(STREAMS_ACTIVE)[("", (("route", "test_route"),))] == 0
+
+
+def test_shards_of_ended_threads_are_retired_as_threads_come_and_go():
+    counter = Counter("test_total", "test")
+
+    for _ in range(2000):
+        thread = threading.Thread(target=counter.inc)
+        thread.start()
+        thread.join()
+
+    # each new thread folds the shards of the threads that ended before it, not only a scrape
+    assert len(counter._shards._shards) <= 2
+    assert _samples(counter) == {("", ()): 2000}
+
+
+def test_nothing_is_recorded_when_metrics_are_disabled():
+    counter = Counter("test_total", "test")
+    histogram = Histogram("test_seconds", "test")
+    configure_metrics(load_config(dict(enabled=False, path="/metrics")))
+    try:
+        counter.inc()
+        histogram.observe(0.5)
+    finally:
+        configure_metrics(load_config(dict(enabled=True, path="/metrics")))
+    counter.inc()
+
+    assert _samples(counter) == {("", ()): 1}
+    assert _samples(histogram) == {}
@@ -0,0 +1,38 @@
+import json
+
+from src.http_transport import HTTPTransport
+from src.openai_request import OpenAI_Request
+from tests.mock_openai_server import MockOpenAIServer, MockSettings
+from tools.sse_decoder import SSEDecoder, DONE
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _requestor(server):
+    return OpenAI_Request("sk-mock", "gpt-4o", f"{server.base_url}/chat/completions",
+                          transport=HTTPTransport(), stream_include_usage=True)
+
+
+def test_streamed_completion():
+    settings = MockSettings(tokens_per_sec=0, ttft=0, ttft_jitter=0, completion_tokens=5)
+    with MockOpenAIServer(settings) as server:
+        response = _requestor(server).post_request_stream(MESSAGES)
+        decoder = SSEDecoder()
+        chunks = [json.loads(data) for raw in response.iter_content(chunk_size=None)
+                  for data in decoder.feed(raw) if data != DONE]
+
+    assert response.status_code == 200 and decoder.done
+    text = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"])
+    assert text == "Lorem ipsum dolor sit amet,"
+    assert chunks[-1]["usage"]["completion_tokens"] == 5
+    assert server.stats() == {"/v1/chat/completions": {"chat_stream": 1, "tokens": 5}}
+
+
+def test_injected_rate_limit():
+    settings = MockSettings(ttft=0, ttft_jitter=0, rate_limit_rate=1.0)
+    with MockOpenAIServer(settings) as server:
+        response = _requestor(server).post_request(MESSAGES)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["error"]["type"] == "rate_limit_exceeded"
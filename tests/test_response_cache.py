@@ -0,0 +1,142 @@
+import json
+import time
+
+from src.openai_request import OpenAI_Request
+from tools.response_cache import CachedResponse, ResponseCache
+
+
+class _Response(object):
+    status_code = 200
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return {"model": self.payload["model"],
+                "choices": [{"message": {"content": "answer"}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 5, "completion_tokens": 1}}
+
+    def iter_lines(self):
+        for word in ["an", "swer"]:
+            yield b"data: " + json.dumps({"model": self.payload["model"],
+                                          "choices": [{"delta": {"content": word}}]}).encode()
+            yield b""
+        yield b"data: " + json.dumps({"choices": [{"delta": {}, "finish_reason": "stop"}]}).encode()
+        yield b""
+        yield b"data: [DONE]"
+        yield b""
+
+    def iter_content(self, chunk_size=None):
+        # the same events cut at arbitrary points, as they come off the socket
+        body = b"\n".join(self.iter_lines())
+        for start in range(0, len(body), 7):
+            yield body[start:start + 7]
+
+
+class _Transport(object):
+    def __init__(self):
+        self.calls = 0
+
+    def post(self, url, headers=None, data=None, stream=False, **kwargs):
+        self.calls += 1
+        return _Response(json.loads(data))
+
+
+def _requestor(cache):
+    transport = _Transport()
+    return OpenAI_Request("key", "gpt-4o-mini", "http://api", transport=transport, response_cache=cache), transport
+
+
+def _stream_text(response):
+    parts = []
+    for line in response.iter_lines():
+        if line.startswith(b"data: ") and line != b"data: [DONE]":
+            delta = json.loads(line[6:])["choices"][0]["delta"]
+            parts.append(delta.get("content", ""))
+    return "".join(parts)
+
+
+def test_key_ignores_stream_fields():
+    payload = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+    streamed = dict(payload, stream=True, stream_options={"include_usage": True})
+    assert ResponseCache.key(payload) == ResponseCache.key(streamed)
+    assert ResponseCache.key(payload) != ResponseCache.key(dict(payload, temperature=1))
+
+
+def test_requests_opt_in_per_call():
+    requestor, transport = _requestor(ResponseCache())
+    messages = [{"role": "user", "content": "faq"}]
+
+    requestor.post_request(messages)
+    requestor.post_request(messages)
+    assert transport.calls == 2
+
+    requestor.post_request(messages, cache=True)
+    cached = requestor.post_request(messages, cache=True)
+    assert transport.calls == 3
+    assert cached.from_cache
+    assert cached.json()["choices"][0]["message"]["content"] == "answer"
+
+
+def test_streamed_completion_is_recorded_and_replayed_as_sse():
+    requestor, transport = _requestor(ResponseCache())
+    messages = [{"role": "user", "content": "faq"}]
+
+    assert _stream_text(requestor.post_request_stream(messages, cache=True)) == "answer"
+    replay = requestor.post_request_stream(messages, cache=True)
+
+    assert transport.calls == 1
+    assert isinstance(replay, CachedResponse)
+    assert _stream_text(replay) == "answer"
+    # the plain request shares the entry
+    assert requestor.post_request(messages, cache=True).json()["choices"][0]["message"]["content"] == "answer"
+
+
+def test_streamed_bytes_are_recorded():
+    requestor, transport = _requestor(ResponseCache())
+    messages = [{"role": "user", "content": "faq"}]
+
+    for _ in requestor.post_request_stream(messages, cache=True).iter_content(chunk_size=None):
+        pass
+    replay = requestor.post_request_stream(messages, cache=True)
+
+    assert transport.calls == 1
+    assert _stream_text(replay) == "answer"
+
+
+def test_abandoned_stream_is_not_cached():
+    requestor, transport = _requestor(ResponseCache())
+    messages = [{"role": "user", "content": "faq"}]
+
+    next(requestor.post_request_stream(messages, cache=True).iter_lines())
+    requestor.post_request_stream(messages, cache=True)
+    assert transport.calls == 2
+
+
+def test_ttl_and_disk_tier(tmp_path):
+    path = str(tmp_path / "responses.db")
+    completion = {"model": "m", "content": "x", "finish_reason": "stop", "usage": None}
+
+    cache = ResponseCache(ttl=60, disk_path=path)
+    cache.put("k", completion)
+    cache.close()
+
+    restarted = ResponseCache(ttl=60, disk_path=path)
+    assert restarted.get("k") == completion
+    assert restarted.stats()["disk_hits"] == 1
+    restarted.close()
+
+    expiring = ResponseCache(ttl=0.01)
+    expiring.put("k", completion)
+    time.sleep(0.02)
+    assert expiring.get("k") is None
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    cache = ResponseCache(max_entries=1, ttl=60, disk_path=str(tmp_path / "responses.db"), disk_max_bytes=200)
+    for i in range(5):
+        cache.put(str(i), {"model": "m", "content": "y" * 50, "finish_reason": "stop", "usage": None})
+
+    assert cache.stats()["disk_bytes"] <= 200
+    assert cache.get("4") is not None and cache.get("0") is None
+    cache.close()
@@ -0,0 +1,86 @@
+import time
+
+from tools.context import ContextHandler
+from tools.session_store import SessionStore
+
+
+def _store(**kwargs):
+    return SessionStore(lambda: ContextHandler(max_context=100), **kwargs)
+
+
+def test_sessions_are_isolated():
+    store = _store()
+    store.get("a").append_cur_to_context("hello from a", 3)
+    store.get("b").append_cur_to_context("hello from b", 3)
+
+    assert [m["content"] for m in store.get("a").context] == ["hello from a"]
+    assert [m["content"] for m in store.get("b").context] == ["hello from b"]
+    assert store.get("a") is store.get("a")
+
+
+def test_lru_eviction_by_count():
+    store = _store(max_sessions=2)
+    store.get("a")
+    store.get("b")
+    store.get("a")  # b is now least recently used
+    store.get("c")
+
+    assert "a" in store and "c" in store
+    assert "b" not in store
+    assert store.stats()["evictions"] == 1
+
+
+def test_idle_ttl_eviction():
+    store = _store(idle_ttl=0.01)
+    store.get("a")
+    time.sleep(0.02)
+    store.get("b")
+
+    assert "a" not in store and "b" in store
+
+
+def test_memory_accounting_and_cap():
+    store = _store(max_memory_bytes=2000)
+    store.get("a").append_cur_to_context("x" * 1500, 10)
+    assert store.memory_bytes >= 1500
+
+    store.get("b").append_cur_to_context("y" * 1500, 10)
+    store.get("b")  # accessing b enforces the cap and evicts a
+
+    assert "a" not in store
+    assert store.memory_bytes == store.get("b").memory_bytes
+
+    store.get("b").clear()
+    assert store.memory_bytes == 0
+
+
+def test_async_get_loads_off_the_event_loop():
+    import asyncio
+
+    from tools.context_storage import MemoryContextStorage, WriteBehindWriter
+
+    class SlowStorage(MemoryContextStorage):
+        def load(self, session_id):
+            time.sleep(0.2)
+            return super().load(session_id)
+
+    store = _store(writer=WriteBehindWriter(SlowStorage()))
+
+    async def main():
+        ticks = []
+
+        async def tick():
+            for _ in range(10):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        handler = await store.aget("a")
+        await ticker
+        return handler, ticks
+
+    handler, ticks = asyncio.run(main())
+    assert handler is store.get("a")
+    # the loop kept running during the 0.2 s load
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.15
+    store.close()
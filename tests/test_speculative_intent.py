@@ -0,0 +1,187 @@
+import asyncio
+import io
+import threading
+import time
+
+from tools.intent_classifier import IntentClassifier
+from tests.test_log import _configure, _records
+
+
+def _speculating(handler, is_image, intent_delay=0.05):
+    """`handler` with the LLM intent check and the generation streams replaced by local generators"""
+    handler.closed = []
+
+    def detect(user_input):
+        time.sleep(intent_delay)
+        return is_image
+
+    def text_stream(user_input, model=None, session_id=None, route=None, speculation=None):
+        handler.sessions.get(session_id).append_cur_to_context(user_input, 5)
+        try:
+            for word in ["a", "b", "c"]:
+                time.sleep(0.02)
+                yield word
+        finally:
+            handler.closed.append("text")
+
+    async def adetect(user_input):
+        await asyncio.sleep(intent_delay)
+        return is_image
+
+    async def atext_stream(user_input, model=None, session_id=None, route=None, speculation=None):
+        handler.sessions.get(session_id).append_cur_to_context(user_input, 5)
+        try:
+            for word in ["a", "b", "c"]:
+                await asyncio.sleep(0.02)
+                yield word
+        finally:
+            handler.closed.append("text")
+
+    async def aimage_stream(user_input):
+        yield "image"
+
+    handler._detect_intent_with_llm = detect
+    handler.generate_massage_stream = text_stream
+    handler.generate_dalle_image_stream = lambda user_input: iter(["image"])
+    handler._adetect_intent_with_llm = adetect
+    handler.agenerate_massage_stream = atext_stream
+    handler.agenerate_dalle_image_stream = aimage_stream
+    return handler
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_text_intent_flushes_buffered_chunks(make_handler):
+    handler = _speculating(make_handler(), is_image=False)
+    assert list(handler._speculative_generate("hello", session_id="s")) == ["a", "b", "c"]
+    assert len(handler.sessions.get("s").context) == 1
+
+
+def test_image_intent_cancels_text_stream_and_rolls_back(make_handler):
+    handler = _speculating(make_handler(), is_image=True)
+    assert list(handler._speculative_generate("draw", session_id="s")) == ["image"]
+    # a read still pending closes the stream when it returns
+    handler.intent_executor.shutdown(wait=True)
+    assert handler.closed == ["text"]
+    assert len(handler.sessions.get("s").context) == 0
+
+
+def test_image_does_not_wait_for_a_blocked_read(make_handler):
+    handler = _speculating(make_handler(), is_image=True)
+
+    def stalled_stream(user_input, model=None, session_id=None, route=None, speculation=None):
+        handler.sessions.get(session_id).append_cur_to_context(user_input, 5)
+        try:
+            time.sleep(0.5)
+            yield "a"
+        finally:
+            handler.closed.append("text")
+
+    handler.generate_massage_stream = stalled_stream
+    start = time.monotonic()
+    assert list(handler._speculative_generate("draw", session_id="s")) == ["image"]
+    assert time.monotonic() - start < 0.4
+
+    handler.intent_executor.shutdown(wait=True)
+    assert handler.closed == ["text"]
+    assert len(handler.sessions.get("s").context) == 0
+
+
+def test_async_speculation(make_handler):
+    handler = _speculating(make_handler(), is_image=False)
+    assert asyncio.run(_collect(handler._aspeculative_generate("hello", session_id="s"))) == ["a", "b", "c"]
+
+    handler = _speculating(make_handler(), is_image=True)
+    assert asyncio.run(_collect(handler._aspeculative_generate("draw", session_id="s"))) == ["image"]
+    assert handler.closed == ["text"]
+    assert len(handler.sessions.get("s").context) == 0
+
+
+def test_async_path_trains_the_classifier_off_the_event_loop(make_handler):
+    handler = _speculating(make_handler(), is_image=False)
+    handler.prompt_manager = type("Prompts", (), {"get_intent_detection_settings": lambda self: {"speculative": False}})()
+    handler.intent_classifier = IntentClassifier()
+    trained_on = []
+    train = handler.intent_classifier._train
+
+    def record_train():
+        trained_on.append(threading.current_thread())
+        train()
+
+    handler.intent_classifier._train = record_train
+
+    assert asyncio.run(_collect(handler.adetect_intent_and_generate("hello", session_id="s"))) == ["a", "b", "c"]
+    assert handler.intent_classifier.trained
+    assert trained_on and trained_on[0] is not threading.main_thread()
+
+
+def test_cached_intent_is_routed_without_speculating(make_handler):
+    handler = _speculating(make_handler(), is_image=False)
+    handler.prompt_manager = type("Prompts", (), {
+        "get_intent_detection_settings": lambda self: {"local_classifier": False, "speculative": True}})()
+    handler.intent_cache.put("a dragon made of clouds", True)
+    handler.intent_cache.put("tell me about dragons", False)
+
+    def no_llm_check(user_input):
+        raise AssertionError("the LLM intent check ran on a cached input")
+
+    async def ano_llm_check(user_input):
+        no_llm_check(user_input)
+
+    handler._detect_intent_with_llm = no_llm_check
+    handler._adetect_intent_with_llm = ano_llm_check
+
+    assert list(handler.detect_intent_and_generate("A dragon made of clouds", session_id="s")) == ["image"]
+    assert list(handler.detect_intent_and_generate("tell me about dragons", session_id="s")) == ["a", "b", "c"]
+    assert asyncio.run(_collect(handler.adetect_intent_and_generate("a dragon made of clouds", session_id="t"))) == ["image"]
+    # no speculative text stream was started for the image
+    assert handler.closed == ["text"]
+    assert len(handler.sessions.get("t").context) == 0
+
+
+def test_decided_source_is_the_tier_that_decided(make_handler):
+    handler = _speculating(make_handler(), is_image=True)
+    handler.prompt_manager = type("Prompts", (), {"get_intent_detection_settings": lambda self: {"speculative": False}})()
+    handler.intent_cache.put("a dragon made of clouds", True)
+    stream = io.StringIO()
+    _configure(stream)
+
+    assert list(handler.detect_intent_and_generate("Tell me something about whales", session_id="s")) == ["a", "b", "c"]
+    assert asyncio.run(_collect(handler.adetect_intent_and_generate("Tell me something about whales",
+                                                                    session_id="t"))) == ["a", "b", "c"]
+    assert list(handler.detect_intent_and_generate("a dragon made of clouds", session_id="s")) == ["image"]
+    # no cache entry and no confident local decision: the LLM check decides
+    assert asyncio.run(_collect(handler.adetect_intent_and_generate("a dragon in the sky", session_id="t"))) == ["image"]
+
+    decided = [(record["route"], record["source"]) for record in _records(stream) if record["event"] == "intent.decided"]
+    assert decided == [("text", "model"), ("text", "model"), ("dalle", "cache"), ("dalle", "llm")]
+
+
+def test_stream_finished_before_an_image_decision_is_not_committed(make_handler, stream_response):
+    # committing the answer would cut the oldest turn
+    handler = make_handler(stream_response(["one ", "two"]), context_max=55)
+    handler._detect_intent_with_llm = lambda user_input: time.sleep(0.2) or True
+    handler.generate_dalle_image_stream = lambda user_input: iter(["image"])
+    history = handler.sessions.get("s")
+    for turn in range(3):
+        history.append_cur_to_context(f"turn {turn:5d}", 14, tag=turn % 2)
+    before = history.messages()
+
+    assert list(handler._speculative_generate("draw", session_id="s")) == ["image"]
+    handler.intent_executor.shutdown(wait=True)
+
+    assert history.messages() == before
+    assert history.total_tokens == 42
+    assert handler.stream_cancellations.stats()["completed"] == 0
+
+
+def test_stream_finished_before_a_text_decision_is_committed_once_decided(make_handler, stream_response):
+    handler = make_handler(stream_response(["one ", "two"]))
+    handler._detect_intent_with_llm = lambda user_input: time.sleep(0.2) or False
+
+    assert list(handler._speculative_generate("hello", session_id="s")) == ["one ", "two"]
+
+    assert handler.sessions.get("s").messages()[-1] == {"role": "assistant", "content": "one two"}
+    assert handler.stream_cancellations.stats()["completed"] == 1
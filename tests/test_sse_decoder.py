@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from tools.sse_decoder import SSEDecoder, StreamDelta, aiter_deltas, iter_deltas, parse_delta
+
+
+def _chunk(content=None, finish_reason=None, usage=None, choices=True):
+    chunk = {"id": "c", "object": "chat.completion.chunk", "model": "m",
+             "choices": [{"index": 0, "delta": {} if content is None else {"content": content},
+                          "finish_reason": finish_reason}] if choices else []}
+    if usage is not None:
+        chunk["usage"] = usage
+    return json.dumps(chunk, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _stream(*events, newline=b"\n"):
+    return b"".join(b"data: " + event + newline + newline for event in events)
+
+
+def test_events_survive_arbitrary_splits():
+    body = _stream(_chunk("你好"), _chunk(" wörld"), b"[DONE]", newline=b"\r\n")
+    for size in (1, 2, 3, 7, len(body)):
+        decoder = SSEDecoder()
+        events = []
+        for start in range(0, len(body), size):
+            events += decoder.feed(body[start:start + size])
+        assert events == [_chunk("你好"), _chunk(" wörld"), b"[DONE]"]
+        assert decoder.done
+
+
+def test_multiline_data_comments_and_other_fields():
+    decoder = SSEDecoder()
+    events = decoder.feed(b": keep-alive\n\nevent: message\nid: 1\ndata: first\ndata:second\n\nretry: 10\n")
+    assert events == [b"first\nsecond"]
+    assert decoder.feed(b"data: tail") == []
+    assert decoder.flush() == [b"tail"]
+
+
+def test_fast_path_matches_json_decoding():
+    for content in ["plain", "", 'quote " and \\ backslash', "line\nbreak", "é中 😀", "\\u0041"]:
+        assert parse_delta(_chunk(content)) == StreamDelta(content, None, None)
+    spaced = json.dumps({"choices": [{"delta": {"role": "assistant", "content": "hi"}}]}).encode()
+    assert parse_delta(spaced) == StreamDelta("hi", None, None)
+
+    assert parse_delta(_chunk("end", finish_reason="stop")) == StreamDelta("end", "stop", None)
+    usage = {"prompt_tokens": 3, "completion_tokens": 2}
+    assert parse_delta(_chunk(choices=False, usage=usage)) == StreamDelta("", None, usage)
+    assert parse_delta(b"[DONE]") is None
+
+
+def test_iter_deltas_stops_at_done_and_skips_malformed_events():
+    body = _stream(_chunk("a"), b"{not json", _chunk("b"), b"[DONE]", _chunk("after"))
+    chunks = [body[i:i + 5] for i in range(0, len(body), 5)]
+
+    assert [delta.content for delta in iter_deltas(chunks)] == ["a", "b"]
+
+    async def collect():
+        async def source():
+            for chunk in chunks:
+                yield chunk
+        return [delta.content async for delta in aiter_deltas(source())]
+
+    assert asyncio.run(collect()) == ["a", "b"]
@@ -0,0 +1,51 @@
+from config.prompt_templates import PromptTemplates
+from tools.stream_cancellation import CancellationTracker, DeferredCommit
+
+
+def test_closed_stream_closes_upstream_and_commits_partial_answer(make_handler, stream_response):
+    response = stream_response(["one ", "two ", "three"])
+    handler = make_handler(response)
+
+    stream = handler.generate_massage_stream("hi", session_id="s")
+    assert next(stream) == "one "
+    stream.close()
+
+    assert response.closed
+    context = handler.sessions.get("s").messages()
+    assert context[-1] == {"role": "assistant", "content": "one " + PromptTemplates.STREAM_TRUNCATED_MARKER}
+    assert handler.stream_cancellations.stats()["cancelled"] == 1
+
+
+def test_discarded_stream_leaves_context_and_stats_alone(make_handler, stream_response):
+    response = stream_response(["one ", "two ", "three"])
+    handler = make_handler(response)
+    speculation = DeferredCommit()
+
+    stream = handler.generate_massage_stream("draw a cat", session_id="s", speculation=speculation)
+    assert next(stream) == "one "
+    speculation.resolve(False)
+    stream.close()
+
+    assert response.closed
+    # only the user turn, which the speculating caller rolls back
+    assert [message["role"] for message in handler.sessions.get("s").messages()] == ["user"]
+    assert handler.stream_cancellations.stats()["cancelled"] == 0
+
+
+def test_saved_tokens_estimate():
+    tracker = CancellationTracker()
+    assert tracker.record_cancelled(10, max_tokens=100) == 90
+
+    tracker.record_completed(50)
+    tracker.record_completed(70)
+    assert tracker.record_cancelled(20) == 40
+    assert tracker.record_cancelled(80) == 0
+    assert tracker.stats() == {"completed": 2, "cancelled": 3, "cancelled_tokens": 110, "saved_tokens": 130}
+
+
+def test_finished_stream_is_not_cancelled(make_handler, stream_response):
+    handler = make_handler(stream_response(["one ", "two"]))
+
+    assert list(handler.generate_massage_stream("hi", session_id="s")) == ["one ", "two"]
+    assert handler.sessions.get("s").messages()[-1]["content"] == "one two"
+    assert handler.stream_cancellations.stats()["completed"] == 1
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+import time
+
+from tools.stream_coalescer import DONE_FRAME, StreamCoalescer, chunk_frame
+
+
+def _text(frames):
+    return "".join(json.loads(frame[6:])["chunk"] for frame in frames if frame != DONE_FRAME)
+
+
+def test_chunk_frame_matches_json_envelope():
+    for chunk in ["hi", "quote \" 中文 \n", "[IMAGE:http://x]"]:
+        expected = "data: " + json.dumps({'code': 0, 'message': 'success', 'chunk': chunk}) + "\n\n"
+        assert chunk_frame(chunk) == expected
+
+
+def test_deltas_are_batched_after_the_first():
+    coalescer = StreamCoalescer(max_delay=0.05, max_bytes=8)
+
+    def chunks():
+        yield "first"
+        for _ in range(6):
+            yield "ab"
+        time.sleep(0.1)
+        yield "late"
+
+    frames = list(coalescer.frames(chunks(), 'call failed'))
+
+    assert frames[0] == chunk_frame("first")
+    assert frames[-1] == DONE_FRAME
+    assert _text(frames) == "first" + "ab" * 6 + "late"
+    assert len(frames) < 8
+    assert coalescer.stats()["chunks"] == 8
+
+
+def test_errors_are_framed_before_done():
+    def chunks():
+        yield "partial"
+        raise RuntimeError("boom")
+
+    frames = list(StreamCoalescer().frames(chunks(), 'call failed'))
+    assert json.loads(frames[-2][6:]) == {'code': 1, 'message': 'call failed', 'chunk': 'boom'}
+    assert frames[-1] == DONE_FRAME
+
+
+def test_gone_client_closes_the_upstream():
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            while True:
+                yield "token"
+                time.sleep(0.001)
+        finally:
+            closed.set()
+
+    coalescer = StreamCoalescer(max_delay=0.0)
+    frames = coalescer.frames(chunks(), 'call failed')
+    next(frames)
+    frames.close()
+
+    assert closed.wait(2)
+    assert coalescer.stats()["disconnects"] == 1
+
+
+def test_slow_client_closes_the_upstream():
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            while True:
+                yield "token"
+        finally:
+            closed.set()
+
+    coalescer = StreamCoalescer(max_pending=4, slow_client_timeout=0.2)
+    frames = coalescer.frames(chunks(), 'call failed')
+    next(frames)
+
+    assert closed.wait(2)
+    assert coalescer.stats()["slow_clients"] == 1
+    frames.close()
+
+
+def test_async_frames():
+    closed = []
+
+    async def chunks():
+        try:
+            yield "first"
+            for _ in range(5):
+                await asyncio.sleep(0)
+                yield "ab"
+        finally:
+            closed.append(True)
+
+    async def collect():
+        return [frame async for frame in StreamCoalescer(max_delay=0.05).aframes(chunks(), 'call failed')]
+
+    frames = asyncio.run(collect())
+    assert frames[0] == chunk_frame("first")
+    assert frames[-1] == DONE_FRAME
+    assert _text(frames) == "first" + "ab" * 5
+    assert len(frames) == 3
+    assert closed == [True]
+
+
+def test_async_gone_client_cancels_the_upstream():
+    closed = []
+
+    async def chunks():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield "token"
+        finally:
+            closed.append(time.monotonic())
+
+    async def disconnect():
+        frames = StreamCoalescer(max_delay=0.0).aframes(chunks(), 'call failed')
+        await frames.__anext__()
+        await frames.aclose()
+        return time.monotonic()
+
+    closed_at = asyncio.run(disconnect())
+    assert len(closed) == 1 and closed[0] <= closed_at
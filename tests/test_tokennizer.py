@@ -0,0 +1,141 @@
+import hashlib
+import os
+
+import tiktoken
+
+from tools.tokennizer import ENCODING_URL, StreamTokenCounter, Tokennizer, TokenizerRegistry, configure_encoding_cache
+
+
+class _WordEncoding(object):
+    """Offline stand-in for a tiktoken Encoding: one token per whitespace separated word"""
+
+    def __init__(self):
+        self.encode_calls = 0
+        self.vocab = {}
+
+    def encode(self, text):
+        self.encode_calls += 1
+        return [self.vocab.setdefault(word, len(self.vocab)) for word in text.split()]
+
+    def encode_batch(self, texts, num_threads=1):
+        return [self.encode(text) for text in texts]
+
+    def decode(self, ids):
+        words = {i: word for word, i in self.vocab.items()}
+        return " ".join(words[i] for i in ids)
+
+
+def _tokenizer(monkeypatch, **kwargs):
+    encoding = _WordEncoding()
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model_name: encoding)
+    return Tokennizer("gpt-3.5-turbo", **kwargs), encoding
+
+
+def test_counts_are_memoized(monkeypatch):
+    tokenizer, encoding = _tokenizer(monkeypatch)
+
+    assert tokenizer.num_tokens_from_string("a b c") == 3
+    assert tokenizer.num_tokens_from_string("a b c") == 3
+    assert encoding.encode_calls == 1
+
+    stats = tokenizer.cache_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_cache_is_bounded(monkeypatch):
+    tokenizer, _ = _tokenizer(monkeypatch, cache_entries=2)
+    for text in ["one", "two", "three"]:
+        tokenizer.num_tokens_from_string(text)
+
+    assert tokenizer.cache_stats()["entries"] == 2
+
+
+def test_count_many_only_encodes_misses(monkeypatch):
+    tokenizer, encoding = _tokenizer(monkeypatch)
+    tokenizer.num_tokens_from_string("system prompt here")
+
+    assert tokenizer.count_many(["system prompt here", "new message", "x"]) == [3, 2, 1]
+    assert encoding.encode_calls == 3
+
+
+def test_stream_counter_matches_full_count(monkeypatch):
+    tokenizer, encoding = _tokenizer(monkeypatch)
+    counter = StreamTokenCounter(tokenizer)
+    deltas = ["Hel", "lo", " wor", "ld,", " this is", " a ", "stream", "ed answer"]
+    for delta in deltas:
+        counter.feed(delta)
+
+    text = "".join(deltas)
+    assert counter.text == text
+    assert counter.tokens == len(text.split())
+
+
+def test_stream_counter_budget_and_usage(monkeypatch):
+    tokenizer, _ = _tokenizer(monkeypatch)
+    counter = StreamTokenCounter(tokenizer, max_tokens=3)
+    for delta in ["one", " two", " three"]:
+        assert not counter.over_budget
+        counter.feed(delta)
+    assert counter.over_budget
+
+    counter.set_usage({"completion_tokens": 42})
+    assert counter.tokens == 42
+
+
+def test_encoding_loads_lazily(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model_name: calls.append(model_name) or _WordEncoding())
+    tokenizer = Tokennizer("gpt-3.5-turbo")
+    assert calls == []
+
+    tokenizer.prewarm().join()
+    assert tokenizer.num_tokens_from_string("a b") == 2
+    assert calls == ["gpt-3.5-turbo"]
+
+
+def test_configure_encoding_cache(tmp_path, monkeypatch):
+    source = tmp_path / "cl100k_base.tiktoken"
+    source.write_text("ranks")
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", "")
+
+    configure_encoding_cache(str(tmp_path / "cache"), {"cl100k_base": str(source)})
+
+    cache_key = hashlib.sha1(ENCODING_URL.format("cl100k_base").encode()).hexdigest()
+    assert os.environ["TIKTOKEN_CACHE_DIR"] == str(tmp_path / "cache")
+    assert (tmp_path / "cache" / cache_key).read_text() == "ranks"
+
+
+def test_registry_picks_encoding_per_model(monkeypatch):
+    built = []
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: built.append(name) or _WordEncoding())
+    registry = TokenizerRegistry("gpt-3.5-turbo", model_encodings={"my-finetune": "o200k_base"})
+
+    assert registry.for_model().encoding_name == "cl100k_base"
+    assert registry.for_model("gpt-4o") is registry.for_model("gpt-4o-mini")
+    assert registry.for_model("gpt-4.1").encoding_name == "o200k_base"
+    assert registry.for_model("my-finetune") is registry.for_model("gpt-4o")
+    assert built == []  # encodings load on first count
+
+    registry.for_model("gpt-4o").num_tokens_from_string("a b")
+    assert built == ["o200k_base"]
+
+
+def test_message_overhead(monkeypatch):
+    tokenizer, _ = _tokenizer(monkeypatch)
+    messages = [
+        {"role": "system", "content": "be brief"},
+        {"role": "user", "content": "hi there", "name": "bob"},
+    ]
+
+    # content + role + 3 per message, name + 1, 3 to prime the reply
+    assert tokenizer.num_tokens_from_message(messages[0]) == 2 + 1 + 3
+    assert tokenizer.num_tokens_from_messages(messages) == (2 + 1 + 3) + (2 + 1 + 3 + 1 + 1) + 3
+
+
+def test_encode_reuses_ids_of_counted_strings(monkeypatch):
+    tokenizer, encoding = _tokenizer(monkeypatch)
+    tokenizer.num_tokens_from_string("one two three")
+
+    ids = tokenizer.encode("one two three")
+    assert encoding.encode_calls == 1
+    assert tokenizer.decode(ids[1:]) == "two three"
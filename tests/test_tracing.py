@@ -0,0 +1,91 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from src.http_transport import HTTPTransport
+from tools.stream_coalescer import StreamCoalescer
+from tools.tracing import configure_tracing, get_tracer, use_span, InMemorySpanExporter, KIND_SERVER, STATUS_ERROR
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemorySpanExporter()
+    configure_tracing(SimpleNamespace(enabled=True, sample_rate=1.0), exporter=exporter)
+    yield exporter
+    configure_tracing(SimpleNamespace(enabled=False))
+
+
+def test_spans_nest_under_the_root(exporter):
+    tracer = get_tracer()
+    with tracer.span("GET /", KIND_SERVER, root=True) as root:
+        with tracer.span("child") as child:
+            child.add_event("mark", n=1)
+        with pytest.raises(ValueError):
+            with tracer.span("failing"):
+                raise ValueError("boom")
+    # no active root: not recorded
+    with tracer.span("orphan") as orphan:
+        assert not orphan.recording
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert set(spans) == {"GET /", "child", "failing"}
+    assert spans["child"].trace_id == root.trace_id and spans["child"].parent_id == root.span_id
+    assert spans["failing"].status == STATUS_ERROR
+
+    otlp = spans["child"].to_otlp()
+    assert len(otlp["traceId"]) == 32 and len(otlp["spanId"]) == 16
+    assert otlp["parentSpanId"] == f"{root.span_id:016x}"
+    assert otlp["events"][0]["attributes"] == [{"key": "n", "value": {"intValue": "1"}}]
+
+
+def test_stream_stages_are_traced(exporter, make_handler, stream_response):
+    handler = make_handler(stream_response(["one ", "two"]))
+    coalescer = StreamCoalescer(max_delay=0.001)
+
+    tracer = get_tracer()
+    root = tracer.start_span("POST /request_openai", KIND_SERVER, root=True)
+    with use_span(root):
+        frames = list(coalescer.frames(handler.generate_massage_stream("hi", session_id="s"), "failed"))
+    root.end()
+    assert frames[-1] == "data: [DONE]\n\n"
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    for name in ("tokenize", "context.assemble", "upstream.request", "upstream.stream", "context.trim"):
+        assert spans[name].trace_id == root.trace_id
+        assert spans[name].parent_id == root.span_id
+    assert spans["upstream.stream"].attributes["completion_tokens"] == 7
+    assert [name for _, name, _ in spans["upstream.stream"].events] == ["first_token"]
+    assert [name for _, name, _ in root.events] == ["first_token_to_client"]
+
+
+def test_connection_acquisition_is_traced(exporter):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = HTTPTransport()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    try:
+        with get_tracer().span("request", root=True):
+            transport.post(url, data="{}")
+            transport.post(url, data="{}")
+    finally:
+        transport.close()
+        server.shutdown()
+
+    acquired = exporter.get_finished_spans("http.connection_acquire")
+    assert [span.attributes["http.connection_reused"] for span in acquired] == [False, True]
+    assert len(exporter.get_finished_spans("http.connect")) == 1
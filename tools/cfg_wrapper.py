@@ -1,5 +1,3 @@
-import json
-
 class cfg_dict(object):
 
     # constructor
@@ -7,6 +5,15 @@ class cfg_dict(object):
         self.__dict__.update(dict1)
 
 
+def _to_cfg(value):
+    if isinstance(value, dict):
+        return cfg_dict({k: _to_cfg(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return [_to_cfg(v) for v in value]
+    return value
+
+
 def load_config(dict1):
 
-    return json.loads(json.dumps(dict1), object_hook=cfg_dict)
+    # walk the dict once instead of a json.dumps/json.loads round trip
+    return _to_cfg(dict1)
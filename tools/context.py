@@ -1,14 +1,89 @@
-from tools.utils import del_context
+import heapq
+import sys
+import threading
+from collections import deque
+
+# defaults of Context_manage_config.del_config
+# del_score = (distance*distance_weights + length/max_length*length_weights)*role_weight
+DEFAULT_DEL_CONFIG = dict(
+    distance_weights=0.05,
+    length_weights=0.4,
+    role_weights=1,
+    sys_role_ratio=3,
+    del_ratio=0.4,
+    max_keep_turns=30,
+    # "tokens" slices the token ids of a message exactly, "chars" estimates a character offset
+    truncate_mode="tokens",
+)
 
 class ContextHandler(object):
-    def __init__(self,max_context=3200,context_del_config=None):
+    """
+    Conversation context with a running token total.
+
+    Messages and their token lengths are kept in deques so the oldest turns
+    are evicted in O(1). Each message also keeps its sequence number and role
+    weight, which makes its deletion score O(1) to evaluate on overflow: the
+    distance to the current turn is the difference of sequence numbers.
+
+    Sequence numbers also identify a range of old turns for compaction: a
+    summary computed in the background replaces the range only if it is
+    still unchanged at the front of the context.
+
+    With a `system_prompt` and a `block_size` the context is laid out for
+    upstream prompt caching: the system prompt is pinned in front of every
+    request (see messages()) and trimming evicts whole blocks of the oldest
+    turns without rewriting any message, so consecutive requests share their
+    leading tokens until the next block is evicted.
+
+    With persistent storage the handler tracks the stored `version` it is
+    based on; messages appended after the last write are kept on top of a
+    newer state written by another worker, see rebase().
+    """
+
+    def __init__(self,max_context=3200,context_del_config=None,system_prompt=None,system_prompt_length=0,
+                 block_size=None):
         super().__init__()
-        self.context = []
-        self.role_lengths = []
+        self.context = deque()
+        self.role_lengths = deque()
         self.max_context = max_context
 
+        # pinned system prompt, counted in total_tokens but never evicted
+        self.system_message = {"role": "system", "content": system_prompt} if system_prompt else None
+        self.system_prompt_length = system_prompt_length if system_prompt else 0
+        self.block_size = block_size
+        self.total_tokens = self.system_prompt_length
+
         # the config of del context
         self.context_del_config = context_del_config
+        del_params = dict(DEFAULT_DEL_CONFIG)
+        if context_del_config:
+            config_items = vars(context_del_config) if hasattr(context_del_config, '__dict__') else context_del_config
+            del_params.update(config_items)
+        self.del_params = del_params
+
+        # (sequence number, role weight) of each message, parallel to context
+        self._score_terms = deque()
+        self._next_seq = 0
+        self._lock = threading.RLock()
+
+        # summarization compaction, see ContextCompactor
+        self.compacting = False
+        self.compactions = 0
+        self.compacted_tokens = 0
+
+        # usage reported by the API for this conversation
+        self.usage_totals = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'latency': 0.0}
+
+        # stored version this context is based on, and the sequence number
+        # of the first message not written yet (see WriteBehindWriter)
+        self.version = 0
+        self._synced_seq = 0
+
+        # approximate heap size of the stored messages, reported to the session store
+        self.memory_bytes = 0
+        self.on_memory_change = None
+        # called after every mutation, used to schedule write-behind persistence
+        self.on_change = None
 
     def append_cur_to_context(self,data,complete__length,tag=0):
 
@@ -20,25 +95,308 @@ class ContextHandler(object):
             role = "system"
 
         role_data = {"role": role, "content": data}
-        self.context.append(role_data)
-        self.role_lengths.append(complete__length)
-
-    def cut_context(self,cur_total_length,tokenizer):
-        if self.context_del_config:
-            del_context(self.context, self.role_lengths, cur_total_length, self.max_context, tokenizer=tokenizer,
-                        distance_weights=self.context_del_config.distance_weights,
-                        length_weights=self.context_del_config.length_weights,
-                        role_weights=self.context_del_config.role_weights,
-                        sys_role_ratio=self.context_del_config.sys_role_ratio,
-                        del_ratio=self.context_del_config.del_ratio,
-                        max_keep_turns=self.context_del_config.max_keep_turns,
-                        )
-        # use the default pram
-        else:
-            del_context(self.context,self.role_lengths,cur_total_length,self.max_context,tokenizer=tokenizer)
+        with self._lock:
+            self._append(role_data, complete__length)
+
+        self._update_memory(self.memory_bytes + sys.getsizeof(data))
+        self._changed()
+
+    def mark(self):
+        """Position to roll back to, see rollback()"""
+        return self._next_seq
+
+    def rollback(self, mark):
+        """Remove the messages appended since `mark`, e.g. the turn of a cancelled speculative stream"""
+        memory_delta = 0
+        with self._lock:
+            while self._score_terms and self._score_terms[-1][0] >= mark:
+                self._score_terms.pop()
+                self.total_tokens -= self.role_lengths.pop()
+                memory_delta -= sys.getsizeof(self.context.pop()['content'])
+        if memory_delta:
+            self._update_memory(self.memory_bytes + memory_delta)
+            self._changed()
+
+    def messages(self):
+        """The messages of the next request, pinned system prompt first"""
+        with self._lock:
+            if self.system_message is None:
+                return list(self.context)
+            return [self.system_message] + list(self.context)
+
+    def fits(self, budget):
+        return self.total_tokens <= budget
+
+    def record_usage(self, usage, latency=None):
+        """Add the `usage` of one completion, including prompt tokens served from the upstream cache"""
+        details = usage.get('prompt_tokens_details') or {}
+        with self._lock:
+            totals = self.usage_totals
+            totals['requests'] += 1
+            totals['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            totals['cached_tokens'] += details.get('cached_tokens') or 0
+            if latency is not None:
+                totals['latency'] += latency
+        self._changed()
+
+    def usage_report(self):
+        totals = dict(self.usage_totals)
+        totals['cached_ratio'] = totals['cached_tokens'] / totals['prompt_tokens'] if totals['prompt_tokens'] else 0.0
+        totals['avg_latency'] = totals['latency'] / totals['requests'] if totals['requests'] else 0.0
+        return totals
+
+    def trim_to(self, budget, tokenizer):
+        """
+        Shrink the context until its total fits into `budget` tokens.
+
+        The oldest turns beyond `max_keep_turns` are dropped first. After that
+        messages are cut from the front, highest deletion score first, each by
+        at most `del_ratio` of its length. In "tokens" mode exactly the
+        overflowing tokens are cut (one decode per touched message), so the
+        trim stops at the first message that covers the remaining overflow.
+
+        With a `block_size` the oldest turns are evicted `block_size` at a time
+        instead, keeping at least the latest message; cutting is only the last
+        resort when that message alone does not fit, and then it is cut from
+        the front, `del_ratio` at a time, until it does.
+        """
+        params = self.del_params
+        memory_delta = 0
+
+        with self._lock:
+            if self.block_size:
+                while len(self.context) > 1 and not self.fits(budget):
+                    for _ in range(min(self.block_size, len(self.context) - 1)):
+                        memory_delta -= sys.getsizeof(self._popleft()['content'])
+                while len(self.context) == 1 and not self.fits(budget):
+                    delta, cut_tokens = self._cut_at(0, budget, tokenizer)
+                    memory_delta += delta
+                    if not cut_tokens:
+                        raise Exception("the remain dialogue after context cutting still too long")
+
+            #if the dia_nums exceeded max_keep_turns turns,del the oldest dia
+            while len(self.context) > params['max_keep_turns'] and not self.fits(budget):
+                memory_delta -= sys.getsizeof(self._popleft()['content'])
+
+            if not self.fits(budget):
+                memory_delta += self._truncate(budget, tokenizer)
+
+        self._update_memory(self.memory_bytes + memory_delta)
+        self._changed()
+
+    def oldest_messages(self, turns):
+        """
+        Copies of the oldest `turns` messages with the sequence numbers of the
+        first and the last one, for compact()
+        """
+        with self._lock:
+            turns = min(turns, len(self.context))
+            if not turns:
+                return None, None, []
+            messages = [dict(self.context[index]) for index in range(turns)]
+            return self._score_terms[0][0], self._score_terms[turns - 1][0], messages
 
+    def compact(self, first_seq, last_seq, summary, summary_length):
+        """
+        Replace the messages first_seq..last_seq with one system message.
 
+        The swap happens under the context lock and only when the range is
+        still at the front of the context and the summary is shorter. Returns
+        the number of tokens saved, 0 when the summary was discarded.
+        """
+        with self._lock:
+            if not self._score_terms or self._score_terms[0][0] != first_seq:
+                return 0
+            turns = 0
+            for seq, _ in self._score_terms:
+                if seq > last_seq:
+                    break
+                turns += 1
+            if self._score_terms[turns - 1][0] != last_seq:
+                return 0
 
+            replaced_length = sum(self.role_lengths[index] for index in range(turns))
+            saved_tokens = replaced_length - summary_length
+            if saved_tokens <= 0:
+                return 0
+
+            memory_delta = sys.getsizeof(summary)
+            for _ in range(turns):
+                memory_delta -= sys.getsizeof(self._popleft()['content'])
+            # the summary takes over the position of the oldest replaced turn
+            self.context.appendleft({"role": "system", "content": summary})
+            self.role_lengths.appendleft(summary_length)
+            self._score_terms.appendleft((first_seq, self._role_weight("system")))
+            self.total_tokens += summary_length
+
+            self.compactions += 1
+            self.compacted_tokens += saved_tokens
+
+        self._update_memory(self.memory_bytes + memory_delta)
+        self._changed()
+        return saved_tokens
+
+    def cut_context(self,tokenizer):
+        self.trim_to(self.max_context, tokenizer)
 
     def clear(self):
-        self.context.clear()
\ No newline at end of file
+        with self._lock:
+            self.context.clear()
+            self.role_lengths.clear()
+            self._score_terms.clear()
+            self.total_tokens = self.system_prompt_length
+        self._update_memory(0)
+        self._changed()
+
+    def snapshot(self):
+        """JSON-serializable copy of the conversation state, as the next stored version"""
+        return self.write_snapshot()[0]
+
+    def write_snapshot(self):
+        """snapshot() and the sequence number it covers, to be passed to synced() once written"""
+        with self._lock:
+            state = {'context': [dict(dia) for dia in self.context], 'role_lengths': list(self.role_lengths),
+                     'compaction': {'compactions': self.compactions, 'compacted_tokens': self.compacted_tokens},
+                     'usage': dict(self.usage_totals), 'version': self.version + 1}
+            return state, self._next_seq
+
+    def synced(self, version, seq):
+        """Record that the state of write_snapshot() was stored"""
+        with self._lock:
+            self.version = max(self.version, version)
+            self._synced_seq = max(self._synced_seq, seq)
+
+    def rebase(self, state):
+        """
+        Switch to a newer stored `state` written by another worker, keeping
+        the messages appended here since the last write on top of it.
+        Returns whether any such message was kept (they still need a write).
+        """
+        with self._lock:
+            if state.get('version', 0) <= self.version:
+                return False
+            unsynced = [(dia, length) for (seq, _), dia, length
+                        in zip(self._score_terms, self.context, self.role_lengths) if seq >= self._synced_seq]
+            self.restore(state)
+            for dia, length in unsynced:
+                self._append(dia, length)
+            self._update_memory(sum(sys.getsizeof(dia['content']) for dia in self.context))
+        if unsynced:
+            self._changed()
+        return bool(unsynced)
+
+    def restore(self, state):
+        with self._lock:
+            self.context.clear()
+            self.role_lengths.clear()
+            self._score_terms.clear()
+            self.total_tokens = self.system_prompt_length
+            for dia, length in zip(state['context'], state['role_lengths']):
+                self._append(dia, length)
+            compaction = state.get('compaction') or {}
+            self.compactions = compaction.get('compactions', 0)
+            self.compacted_tokens = compaction.get('compacted_tokens', 0)
+            self.usage_totals.update(state.get('usage') or {})
+            self.version = state.get('version', 0)
+            self._synced_seq = self._next_seq
+        self._update_memory(sum(sys.getsizeof(dia['content']) for dia in self.context))
+
+    def _role_weight(self, role):
+        if role == 'assistant':
+            return self.del_params['role_weights'] * self.del_params['sys_role_ratio']
+        return self.del_params['role_weights']
+
+    def _append(self, dia, length):
+        self.context.append(dia)
+        self.role_lengths.append(length)
+        self._score_terms.append((self._next_seq, self._role_weight(dia['role'])))
+        self._next_seq += 1
+        self.total_tokens += length
+
+    def _popleft(self):
+        self._score_terms.popleft()
+        self.total_tokens -= self.role_lengths.popleft()
+        return self.context.popleft()
+
+    def _truncate(self, budget, tokenizer):
+        """Cut messages by deletion score until the total fits, returns the memory delta"""
+        params = self.del_params
+        distance_weights = params['distance_weights']
+        length_weights = params['length_weights']
+
+        # scores are evaluated once per overflow, heapify is O(n) and only the
+        # messages actually cut are popped
+        next_seq = self._next_seq
+        heap = [(-(((next_seq - seq) * distance_weights + length / budget * length_weights) * role_weight), index)
+                for index, ((seq, role_weight), length) in enumerate(zip(self._score_terms, self.role_lengths))]
+        heapq.heapify(heap)
+
+        memory_delta = 0
+        cut_nums = 0
+        while not self.fits(budget):
+
+            if cut_nums == len(self.context) - 1:
+                raise Exception("the remain dialogue after context cutting still too long")
+
+            _, index = heapq.heappop(heap)
+            memory_delta += self._cut_at(index, budget, tokenizer)[0]
+            cut_nums += 1
+
+        return memory_delta
+
+    def _cut_at(self, index, budget, tokenizer):
+        """Cut the message at `index` by up to del_ratio, returns the memory delta and the tokens cut"""
+        params = self.del_params
+        cut_message = self._cut_tokens if params['truncate_mode'] == 'tokens' else self._cut_chars
+        del_dia = self.context[index]
+        del_dia_length = self.role_lengths[index]
+
+        exceed_num = self.total_tokens - budget
+        deleted_dia, deleted_dia_length = cut_message(del_dia, del_dia_length, exceed_num, params['del_ratio'],
+                                                      tokenizer)
+
+        self.total_tokens -= del_dia_length - deleted_dia_length
+        memory_delta = sys.getsizeof(deleted_dia) - sys.getsizeof(del_dia['content'])
+        del_dia['content'] = deleted_dia
+        self.role_lengths[index] = deleted_dia_length
+        return memory_delta, del_dia_length - deleted_dia_length
+
+    @staticmethod
+    def _cut_chars(del_dia, del_dia_length, exceed_num, del_ratio, tokenizer):
+        # delete the del_ratio numbers at most for each dialogue
+        ch_del_dia_len = len(del_dia['content'])
+        if exceed_num/del_dia_length < del_ratio:
+            # +2 for token "/n"
+            del_st_index = int((exceed_num/del_dia_length)*ch_del_dia_len)+2
+        else:
+            del_st_index = int(del_ratio*ch_del_dia_len)
+
+        deleted_dia = del_dia['content'][del_st_index:]
+        # the message keeps its role, so its chat format overhead stays counted
+        deleted_dia_length = tokenizer.num_tokens_from_message({'role': del_dia['role'], 'content': deleted_dia})
+        return deleted_dia, deleted_dia_length
+
+    @staticmethod
+    def _cut_tokens(del_dia, del_dia_length, exceed_num, del_ratio, tokenizer):
+        ids = tokenizer.encode(del_dia['content'])
+        # a stored length may differ from the ids (e.g. taken from usage), cut at least the difference
+        overhead = tokenizer.message_overhead(del_dia['role'])
+        exceed_num -= max(0, del_dia_length - len(ids) - overhead)
+
+        # delete the del_ratio tokens at most for each dialogue
+        cut = min(max(exceed_num, 0), int(del_ratio * len(ids)))
+        kept = ids[cut:]
+        deleted_dia = tokenizer.decode(kept) if cut else del_dia['content']
+        # a cut inside a multi-byte character decodes to a replacement character
+        deleted_dia = deleted_dia.lstrip('\ufffd')
+        return deleted_dia, len(kept) + overhead
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def _update_memory(self, memory_bytes):
+        delta = memory_bytes - self.memory_bytes
+        self.memory_bytes = memory_bytes
+        if delta and self.on_memory_change is not None:
+            self.on_memory_change(delta)
@@ -0,0 +1,108 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config.prompt_templates import PromptTemplates
+from tools.log import get_logger
+
+log = get_logger(__name__)
+
+
+class ContextCompactor(object):
+    """
+    Summarizes the oldest turns of a context into one system message.
+
+    Once a context holds more than `threshold` of its max_context tokens,
+    the oldest `compact_turns` messages are sent to the chat completion API
+    from a background thread, always leaving at least `keep_turns` recent
+    messages verbatim. The summary is swapped in with ContextHandler.compact,
+    which discards it when the turns changed in the meantime. Tokens saved
+    are recorded on each ContextHandler and summed here.
+    """
+
+    def __init__(self, requestor, prompt_manager, threshold=0.75, compact_turns=6, keep_turns=4,
+                 max_words=150, workers=1):
+        super().__init__()
+        self.requestor = requestor
+        self.prompt_manager = prompt_manager
+        self.threshold = threshold
+        self.compact_turns = compact_turns
+        self.keep_turns = keep_turns
+        self.max_words = max_words
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="context-compactor")
+        self._lock = threading.Lock()
+        self.compactions = 0
+        self.discarded = 0
+        self.failures = 0
+        self.saved_tokens = 0
+
+    @classmethod
+    def from_config(cls, requestor, prompt_manager, compaction_config):
+        return cls(requestor, prompt_manager,
+                   threshold=compaction_config.threshold,
+                   compact_turns=compaction_config.compact_turns,
+                   keep_turns=compaction_config.keep_turns,
+                   max_words=compaction_config.max_words,
+                   workers=compaction_config.workers)
+
+    def maybe_compact(self, context_handler, tokenizer):
+        """Schedule a compaction when the context crossed the threshold, returns the future or None"""
+        if context_handler.compacting:
+            return None
+        if context_handler.total_tokens < self.threshold * context_handler.max_context:
+            return None
+        if len(context_handler.context) < self.compact_turns + self.keep_turns:
+            return None
+
+        first_seq, last_seq, messages = context_handler.oldest_messages(self.compact_turns)
+        context_handler.compacting = True
+        return self.executor.submit(self._compact, context_handler, tokenizer, first_seq, last_seq, messages)
+
+    def _compact(self, context_handler, tokenizer, first_seq, last_seq, messages):
+        try:
+            transcript = "\n".join(f"{dia['role']}: {dia['content']}" for dia in messages)
+            prompt = self.prompt_manager.get_context_summary_prompt(transcript, self.max_words)
+
+            res = self.requestor.post_request([{"role": "user", "content": prompt}])
+            if res.status_code != 200:
+                # the body may echo the transcript, it is redacted unless Logging_config.log_bodies is on
+                log.error("compaction.failed", status=res.status_code, body=res.text)
+                self._count(failures=1)
+                return 0
+
+            summary = res.json()['choices'][0]['message']['content'].strip()
+            summary = PromptTemplates.CONTEXT_SUMMARY_PREFIX + summary
+            summary_length = tokenizer.num_tokens_from_message({"role": "system", "content": summary})
+
+            saved_tokens = context_handler.compact(first_seq, last_seq, summary, summary_length)
+            if saved_tokens:
+                log.info("compaction.done", turns=len(messages), saved_tokens=saved_tokens)
+                self._count(compactions=1, saved_tokens=saved_tokens)
+            else:
+                self._count(discarded=1)
+            return saved_tokens
+        except Exception as e:
+            log.exception("compaction.error", error=str(e))
+            self._count(failures=1)
+            return 0
+        finally:
+            context_handler.compacting = False
+
+    def _count(self, compactions=0, discarded=0, failures=0, saved_tokens=0):
+        with self._lock:
+            self.compactions += compactions
+            self.discarded += discarded
+            self.failures += failures
+            self.saved_tokens += saved_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                'compactions': self.compactions,
+                'discarded': self.discarded,
+                'failures': self.failures,
+                'saved_tokens': self.saved_tokens,
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
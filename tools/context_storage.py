@@ -0,0 +1,388 @@
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends to a shared log are not serialized across processes
+    fcntl = None
+
+from tools.log import get_logger
+
+log = get_logger(__name__)
+
+
+class ContextStorage(abc.ABC):
+    """
+    Storage interface behind the conversation contexts.
+
+    A stored state is the dict produced by ContextHandler.snapshot(). The
+    session store calls `load` on first access of a session, and on later
+    accesses when `version` shows a newer state; writes go through
+    WriteBehindWriter so they never block request threads.
+
+    Every write of a session carries the next `version` of its state. A
+    versioned state only replaces an older version, so a worker whose
+    context is stale cannot overwrite the turns another worker wrote.
+    """
+
+    # other processes may write the same sessions, see SessionStore(check_versions)
+    shared = True
+
+    @abc.abstractmethod
+    def load(self, session_id):
+        """Return the stored state of a session, or None"""
+
+    @abc.abstractmethod
+    def save_many(self, states):
+        """
+        Persist a batch of {session_id: state}; a None state deletes the
+        session. Returns the ids whose versioned state was refused because
+        the same or a newer version is stored already.
+        """
+
+    @abc.abstractmethod
+    def session_ids(self):
+        """Ids of all stored sessions"""
+
+    def version(self, session_id):
+        """Stored version of a session, None when it is not stored"""
+        state = self.load(session_id)
+        return None if state is None else state.get('version', 0)
+
+    def save(self, session_id, state):
+        self.save_many({session_id: state})
+
+    def delete(self, session_id):
+        self.save_many({session_id: None})
+
+    def close(self):
+        pass
+
+
+class MemoryContextStorage(ContextStorage):
+    """Process-local storage, keeps evicted sessions but does not survive a restart"""
+
+    shared = False
+
+    def __init__(self):
+        super().__init__()
+        # session_id -> (encoded state, version)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._states.get(session_id)
+        return json.loads(entry[0]) if entry is not None else None
+
+    def version(self, session_id):
+        with self._lock:
+            entry = self._states.get(session_id)
+        return entry[1] if entry is not None else None
+
+    def save_many(self, states):
+        # serialized so stored states never alias live messages
+        encoded = {session_id: json.dumps(state) if state is not None else None
+                   for session_id, state in states.items()}
+        refused = []
+        with self._lock:
+            for session_id, state in encoded.items():
+                if state is None:
+                    self._states.pop(session_id, None)
+                    continue
+                version = states[session_id].get('version')
+                stored = self._states.get(session_id)
+                if version is not None and stored is not None and stored[1] >= version:
+                    refused.append(session_id)
+                    continue
+                self._states[session_id] = (state, version or 0)
+        return refused
+
+    def session_ids(self):
+        with self._lock:
+            return list(self._states)
+
+
+class SQLiteContextStorage(ContextStorage):
+    """
+    Local SQLite storage. WAL mode lets several worker processes on the same
+    host share one database file.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:
+                # databases written before states were versioned
+                self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def version(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, states):
+        now = time.time()
+        refused = []
+        with self._lock, self._conn:
+            for session_id, state in states.items():
+                if state is None:
+                    self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                    continue
+                version = state.get('version')
+                # one statement per session, the version check and the write are atomic across processes
+                cursor = self._conn.execute(
+                    "INSERT INTO sessions (session_id, state, updated_at, version) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, "
+                    "updated_at = excluded.updated_at, version = excluded.version "
+                    "WHERE ? OR sessions.version < excluded.version",
+                    (session_id, json.dumps(state), now, version or 0, version is None),
+                )
+                if cursor.rowcount == 0:
+                    refused.append(session_id)
+        return refused
+
+    def session_ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT session_id FROM sessions")]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AppendLogContextStorage(ContextStorage):
+    """
+    Append-only log of JSON lines, one record per saved state; the last record
+    of a session wins. An offset index is kept in memory and caught up with
+    records appended by other processes before every lookup. Writers hold an
+    exclusive lock on the file while they check versions and append.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # session_id -> (offset of its latest record, version), None when deleted
+        self._index = {}
+        self._indexed_size = 0
+        self._file = open(path, 'a+b')
+        with self._lock:
+            self._catch_up()
+
+    def _catch_up(self):
+        size = os.fstat(self._file.fileno()).st_size
+        if size <= self._indexed_size:
+            return
+        self._file.seek(self._indexed_size)
+        offset = self._indexed_size
+        for line in self._file:
+            if not line.endswith(b"\n"):
+                break  # partially written record, picked up next time
+            record = json.loads(line)
+            if record.get('deleted'):
+                self._index[record['id']] = None
+            else:
+                self._index[record['id']] = (offset, record['state'].get('version', 0))
+            offset += len(line)
+        self._indexed_size = offset
+
+    def load(self, session_id):
+        with self._lock:
+            self._catch_up()
+            entry = self._index.get(session_id)
+            if entry is None:
+                return None
+            self._file.seek(entry[0])
+            return json.loads(self._file.readline())['state']
+
+    def version(self, session_id):
+        with self._lock:
+            self._catch_up()
+            entry = self._index.get(session_id)
+        return entry[1] if entry is not None else None
+
+    def save_many(self, states):
+        refused = []
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                self._catch_up()
+                lines = []
+                for session_id, state in states.items():
+                    if state is None:
+                        record = {'id': session_id, 'deleted': True}
+                    else:
+                        entry = self._index.get(session_id)
+                        version = state.get('version')
+                        if version is not None and entry is not None and entry[1] >= version:
+                            refused.append(session_id)
+                            continue
+                        record = {'id': session_id, 'state': state}
+                    lines.append(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+                # a single append keeps the batch contiguous when several processes share the log
+                self._file.write(b"".join(lines))
+                self._file.flush()
+                self._catch_up()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        return refused
+
+    def session_ids(self):
+        with self._lock:
+            self._catch_up()
+            return [session_id for session_id, entry in self._index.items() if entry is not None]
+
+    def compact(self):
+        """Rewrite the log keeping only the latest record of every live session (single process only)"""
+        with self._lock:
+            self._catch_up()
+            tmp_path = self.path + '.compact'
+            index = {}
+            with open(tmp_path, 'wb') as out:
+                for session_id, entry in self._index.items():
+                    if entry is None:
+                        continue
+                    self._file.seek(entry[0])
+                    index[session_id] = (out.tell(), entry[1])
+                    out.write(self._file.readline())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'a+b')
+            self._index = index
+            self._indexed_size = os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def build_context_storage(kind, path=None):
+    """Storage named by Session_config.storage; None keeps contexts in memory only"""
+    if kind is None:
+        return None
+    if kind == 'memory':
+        return MemoryContextStorage()
+    if kind == 'sqlite':
+        return SQLiteContextStorage(path or os.path.join('data', 'sessions.db'))
+    if kind == 'append_log':
+        return AppendLogContextStorage(path or os.path.join('data', 'sessions.log'))
+    raise ValueError(f"unknown context storage: {kind}")
+
+
+class WriteBehindWriter(object):
+    """
+    Batches context writes off the request path.
+
+    `mark_dirty` only records the handler; a background thread snapshots every
+    dirty handler and hands the batch to the storage every `flush_interval`
+    seconds, or sooner once `batch_size` sessions are pending. Repeated
+    changes to one session between flushes cost a single write.
+
+    A write refused because another worker stored a newer version of the
+    session is not retried as is: the handler is rebased on the stored state
+    first, keeping its unwritten messages, and written again.
+    """
+
+    def __init__(self, storage, flush_interval=0.5, batch_size=64):
+        super().__init__()
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._dirty = {}
+        # handlers whose snapshot is being written right now
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="context-write-behind", daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self, session_id, handler):
+        with self._lock:
+            self._dirty[session_id] = handler
+            if len(self._dirty) >= self.batch_size:
+                self._wakeup.set()
+
+    def discard(self, session_id):
+        with self._lock:
+            self._dirty.pop(session_id, None)
+
+    def pending(self, session_id):
+        """Handler of a session whose latest state is not written yet"""
+        with self._lock:
+            return self._dirty.get(session_id) or self._in_flight.get(session_id)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._in_flight = dirty
+        if not dirty:
+            return
+        snapshots = {session_id: handler.write_snapshot() for session_id, handler in dirty.items()}
+        try:
+            refused = set(self.storage.save_many({session_id: state for session_id, (state, _) in snapshots.items()}))
+        except Exception as e:
+            log.error("session.write_failed", sessions=len(dirty), error=str(e))
+            with self._lock:
+                for session_id, handler in dirty.items():
+                    self._dirty.setdefault(session_id, handler)
+                self._in_flight = {}
+            return
+
+        try:
+            for session_id, handler in dirty.items():
+                state, seq = snapshots[session_id]
+                if session_id not in refused:
+                    handler.synced(state['version'], seq)
+                    continue
+                log.warning("session.write_conflict", session_id=session_id, version=state['version'])
+                stored = self.storage.load(session_id)
+                # marks the handler dirty again when it has messages of its own to write
+                if stored is not None:
+                    handler.rebase(stored)
+        finally:
+            with self._lock:
+                self._in_flight = {}
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self.storage.close()
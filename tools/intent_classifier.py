@@ -0,0 +1,208 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import namedtuple
+
+from config.prompt_templates import PromptTemplates
+from tools.lru_cache import LRUCache
+
+# confidence of a decision taken by the rule tiers
+KEYWORD_CONFIDENCE = 1.0
+REGEX_CONFIDENCE = 0.95
+
+IntentDecision = namedtuple('IntentDecision', ['is_image', 'confidence', 'tier'])
+
+# explicit image generation phrases, previously the keyword check of detect_intent_and_generate
+IMAGE_KEYWORDS = ('generate image', 'create image', 'generate a picture', 'create a picture',
+                  '生成图片', '生成图像')
+
+_IMAGE_NOUNS = (r"(image|picture|pic|photo|drawing|illustration|painting|sketch|logo|poster|wallpaper|"
+                r"artwork|avatar|icon|portrait|cartoon|comic)s?")
+IMAGE_PATTERNS = [
+    # "draw a cat", "please paint the sea", "can you sketch me a house"
+    re.compile(r"^(please |can you |could you |would you )?(draw|paint|sketch|illustrate)\b(?! (a |the )?conclusions?)", re.I),
+    # "generate an image of ...", "make me a poster for ...", "can you design a cute cartoon avatar";
+    # verb first, so "how do I make an icon in CSS" or "show me how to render images" go to the other tiers
+    re.compile(r"^(please |can you |could you |would you )?(generate|create|make|produce|render|design|give me|show me)"
+               r" (me |us )?((an?|the|some|one|two|three|\d+) )?((?!(how|what|why|to|of)\b)\w+ ){0,2}"
+               + _IMAGE_NOUNS + r"\b", re.I),
+    # 画/绘制/生成/设计 ... 图/画/海报/头像/插画/壁纸
+    re.compile(r"^(请|帮我|给我|能不能|可以)?(画|绘制|生成|创作|设计|做).{0,12}(图|画|照片|海报|插画|头像|壁纸|标志|logo)"),
+    # 画一只狗, 帮我画个太阳
+    re.compile(r"^(请|帮我|给我)?(画|绘制)(一|个|张|幅)"),
+]
+
+_WORD_RE = re.compile(r"\w+")
+_SPACE_RE = re.compile(r"\s+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+
+def normalize_intent_input(text):
+    """
+    Canonical form of a user input for intent lookups: NFKC (folds full-width
+    and compatibility characters), casefolded, punctuation and symbols
+    dropped, whitespace collapsed.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = "".join(" " if unicodedata.category(ch)[0] in "PSZ" else ch for ch in text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _features(text, n_features):
+    """Hashed word unigrams and bigrams plus character bigrams of CJK runs"""
+    text = text.lower()
+    words = _WORD_RE.findall(text)
+    grams = ["w:" + word for word in words]
+    grams += ["b:" + a + " " + b for a, b in zip(words, words[1:])]
+    # CJK text has no spaces, character n-grams stand in for words
+    cjk = "".join(ch if _CJK_RE.match(ch) else " " for ch in text).split()
+    for run in cjk:
+        grams += ["c:" + ch for ch in run]
+        grams += ["c:" + run[i:i + 2] for i in range(len(run) - 1)]
+    # leading token, imperatives at the start carry most of the intent
+    if words:
+        grams.append("s:" + words[0])
+    if cjk:
+        grams.append("s:" + cjk[0][:1])
+
+    features = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode('utf-8')) % n_features
+        features[index] = features.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {index: value / norm for index, value in features.items()}
+
+
+class IntentClassifier(object):
+    """
+    Local image generation intent classifier for /request_smart.
+
+    Inputs go through three tiers: explicit keywords, regular expressions
+    (English and Chinese), then a hashed n-gram logistic regression trained
+    at first use from PromptTemplates.get_intent_examples(). The model's
+    decision is only trusted when its confidence reaches
+    `confidence_threshold`; below it the caller escalates to the LLM check.
+    """
+
+    def __init__(self, examples=None, confidence_threshold=0.8, n_features=2**14, epochs=200,
+                 learning_rate=4.0, l2=1e-4):
+        super().__init__()
+        self.examples = examples
+        self.confidence_threshold = confidence_threshold
+        self.n_features = n_features
+        self.epochs = epochs
+        self.learning_rate = learning_rate
+        self.l2 = l2
+
+        self._weights = None
+        self._bias = 0.0
+        self._lock = threading.Lock()
+
+    def classify(self, text):
+        """IntentDecision of the first tier that decides; model decisions carry the model confidence"""
+        lowered = text.lower()
+        if any(keyword in lowered for keyword in IMAGE_KEYWORDS):
+            return IntentDecision(True, KEYWORD_CONFIDENCE, 'keyword')
+        if any(pattern.search(text) for pattern in IMAGE_PATTERNS):
+            return IntentDecision(True, REGEX_CONFIDENCE, 'regex')
+
+        probability = self.predict_proba(text)
+        is_image = probability >= 0.5
+        return IntentDecision(is_image, probability if is_image else 1.0 - probability, 'model')
+
+    def is_confident(self, decision):
+        return decision.confidence >= self.confidence_threshold
+
+    @property
+    def trained(self):
+        """False until the model is trained; classify() may then take ~0.2 s"""
+        return self._weights is not None
+
+    def prewarm(self):
+        """Train the model in a background thread so the first request does not pay for it"""
+        thread = threading.Thread(target=self._model, name="intent-classifier-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def predict_proba(self, text):
+        """Probability that `text` asks for image generation"""
+        weights = self._model()
+        score = self._bias + sum(weights.get(index, 0.0) * value
+                                 for index, value in _features(text, self.n_features).items())
+        return 1.0 / (1.0 + math.exp(-max(min(score, 30.0), -30.0)))
+
+    def _model(self):
+        if self._weights is None:
+            with self._lock:
+                if self._weights is None:
+                    self._train()
+        return self._weights
+
+    def _train(self):
+        examples = self.examples if self.examples is not None else PromptTemplates.get_intent_examples()
+        data = [(_features(text, self.n_features), 1.0 if label else 0.0) for text, label in examples]
+
+        # full batch gradient descent on the L2 regularized log loss, deterministic, ~0.2 s
+        weights = {}
+        bias = 0.0
+        for _ in range(self.epochs):
+            gradient = {}
+            bias_gradient = 0.0
+            for features, label in data:
+                score = bias + sum(weights.get(index, 0.0) * value for index, value in features.items())
+                error = 1.0 / (1.0 + math.exp(-max(min(score, 30.0), -30.0))) - label
+                bias_gradient += error
+                for index, value in features.items():
+                    gradient[index] = gradient.get(index, 0.0) + error * value
+            step = self.learning_rate / len(data)
+            for index, value in gradient.items():
+                weights[index] = weights.get(index, 0.0) * (1.0 - self.learning_rate * self.l2) - step * value
+            bias -= step * bias_gradient
+
+        self._bias = bias
+        self._weights = weights
+
+
+class IntentCache(object):
+    """
+    Bounded LRU of intent decisions keyed on normalize_intent_input(), with
+    a TTL so a changed intent prompt or model is picked up eventually.
+    """
+
+    def __init__(self, max_entries=4096, ttl=86400):
+        super().__init__()
+        self.ttl = ttl
+        # normalized input -> (expires_at, is_image)
+        self.cache = LRUCache(max_entries=max_entries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        """Cached decision for `text`, None on a miss"""
+        key = normalize_intent_input(text)
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            self.cache.pop(key)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry[1] if entry is not None else None
+
+    def put(self, text, is_image):
+        self.cache.put(normalize_intent_input(text), (time.monotonic() + self.ttl, is_image))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.cache),
+        }
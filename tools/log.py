@@ -0,0 +1,218 @@
+"""
+Structured logging for the API.
+
+Modules take a logger with `log = get_logger(__name__)` and log events with
+keyword fields: `log.info("stream.done", tokens=120, latency=0.8)`. Fields
+that carry conversation text (messages, content, prompts, ...) are reduced to
+their size unless `log_bodies` is on, and API keys are masked. Records are
+handed to a bounded queue and written by a background thread, so a request
+thread never blocks on stdout; when the queue is full records are dropped
+and counted. Per-chunk debug events go through `log.sampled` and only a
+fraction of them is kept.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+
+from tools import metrics
+
+ROOT_LOGGER = "chatflow"
+
+# fields whose values are conversation text
+BODY_FIELDS = frozenset({'messages', 'message', 'content', 'user_input', 'prompt', 'text', 'input',
+                         'response', 'transcript', 'image_url', 'result', 'body'})
+
+_SECRET_RE = re.compile(r"\b(sk-[A-Za-z0-9]{2})[A-Za-z0-9_\-]{8,}|(Bearer\s+)[A-Za-z0-9_\-.]{8,}")
+
+
+class _Settings(object):
+    log_bodies = False
+    debug_sample_rate = 1.0
+    sample_rates = {}
+
+
+_settings = _Settings()
+_listener = None
+_handler = None
+
+
+def mask_secrets(text):
+    """Mask API keys and bearer tokens in `text`"""
+    return _SECRET_RE.sub(lambda m: (m.group(1) or m.group(2)) + "***", text)
+
+
+def _summarize(value):
+    if isinstance(value, (str, bytes)):
+        return f"<{len(value)} chars>"
+    try:
+        return f"<{type(value).__name__} of {len(value)}>"
+    except TypeError:
+        return f"<{type(value).__name__}>"
+
+
+def redact(fields):
+    """Copy of `fields` with conversation text replaced by its size, unless log_bodies is on"""
+    if _settings.log_bodies:
+        return fields
+    return {key: _summarize(value) if key in BODY_FIELDS and value is not None else value
+            for key, value in fields.items()}
+
+
+class StructuredLogger(object):
+    """Front of a logging.Logger taking an event name and keyword fields"""
+
+    def __init__(self, logger):
+        super().__init__()
+        self.logger = logger
+
+    def is_enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+    def sampled(self, event, **fields):
+        """Debug event of a hot path (one per chunk), kept at the configured sample rate"""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        rate = _settings.sample_rates.get(event, _settings.debug_sample_rate)
+        if rate < 1.0 and random.random() >= rate:
+            return
+        self._log(logging.DEBUG, event, dict(fields, sample_rate=rate))
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            # redacted in the calling thread, the writer thread must not see live conversation objects
+            self.logger.log(level, event, extra={'fields': redact(fields)}, exc_info=exc_info, stacklevel=3)
+
+
+def get_logger(name):
+    """StructuredLogger under the `chatflow` logger; `name` is usually the module's __name__"""
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+class _Formatter(logging.Formatter):
+    def _fields(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        return fields
+
+
+class JsonFormatter(_Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(self._fields(record))
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return mask_secrets(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class TextFormatter(_Formatter):
+    """`time level logger event key=value ...`"""
+
+    def format(self, record):
+        fields = self._fields(record)
+        line = "{} {:<7} {} {}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created)),
+            record.levelname, record.name, record.getMessage())
+        if fields:
+            line += " " + " ".join(f"{key}={value!r}" if isinstance(value, str) else f"{key}={value}"
+                                   for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return mask_secrets(line)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records arriving at a full queue are dropped and counted"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the queue stays in process, only freeze the message; formatting happens in the writer thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(logging_config, stream=None):
+    """
+    Route the `chatflow` loggers through a queue to a writer thread, as set
+    in Logging_config. Calling it again replaces the previous setup.
+    """
+    global _listener, _handler
+    _settings.log_bodies = logging_config.log_bodies
+    _settings.debug_sample_rate = logging_config.debug_sample_rate
+    sample_rates = getattr(logging_config, 'sample_rates', None) or {}
+    _settings.sample_rates = dict(vars(sample_rates) if hasattr(sample_rates, '__dict__') else sample_rates)
+
+    shutdown_logging()
+    root = logging.getLogger(ROOT_LOGGER)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if logging_config.format == "json" else TextFormatter())
+
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=logging_config.queue_size))
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+
+    root.addHandler(_handler)
+    root.setLevel(logging_config.level)
+    root.propagate = False
+    return _handler
+
+
+def shutdown_logging():
+    """Write out the queued records, stop the writer thread and detach the queue"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        root = logging.getLogger(ROOT_LOGGER)
+        root.removeHandler(_handler)
+        root.propagate = True
+
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
+
+
+atexit.register(shutdown_logging)
+metrics.register_callback("chatflow_log_records_dropped_total", "Log records dropped at a full queue", "counter",
+                          dropped_records)
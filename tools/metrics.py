@@ -0,0 +1,301 @@
+"""
+Prometheus metrics.
+
+Modules declare their metrics at import time
+(`REQUESTS = counter("chatflow_requests_total", "...", ("route",))`) and
+record with `REQUESTS.inc("request_openai")` or `TTFT.observe(0.4)`. Values
+are kept per thread: a writer only touches a dict of its own thread, so
+recording takes no lock and is cheap enough for per-chunk loops; the shards
+are summed when `/metrics` is scraped. A shard is retired when its thread
+ends and folded into a total the next time a thread records for the first
+time or the metric is scraped, so short-lived threads do not pile up
+shards. State that already lives elsewhere (session count, cache hit
+counts) is read by callbacks at scrape time. With Metrics_config.enabled
+off, see configure_metrics, recording is a no-op.
+"""
+
+import bisect
+import collections
+import threading
+import time
+import weakref
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# seconds, for latencies from a few ms (first token of a cached reply) to long streams
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Settings(object):
+    recording = True
+
+
+_settings = _Settings()
+
+
+class _Shard(object):
+    """Holder of one thread's values, dropped with the thread's locals when the thread ends"""
+
+    __slots__ = ('values', '__weakref__')
+
+
+class _ThreadShards(object):
+    """Per-thread value dicts of one metric, keyed by label values"""
+
+    def __init__(self, merge):
+        super().__init__()
+        self._merge = merge
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # id(values) -> values of the live threads
+        self._shards = {}
+        # values of ended threads, appended by their finalizers, which may run in any thread
+        self._ended = collections.deque()
+        self._retired = {}
+
+    def values(self):
+        """The calling thread's dict"""
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            values = shard.values = {}
+            weakref.finalize(shard, self._ended.append, values)
+            with self._lock:
+                self._retire_ended()
+                self._shards[id(values)] = values
+            return values
+
+    def collect(self):
+        """Sum of all shards"""
+        with self._lock:
+            self._retire_ended()
+            live = list(self._shards.values())
+            total = {}
+            self._merge_into(total, self._retired)
+        for values in live:
+            # a dict copy is atomic under the GIL, the owner may keep writing
+            self._merge_into(total, values.copy())
+        return total
+
+    def _retire_ended(self):
+        # under self._lock: every dict is counted either as a live shard or in the retired total
+        while self._ended:
+            values = self._ended.popleft()
+            self._shards.pop(id(values), None)
+            self._merge_into(self._retired, values)
+
+    def _merge_into(self, total, values):
+        for key, value in values.items():
+            total[key] = self._merge(total.get(key), value)
+
+
+def _add(total, value):
+    return value if total is None else total + value
+
+
+def _add_lists(total, value):
+    return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+
+class Counter(object):
+    """Monotonic count per label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _ThreadShards(_add)
+
+    def inc(self, *labels, amount=1):
+        if not _settings.recording:
+            return
+        values = self._shards.values()
+        values[labels] = values.get(labels, 0) + amount
+
+    def collect(self):
+        """[(suffix, labels, value)]"""
+        return [("", self._labels(key), value) for key, value in sorted(self._shards.collect().items())]
+
+    def _labels(self, key):
+        return tuple(zip(self.labelnames, key))
+
+
+class Gauge(Counter):
+    """Value that goes up and down, e.g. open streams; inc and dec may happen in different threads"""
+
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Counter):
+    """Observations counted into cumulative `le` buckets, with their sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _ThreadShards(_add_lists)
+
+    def observe(self, value, *labels):
+        if not _settings.recording:
+            return
+        values = self._shards.values()
+        state = values.get(labels)
+        if state is None:
+            # one slot per bucket, +Inf, sum, count
+            state = values[labels] = [0] * (len(self.buckets) + 3)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def collect(self):
+        samples = []
+        for key, state in sorted(self._shards.collect().items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                samples.append(("_bucket", labels + (("le", _format_value(bound)),), cumulative))
+            samples.append(("_sum", labels, state[-2]))
+            samples.append(("_count", labels, state[-1]))
+        return samples
+
+
+class CallbackMetric(object):
+    """
+    Metric read at scrape time from `callback`, which returns a number or a
+    dict of label values (a tuple matching `labelnames`) to numbers
+    """
+
+    def __init__(self, name, documentation, kind, callback, labelnames=()):
+        super().__init__()
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            return [("", (), values)]
+        return [("", tuple(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+
+class MetricsRegistry(object):
+    """Metrics by name; registering a name again replaces the metric"""
+
+    def __init__(self):
+        super().__init__()
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def exposition(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            try:
+                samples = metric.collect()
+            except Exception:
+                # a failing callback must not break the scrape of everything else
+                continue
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for suffix, labels, value in samples:
+                if labels:
+                    label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+                    lines.append(f"{name}{suffix}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name}{suffix} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def configure_metrics(metrics_config):
+    """Turn recording off when the /metrics endpoint is disabled"""
+    _settings.recording = bool(metrics_config.enabled)
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def register_callback(name, documentation, kind, callback, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, documentation, kind, callback, labelnames))
+
+
+def exposition():
+    return REGISTRY.exposition()
+
+
+REQUESTS = counter("chatflow_requests_total", "HTTP requests by route, method and status",
+                   ("route", "method", "status"))
+REQUEST_DURATION = histogram("chatflow_request_duration_seconds",
+                             "Seconds from request to response headers, by route", ("route",))
+
+
+def record_request(route, method, status, duration):
+    """Count a request; `route` is the endpoint name (unmatched paths share one label)"""
+    route = route or "unmatched"
+    REQUESTS.inc(route, method, str(status))
+    REQUEST_DURATION.observe(duration, route)
+
+
+class MetricsMiddleware(object):
+    """ASGI middleware recording every HTTP request, see record_request"""
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def recording_send(message):
+            if message['type'] == 'http.response.start':
+                # the router put the matched endpoint into the scope
+                endpoint = scope.get('endpoint')
+                record_request(getattr(endpoint, '__name__', None), scope['method'], message['status'],
+                               time.perf_counter() - start)
+            await send(message)
+
+        await self.app(scope, receive, recording_send)
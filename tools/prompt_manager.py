@@ -4,13 +4,16 @@ Centralized management of all prompt templates
 """
 
 import os
-import yaml
+import threading
 from typing import Dict, Any, Optional
 import sys
 
 # Add config directory to path to import prompt templates
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config'))
 from prompt_templates import PromptTemplates
+from tools.log import get_logger
+
+log = get_logger(__name__)
 
 class PromptManager:
     """
@@ -29,7 +32,35 @@ class PromptManager:
             'config', 
             'prompt_config.yaml'
         )
-        self.config = self._load_config()
+        # the YAML file is parsed on first access (or by prewarm)
+        self._config = None
+        self._config_lock = threading.Lock()
+    
+    @property
+    def config(self) -> Dict[str, Any]:
+        """
+        Prompt configuration, loaded lazily on first access
+        
+        Returns:
+            dict: Configuration dictionary
+        """
+        if self._config is None:
+            with self._config_lock:
+                if self._config is None:
+                    self._config = self._load_config()
+        return self._config
+    
+    @config.setter
+    def config(self, value: Dict[str, Any]):
+        self._config = value
+    
+    def prewarm(self):
+        """
+        Load the configuration in a background thread
+        """
+        thread = threading.Thread(target=lambda: self.config, name="prompt-config-prewarm", daemon=True)
+        thread.start()
+        return thread
     
     def _load_config(self) -> Dict[str, Any]:
         """
@@ -40,15 +71,17 @@ class PromptManager:
         """
         try:
             if os.path.exists(self.config_path):
+                import yaml
+
                 with open(self.config_path, 'r', encoding='utf-8') as file:
                     config = yaml.safe_load(file)
-                    print(f"Loaded prompt configuration from {self.config_path}")
+                    log.info("prompts.loaded", path=self.config_path)
                     return config or {}
             else:
-                print(f"Configuration file not found at {self.config_path}, using defaults")
+                log.warning("prompts.config_missing", path=self.config_path)
                 return {}
         except Exception as e:
-            print(f"Error loading prompt configuration: {e}, using defaults")
+            log.error("prompts.load_failed", path=self.config_path, error=str(e))
             return {}
     
     def get_intent_detection_prompt(self, user_input):
@@ -128,6 +161,19 @@ class PromptManager:
             'prompt_injection_check': PromptTemplates.PROMPT_INJECTION_CHECK
         }
     
+    def get_context_summary_prompt(self, transcript, max_words=150):
+        """
+        Get formatted prompt for summarizing old conversation turns
+        
+        Args:
+            transcript (str): The turns to summarize, one "role: content" per line
+            max_words (int): Upper bound on the summary length
+            
+        Returns:
+            str: Formatted summary prompt
+        """
+        return PromptTemplates.get_context_summary_prompt(transcript, max_words)
+    
     def get_content_safety_prompt(self, content):
         """
         Get formatted content safety prompt
@@ -202,11 +248,11 @@ class PromptManager:
         """
         # For now, update in config to override template defaults
         if template_name in ['system_prompt', 'error_response']:
-            print(f"Template update requested for {template_name}")
+            log.info("prompts.template_update", template=template_name)
             # This could be extended to update YAML config file
         else:
-            print(f"Template {template_name} is managed in prompt_templates.py")
-            print("Please edit the template file directly for permanent changes")
+            log.warning("prompts.template_readonly", template=template_name,
+                        hint="edit config/prompt_templates.py for permanent changes")
     
     def get_all_templates(self):
         """
@@ -229,6 +275,7 @@ class PromptManager:
             'system_prompts', 
             'vision_prompt',
             'dalle_enhancement',
+            'context_summary',
             'error_responses',
             'validation_prompts',
             'voice_prompts',
@@ -263,7 +310,7 @@ class PromptManager:
         Reload configuration from file
         """
         self.config = self._load_config()
-        print("Prompt configuration reloaded")
+        log.info("prompts.reloaded", path=self.config_path)
     
     def get_intent_detection_settings(self):
         """
@@ -275,7 +322,9 @@ class PromptManager:
         return self.config.get('intent_detection', {
             'confidence_threshold': 0.8,
             'fallback_to_text': True,
-            'debug_logging': True
+            'debug_logging': True,
+            'local_classifier': True,
+            'speculative': True
         })
     
     def get_tts_settings(self):
@@ -0,0 +1,346 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from tools.lru_cache import LRUCache
+from tools.sse_decoder import SSEDecoder, parse_delta
+
+# payload fields that do not change the completion itself
+_TRANSPORT_FIELDS = ('stream', 'stream_options')
+
+# accounted overhead of one memory entry besides its encoded body
+_ENTRY_OVERHEAD_BYTES = 32 + 64 + 64
+
+
+def completion_from_json(body):
+    """The cached form of a chat completion response body"""
+    choice = body['choices'][0]
+    return {
+        'model': body.get('model'),
+        'content': choice['message']['content'],
+        'finish_reason': choice.get('finish_reason'),
+        'usage': body.get('usage'),
+    }
+
+
+class ResponseCache(object):
+    """
+    Cache of chat completions keyed on a canonical hash of the request payload.
+
+    The memory tier is an LRU bounded by entry count and encoded size; the
+    optional disk tier (SQLite) is bounded by size and evicts the oldest
+    entries first. Entries expire after `ttl` seconds in both tiers. A disk
+    hit is promoted to memory.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16*1024*1024, ttl=3600, disk_path=None,
+                 disk_max_bytes=256*1024*1024):
+        super().__init__()
+        self.ttl = ttl
+        # key -> (expires_at, encoded completion)
+        self.memory = LRUCache(max_entries=max_entries, max_bytes=max_bytes,
+                               sizeof=lambda key, value: _ENTRY_OVERHEAD_BYTES + len(value[1]))
+        self.disk = _DiskTier(disk_path, disk_max_bytes) if disk_path else None
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, cache_config):
+        """A ResponseCache for Response_cache_config, or None when it is disabled"""
+        if not cache_config.enabled:
+            return None
+        return cls(max_entries=cache_config.max_entries,
+                   max_bytes=cache_config.max_mb * 1024 * 1024,
+                   ttl=cache_config.ttl,
+                   disk_path=cache_config.disk_path,
+                   disk_max_bytes=cache_config.disk_max_mb * 1024 * 1024)
+
+    @staticmethod
+    def key(payload):
+        """Hash of model, messages and generation parameters; streamed and plain requests share it"""
+        canonical = {k: v for k, v in payload.items() if k not in _TRANSPORT_FIELDS}
+        encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.blake2b(encoded.encode('utf-8'), digest_size=20).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._count(hits=1)
+                return json.loads(entry[1])
+            self.memory.pop(key)
+
+        if self.disk is not None:
+            entry = self.disk.get(key, now)
+            if entry is not None:
+                self.memory.put(key, entry)
+                self._count(hits=1, disk_hits=1)
+                return json.loads(entry[1])
+
+        self._count(misses=1)
+        return None
+
+    def put(self, key, completion):
+        entry = (time.time() + self.ttl, json.dumps(completion, ensure_ascii=False))
+        self.memory.put(key, entry)
+        if self.disk is not None:
+            self.disk.put(key, entry)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def _count(self, hits=0, disk_hits=0, misses=0):
+        with self._lock:
+            self.hits += hits
+            self.disk_hits += disk_hits
+            self.misses += misses
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.memory),
+            'bytes': self.memory.total_bytes,
+        }
+        if self.disk is not None:
+            stats['disk_bytes'] = self.disk.total_bytes
+        return stats
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+class _DiskTier(object):
+    """SQLite table of encoded completions, trimmed oldest first once over `max_bytes`"""
+
+    def __init__(self, path, max_bytes):
+        super().__init__()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, size INTEGER NOT NULL, body TEXT NOT NULL)"
+            )
+            self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key, now):
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at, body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return row[0], row[1]
+
+    def put(self, key, entry):
+        expires_at, body = entry
+        size = len(body)
+        with self._lock, self._conn:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, expires_at, size, body) VALUES (?, ?, ?, ?)",
+                (key, expires_at, size, body),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict(time.time())
+
+    def _evict(self, now):
+        # expired entries first, then the entries that expire soonest (the oldest, all share one ttl)
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY expires_at").fetchall():
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+            self.total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedResponse(object):
+    """
+    Stand-in for an HTTP response that replays a cached completion.
+
+    For plain requests `json()` returns a chat.completion body. For streamed
+    requests the completion is replayed as `chat.completion.chunk` SSE events
+    (iter_content / aiter_bytes, or iter_lines / aiter_lines), ending with the usage chunk when asked for
+    and `data: [DONE]`, so stream consumers cannot tell the difference.
+    """
+
+    status_code = 200
+    from_cache = True
+
+    def __init__(self, completion, include_usage=False, chunk_chars=16):
+        super().__init__()
+        self.completion = completion
+        self.include_usage = include_usage
+        self.chunk_chars = chunk_chars
+
+    def json(self):
+        completion = self.completion
+        return {
+            'object': 'chat.completion',
+            'model': completion['model'],
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': completion['content']},
+                'finish_reason': completion['finish_reason'],
+            }],
+            'usage': completion['usage'],
+        }
+
+    @property
+    def text(self):
+        return json.dumps(self.json(), ensure_ascii=False)
+
+    def sse_lines(self):
+        completion = self.completion
+        content = completion['content'] or ''
+
+        def chunk(delta, finish_reason=None):
+            return 'data: ' + json.dumps({
+                'object': 'chat.completion.chunk',
+                'model': completion['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }, ensure_ascii=False)
+
+        yield chunk({'role': 'assistant', 'content': ''})
+        for start in range(0, len(content), self.chunk_chars):
+            yield chunk({'content': content[start:start + self.chunk_chars]})
+        yield chunk({}, completion['finish_reason'] or 'stop')
+        if self.include_usage and completion['usage']:
+            yield 'data: ' + json.dumps({'object': 'chat.completion.chunk', 'model': completion['model'],
+                                         'choices': [], 'usage': completion['usage']})
+        yield 'data: [DONE]'
+
+    def iter_lines(self):
+        for line in self.sse_lines():
+            yield line.encode('utf-8')
+
+    async def aiter_lines(self):
+        for line in self.sse_lines():
+            yield line
+
+    def iter_content(self, chunk_size=None):
+        for line in self.sse_lines():
+            yield (line + '\n\n').encode('utf-8')
+
+    async def aiter_bytes(self):
+        for chunk in self.iter_content():
+            yield chunk
+
+    async def aread(self):
+        return self.text.encode('utf-8')
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class _StreamRecorder(object):
+    """Collects the deltas of a streamed completion and stores it once the stream completed"""
+
+    def __init__(self, cache, key):
+        super().__init__()
+        self.cache = cache
+        self.key = key
+        self.decoder = SSEDecoder()
+        self.model = None
+        self.parts = []
+        self.finish_reason = None
+        self.usage = None
+
+    def feed(self, chunk):
+        """Feed raw stream bytes"""
+        if not self.decoder.done:
+            self._record(self.decoder.feed(chunk))
+
+    def finish(self):
+        """The stream was read to its end; an unterminated last event still counts"""
+        self._record(self.decoder.flush())
+
+    def _record(self, events):
+        for data in events:
+            try:
+                delta = parse_delta(data)
+            except ValueError:
+                continue
+            if delta is None:
+                if self.finish_reason is not None:
+                    self.cache.put(self.key, {'model': self.model, 'content': ''.join(self.parts),
+                                              'finish_reason': self.finish_reason, 'usage': self.usage})
+                return
+            if self.model is None and b'"model":' in data:
+                self.model = json.loads(data).get('model')
+            if delta.content:
+                self.parts.append(delta.content)
+            if delta.finish_reason:
+                self.finish_reason = delta.finish_reason
+            if delta.usage:
+                self.usage = delta.usage
+
+
+class RecordingResponse(object):
+    """
+    Wraps a streamed response (requests or httpx) and caches the completion
+    it carried once the consumer read it up to `data: [DONE]`. Streams that
+    are abandoned early are not cached.
+    """
+
+    def __init__(self, response, cache, key):
+        super().__init__()
+        self._response = response
+        self._recorder = _StreamRecorder(cache, key)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def iter_content(self, *args, **kwargs):
+        for chunk in self._response.iter_content(*args, **kwargs):
+            self._recorder.feed(chunk)
+            yield chunk
+        self._recorder.finish()
+
+    async def aiter_bytes(self, *args, **kwargs):
+        async for chunk in self._response.aiter_bytes(*args, **kwargs):
+            self._recorder.feed(chunk)
+            yield chunk
+        self._recorder.finish()
+
+    def iter_lines(self, *args, **kwargs):
+        for line in self._response.iter_lines(*args, **kwargs):
+            self._recorder.feed((line if isinstance(line, bytes) else line.encode('utf-8')) + b"\n")
+            yield line
+
+    async def aiter_lines(self):
+        async for line in self._response.aiter_lines():
+            self._recorder.feed(line.encode('utf-8') + b"\n")
+            yield line
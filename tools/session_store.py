@@ -0,0 +1,200 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+DEFAULT_SESSION_ID = "default"
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class SessionStore(object):
+    """
+    In-memory store holding one ContextHandler per conversation.
+
+    Sessions are kept in LRU order. A session is dropped when it has been idle
+    for longer than `idle_ttl` seconds, when more than `max_sessions` are open,
+    or when the summed context size exceeds `max_memory_bytes`; the least
+    recently used sessions go first.
+
+    With a `writer` (WriteBehindWriter) every context change is persisted in
+    the background and dropped sessions are reloaded from its storage on their
+    next access. With `lazy_load` off, stored sessions are loaded up front.
+    Storage reads happen outside the store lock, and concurrent first accesses
+    of one session share a single load; async callers use aget(), which does
+    the storage I/O on a worker thread.
+
+    With `check_versions` (the default for storages shared by several worker
+    processes) every access compares the stored version of the session with
+    the one in memory and picks up turns another worker wrote meanwhile, so
+    requests of one conversation need not stick to one worker.
+    """
+
+    def __init__(self, context_factory, max_sessions=1000, idle_ttl=1800, max_memory_bytes=None,
+                 writer=None, lazy_load=True, check_versions=None):
+        super().__init__()
+        self.context_factory = context_factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_memory_bytes = max_memory_bytes
+        self.writer = writer
+        if check_versions is None:
+            check_versions = writer is not None and writer.storage.shared
+        self.check_versions = check_versions and writer is not None
+
+        # session_id -> [context_handler, last_access]
+        self._sessions = OrderedDict()
+        # session_id -> Event set when its load finished
+        self._loading = {}
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self.evictions = 0
+
+        if writer is not None and not lazy_load:
+            for session_id in writer.storage.session_ids()[:max_sessions]:
+                self.get(session_id)
+
+    def get(self, session_id=None):
+        """Return the ContextHandler of a session, creating it when missing"""
+        session_id = session_id or DEFAULT_SESSION_ID
+        handler = self._touch(session_id)
+        if handler is None:
+            return self._load(session_id)
+        if self.check_versions:
+            self._refresh(session_id, handler)
+        return handler
+
+    async def aget(self, session_id=None):
+        """get() for the event loop, storage reads run on a worker thread"""
+        session_id = session_id or DEFAULT_SESSION_ID
+        if not self.check_versions:
+            handler = self._touch(session_id)
+            if handler is not None:
+                return handler
+            if self.writer is None:
+                return self._load(session_id)
+        return await asyncio.to_thread(self.get, session_id)
+
+    def _touch(self, session_id):
+        """The resident handler of a session, marked as used, or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            entry[1] = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now, keep=session_id)
+            return entry[0]
+
+    def _load(self, session_id):
+        while True:
+            with self._lock:
+                entry = self._sessions.get(session_id)
+                if entry is not None:
+                    return entry[0]
+                loading = self._loading.get(session_id)
+                if loading is None:
+                    loading = self._loading[session_id] = threading.Event()
+                    break
+            # another thread is loading this session
+            loading.wait()
+
+        try:
+            handler = self._open(session_id)
+            now = time.monotonic()
+            with self._lock:
+                handler.on_memory_change = self._on_memory_change
+                self._memory_bytes += handler.memory_bytes
+                self._sessions[session_id] = [handler, now]
+                self._evict(now, keep=session_id)
+            return handler
+        finally:
+            with self._lock:
+                del self._loading[session_id]
+            loading.set()
+
+    def _refresh(self, session_id, handler):
+        """Pick up a newer state another worker stored for a resident session"""
+        storage = self.writer.storage
+        version = storage.version(session_id)
+        if version is not None and version > handler.version:
+            state = storage.load(session_id)
+            if state is not None:
+                handler.rebase(state)
+
+    def drop(self, session_id):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._release(entry[0])
+        if self.writer is not None:
+            self.writer.discard(session_id)
+            self.writer.storage.delete(session_id)
+        return entry is not None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def _open(self, session_id):
+        if self.writer is None:
+            return self.context_factory()
+
+        # an evicted session may still have an unwritten change, reuse that handler
+        handler = self.writer.pending(session_id)
+        if handler is None:
+            handler = self.context_factory()
+            state = self.writer.storage.load(session_id)
+            if state is not None:
+                handler.restore(state)
+
+        writer = self.writer
+        handler.on_change = lambda changed: writer.mark_dirty(session_id, changed)
+        return handler
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @property
+    def memory_bytes(self):
+        return self._memory_bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'memory_bytes': self._memory_bytes,
+                'evictions': self.evictions,
+            }
+
+    def _on_memory_change(self, delta):
+        with self._lock:
+            self._memory_bytes += delta
+
+    def _release(self, handler):
+        handler.on_memory_change = None
+        self._memory_bytes -= handler.memory_bytes
+
+    def _evict(self, now, keep):
+        # the LRU end holds the oldest access, so expired sessions are always in front
+        while self._sessions:
+            session_id, (handler, last_access) = next(iter(self._sessions.items()))
+            if session_id == keep:
+                break
+            over_ttl = self.idle_ttl is not None and now - last_access > self.idle_ttl
+            over_count = self.max_sessions is not None and len(self._sessions) > self.max_sessions
+            over_memory = self.max_memory_bytes is not None and self._memory_bytes > self.max_memory_bytes
+            if not (over_ttl or over_count or over_memory):
+                break
+            self._sessions.popitem(last=False)
+            self._release(handler)
+            self.evictions += 1
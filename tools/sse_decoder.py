@@ -0,0 +1,166 @@
+from collections import namedtuple
+
+from tools.log import get_logger
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    import json
+
+    _loads = json.loads
+
+log = get_logger(__name__)
+
+# one chat.completion.chunk: the text of choices[0].delta, its finish_reason and the usage when sent
+StreamDelta = namedtuple('StreamDelta', ['content', 'finish_reason', 'usage'])
+
+DONE = b"[DONE]"
+
+# markers of the fast path; JSON strings escape quotes, so none of them can occur inside a string value
+_DELTA = b'"delta":{'
+_CONTENT = b'"content":"'
+_ROLE_CONTENT = b'"role":"assistant","content":"'
+
+
+class SSEDecoder(object):
+    """
+    Incremental Server-Sent Events decoder over raw bytes.
+
+    `feed` takes chunks as they come off the socket, cut anywhere (inside a
+    line, between \\r and \\n, inside a UTF-8 sequence), and returns the data
+    of every event completed so far; the data lines of one event are joined
+    with \\n. Comments and the event, id and retry fields are skipped.
+    `done` is set once the [DONE] event arrived; nothing after it is decoded.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.done = False
+        self._buffer = b""
+        self._data = []
+        # the last chunk ended with \r, a \n starting the next one belongs to it
+        self._skip_lf = False
+
+    def feed(self, chunk):
+        if self._skip_lf:
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        if self._buffer:
+            chunk = self._buffer + chunk
+            self._buffer = b""
+        if not chunk:
+            return []
+
+        lines = chunk.splitlines(True)
+        last = lines[-1]
+        if last[-1:] not in b"\r\n":
+            self._buffer = lines.pop()
+        elif last[-1:] == b"\r":
+            self._skip_lf = True
+
+        events = []
+        data = self._data
+        for line in lines:
+            line = line.rstrip(b"\r\n")
+            if not line:
+                if data:
+                    event = data[0] if len(data) == 1 else b"\n".join(data)
+                    data = self._data = []
+                    events.append(event)
+                    if event == DONE:
+                        self.done = True
+                        break
+            elif line[:5] == b"data:":
+                data.append(line[6:] if line[5:6] == b" " else line[5:])
+            # ":" comments, event / id / retry fields and unknown fields carry nothing we use
+        return events
+
+    def flush(self):
+        """Data of an event the stream ended without terminating, servers often omit the last blank line"""
+        if self._buffer:
+            self.feed(b"\n")
+        data, self._data = self._data, []
+        if not data or self.done:
+            return []
+        return [b"\n".join(data)]
+
+
+def parse_delta(data):
+    """
+    StreamDelta of one event's data, None for [DONE]. The content of plain
+    text chunks is sliced out of the bytes without decoding the chunk;
+    anything else (escapes, finish_reason, usage, tool calls, other layouts)
+    goes through the JSON decoder. Raises ValueError on malformed JSON.
+    """
+    if data == DONE:
+        return None
+    start = data.find(_DELTA)
+    if start >= 0:
+        start += len(_DELTA)
+        if data.startswith(_CONTENT, start):
+            start += len(_CONTENT)
+        elif data.startswith(_ROLE_CONTENT, start):
+            start += len(_ROLE_CONTENT)
+        else:
+            start = -1
+        if start >= 0:
+            end = data.find(b'"', start)
+            if (end >= 0 and data.find(b"\\", start, end) < 0
+                    and b'"usage":{' not in data and b'"finish_reason":"' not in data):
+                return StreamDelta(data[start:end].decode('utf-8'), None, None)
+
+    chunk = _loads(data)
+    choices = chunk.get('choices')
+    if choices:
+        choice = choices[0]
+        content = (choice.get('delta') or {}).get('content') or ''
+        return StreamDelta(content, choice.get('finish_reason'), chunk.get('usage'))
+    return StreamDelta('', None, chunk.get('usage'))
+
+
+def response_chunks(response):
+    """
+    Raw bytes of a streamed requests response as they arrive: one HTTP
+    chunk at a time for chunked responses, 512 byte reads otherwise (a
+    read of unbounded size would wait for the end of the body)
+    """
+    raw = getattr(response, 'raw', None)
+    chunked = getattr(raw, 'chunked', True)
+    return response.iter_content(chunk_size=None if chunked else 512)
+
+
+def _deltas(events):
+    for data in events:
+        try:
+            delta = parse_delta(data)
+        except ValueError as e:
+            log.warning("sse.decode_error", error=str(e), body=data[:200])
+            continue
+        if delta is None:
+            return
+        yield delta
+
+
+def iter_deltas(byte_chunks):
+    """StreamDelta of every chunk in a chat completion stream of raw bytes, up to [DONE]"""
+    decoder = SSEDecoder()
+    for chunk in byte_chunks:
+        yield from _deltas(decoder.feed(chunk))
+        if decoder.done:
+            return
+    yield from _deltas(decoder.flush())
+
+
+async def aiter_deltas(byte_chunks):
+    """Async twin of iter_deltas over an async iterator of bytes"""
+    decoder = SSEDecoder()
+    async for chunk in byte_chunks:
+        for delta in _deltas(decoder.feed(chunk)):
+            yield delta
+        if decoder.done:
+            return
+    for delta in _deltas(decoder.flush()):
+        yield delta
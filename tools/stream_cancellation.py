@@ -0,0 +1,82 @@
+import threading
+
+
+class CancellationTracker(object):
+    """
+    Counts completion streams that were closed before the upstream finished,
+    and estimates the completion tokens that were not generated because of
+    it: the request's token budget when it had one, otherwise the mean
+    length of the completions that ran to the end, minus what was produced.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.completed_tokens = 0
+        self.cancelled = 0
+        self.cancelled_tokens = 0
+        self.saved_tokens = 0
+
+    def record_completed(self, tokens):
+        with self._lock:
+            self.completed += 1
+            self.completed_tokens += tokens
+
+    def record_cancelled(self, tokens, max_tokens=None):
+        """Record a stream cancelled after `tokens` completion tokens, returns the estimated tokens saved"""
+        with self._lock:
+            if max_tokens:
+                expected = max_tokens
+            elif self.completed:
+                expected = self.completed_tokens / self.completed
+            else:
+                expected = tokens
+            saved = max(int(expected) - tokens, 0)
+            self.cancelled += 1
+            self.cancelled_tokens += tokens
+            self.saved_tokens += saved
+            return saved
+
+    def stats(self):
+        with self._lock:
+            return {
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'cancelled_tokens': self.cancelled_tokens,
+                'saved_tokens': self.saved_tokens,
+            }
+
+
+class DeferredCommit(object):
+    """
+    Holds back the commit of a speculative text stream until its intent is
+    known. The stream hands its commit over with `submit`, whether it ran to
+    the end or was closed; `resolve(keep)` runs it, or runs it as discarded
+    when an image replaced the answer. Only the first resolve counts.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        # None until resolved, then whether the answer is kept
+        self._keep = None
+        self._commit = None
+
+    def submit(self, commit):
+        """`commit(discarded)` now if the intent is known, else once it is"""
+        with self._lock:
+            if self._keep is None:
+                self._commit = commit
+                return
+            keep = self._keep
+        commit(not keep)
+
+    def resolve(self, keep):
+        with self._lock:
+            if self._keep is not None:
+                return
+            self._keep = keep
+            commit, self._commit = self._commit, None
+        if commit is not None:
+            commit(not keep)
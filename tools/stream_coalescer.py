@@ -0,0 +1,274 @@
+import asyncio
+import contextvars
+import json
+import queue
+import threading
+import time
+
+from tools import metrics
+from tools.log import get_logger
+from tools.tracing import current_span
+
+log = get_logger(__name__)
+
+STREAMS_ACTIVE = metrics.gauge("chatflow_streams_active", "SSE streams open to clients", ("route",))
+TIME_TO_FIRST_TOKEN = metrics.histogram("chatflow_time_to_first_token_seconds",
+                                        "Seconds from the start of a stream to its first text frame", ("route",))
+STREAM_DURATION = metrics.histogram("chatflow_stream_duration_seconds",
+                                    "Seconds streams stayed open, by route and outcome", ("route", "outcome"))
+STREAM_CHUNKS = metrics.counter("chatflow_stream_chunks_total", "Text chunks sent to clients", ("route",))
+STREAM_FRAMES = metrics.counter("chatflow_stream_frames_total", "SSE frames sent to clients", ("route",))
+
+# constant parts of a success frame, the chunk string is serialized in between; the frame is
+# byte for byte what json.dumps({'code': 0, 'message': 'success', 'chunk': chunk}) framed used to be
+CHUNK_FRAME_PREFIX = 'data: {"code": 0, "message": "success", "chunk": '
+CHUNK_FRAME_SUFFIX = '}\n\n'
+DONE_FRAME = "data: [DONE]\n\n"
+
+_END = object()
+
+
+class _Failure(object):
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+
+def chunk_frame(chunk):
+    return CHUNK_FRAME_PREFIX + json.dumps(chunk) + CHUNK_FRAME_SUFFIX
+
+
+def error_frame(message, error):
+    return f"data: {json.dumps({'code': 1, 'message': message, 'chunk': str(error)})}\n\n"
+
+
+class StreamCoalescer(object):
+    """
+    Turns a stream of text chunks into SSE frames for the client.
+
+    The first chunk is sent at once; later chunks are batched into one frame
+    until `max_bytes` of text are pending or `max_delay` seconds passed since
+    the oldest pending one. The upstream is read ahead into a queue of
+    `max_pending` chunks; when the client does not take anything for
+    `slow_client_timeout` seconds with the queue full, or goes away, the
+    upstream stream is closed so it stops consuming tokens.
+    """
+
+    def __init__(self, max_delay=0.02, max_bytes=256, max_pending=1024, slow_client_timeout=10.0):
+        super().__init__()
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.slow_client_timeout = slow_client_timeout
+
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.chunk_count = 0
+        self.frame_count = 0
+        self.slow_clients = 0
+        self.disconnects = 0
+
+    @classmethod
+    def from_config(cls, downstream_config):
+        return cls(max_delay=downstream_config.coalesce_ms / 1000,
+                   max_bytes=downstream_config.coalesce_bytes,
+                   max_pending=downstream_config.max_pending_chunks,
+                   slow_client_timeout=downstream_config.slow_client_timeout)
+
+    def frames(self, chunks, error_message, route="unknown"):
+        """SSE frames of a chunk generator; the generator is drained from a reader thread"""
+        pending = queue.Queue(maxsize=self.max_pending)
+        stop = threading.Event()
+
+        def put(item):
+            # short waits so a gone client (stop) is noticed while the queue is full
+            waited = 0.0
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    waited += 0.1
+                    if item is not _END and waited >= self.slow_client_timeout:
+                        self._slow_client()
+                        return False
+            return False
+
+        def produce():
+            try:
+                for chunk in chunks:
+                    if stop.is_set() or not put(chunk):
+                        break
+            except Exception as e:
+                put(_Failure(e))
+            finally:
+                chunks.close()
+                put(_END)
+
+        # the reader runs the generator under the request's trace
+        threading.Thread(target=contextvars.copy_context().run, args=(produce,), name="sse-reader", daemon=True).start()
+        self._count(streams=1)
+
+        batcher = _Batcher(self, current_span(), route)
+        finished = False
+        try:
+            while True:
+                try:
+                    item = pending.get(timeout=batcher.timeout())
+                except queue.Empty:
+                    yield batcher.flush()
+                    continue
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    if batcher.buffer:
+                        yield batcher.flush()
+                    yield error_frame(error_message, item.error)
+                    continue
+                frame = batcher.add(item)
+                if frame is not None:
+                    yield frame
+            if batcher.buffer:
+                yield batcher.flush()
+            finished = True
+            yield DONE_FRAME
+        finally:
+            if not finished:
+                self._count(disconnects=1)
+            batcher.close(finished)
+            stop.set()
+
+    async def aframes(self, chunks, error_message, route="unknown"):
+        """Async twin of frames; the async generator is drained from a task"""
+        pending = asyncio.Queue(maxsize=self.max_pending)
+        stop = asyncio.Event()
+
+        async def produce():
+            try:
+                async for chunk in chunks:
+                    if stop.is_set():
+                        break
+                    # wait_for only when the queue is full, it can swallow a cancellation arriving as the put completes
+                    try:
+                        pending.put_nowait(chunk)
+                        continue
+                    except asyncio.QueueFull:
+                        pass
+                    try:
+                        await asyncio.wait_for(pending.put(chunk), self.slow_client_timeout)
+                    except asyncio.TimeoutError:
+                        self._slow_client()
+                        break
+            except Exception as e:
+                await pending.put(_Failure(e))
+            finally:
+                await chunks.aclose()
+            await pending.put(_END)
+
+        producer = asyncio.ensure_future(produce())
+        self._count(streams=1)
+
+        batcher = _Batcher(self, current_span(), route)
+        finished = False
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(pending.get(), batcher.timeout())
+                except asyncio.TimeoutError:
+                    yield batcher.flush()
+                    continue
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    if batcher.buffer:
+                        yield batcher.flush()
+                    yield error_frame(error_message, item.error)
+                    continue
+                frame = batcher.add(item)
+                if frame is not None:
+                    yield frame
+            if batcher.buffer:
+                yield batcher.flush()
+            finished = True
+            yield DONE_FRAME
+        finally:
+            if not finished:
+                self._count(disconnects=1)
+            batcher.close(finished)
+            stop.set()
+            if not producer.done():
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+
+    def _slow_client(self):
+        log.warning("stream.slow_client", timeout=self.slow_client_timeout)
+        self._count(slow_clients=1)
+
+    def _count(self, streams=0, chunks=0, frames=0, slow_clients=0, disconnects=0):
+        with self._lock:
+            self.streams += streams
+            self.chunk_count += chunks
+            self.frame_count += frames
+            self.slow_clients += slow_clients
+            self.disconnects += disconnects
+
+    def stats(self):
+        with self._lock:
+            return {
+                'streams': self.streams,
+                'chunks': self.chunk_count,
+                'frames': self.frame_count,
+                'slow_clients': self.slow_clients,
+                'disconnects': self.disconnects,
+            }
+
+
+class _Batcher(object):
+    """Pending text of one stream and its flush deadline"""
+
+    def __init__(self, coalescer, span, route):
+        super().__init__()
+        self.coalescer = coalescer
+        self.span = span
+        self.route = route
+        self.start = time.monotonic()
+        STREAMS_ACTIVE.inc(route)
+        self.buffer = []
+        self.size = 0
+        self.deadline = None
+        self.first = True
+
+    def timeout(self):
+        """Seconds until the pending text is due, None while nothing is pending"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def add(self, chunk):
+        """Buffer `chunk`, returns a frame when it is due right away"""
+        self.buffer.append(chunk)
+        self.size += len(chunk.encode('utf-8'))
+        if self.first or self.size >= self.coalescer.max_bytes:
+            if self.first:
+                self.first = False
+                self.span.add_event("first_token_to_client")
+                TIME_TO_FIRST_TOKEN.observe(time.monotonic() - self.start, self.route)
+            return self.flush()
+        if self.deadline is None:
+            self.deadline = time.monotonic() + self.coalescer.max_delay
+        return None
+
+    def flush(self):
+        chunks = len(self.buffer)
+        text = self.buffer[0] if chunks == 1 else "".join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        self.deadline = None
+        self.coalescer._count(chunks=chunks, frames=1)
+        STREAM_CHUNKS.inc(self.route, amount=chunks)
+        STREAM_FRAMES.inc(self.route)
+        return chunk_frame(text)
+
+    def close(self, finished):
+        STREAMS_ACTIVE.dec(self.route)
+        STREAM_DURATION.observe(time.monotonic() - self.start, self.route, "completed" if finished else "disconnected")
@@ -1,14 +1,298 @@
+import hashlib
+import os
+import shutil
+import threading
+from array import array
+
 import tiktoken
 
+from tools.log import get_logger
+from tools.lru_cache import LRUCache
+
+log = get_logger(__name__)
+
+# accounted size of one cached count: 16 byte digest + int + OrderedDict slot
+_COUNT_ENTRY_BYTES = 16 + 28 + 64
+# cached token ids are packed 4 bytes each; the array header and the slot come on top
+_IDS_ENTRY_BYTES = 16 + 64 + 64
+
+# where tiktoken downloads the BPE ranks of an encoding from, also its cache key
+ENCODING_URL = "https://openaipublic.blob.core.windows.net/encodings/{}.tiktoken"
+
+
+def configure_encoding_cache(cache_dir=None, encoding_files=None):
+    """
+    Make tiktoken load its BPE files from a local cache instead of downloading
+    them at boot. `encoding_files` maps encoding names (e.g. cl100k_base) to
+    local .tiktoken files, which are copied into the cache under the key
+    tiktoken looks up.
+    """
+    if not cache_dir:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+    for encoding_name, path in (encoding_files or {}).items():
+        cache_key = hashlib.sha1(ENCODING_URL.format(encoding_name).encode()).hexdigest()
+        target = os.path.join(cache_dir, cache_key)
+        if not os.path.exists(target):
+            shutil.copyfile(path, target)
+
+
+# fixed tokens the chat format spends on every message (<|start|>{role}\n ... <|end|>),
+# on a message name, and on priming the assistant reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_PRIMING_TOKENS = 3
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# model name prefixes, most specific first, checked before tiktoken's own table
+# so that newer models resolve even on an older tiktoken
+MODEL_PREFIX_ENCODINGS = (
+    ("gpt-4o", "o200k_base"),
+    ("chatgpt-4o", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("gpt-4.5", "o200k_base"),
+    ("gpt-5", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+    ("gpt-35", "cl100k_base"),
+)
+
+
+def _content_key(query_string):
+    return hashlib.blake2b(query_string.encode('utf-8'), digest_size=16).digest()
+
+
+def encoding_name_for_model(model_name, overrides=None):
+    """Name of the tiktoken encoding a chat model uses"""
+    if overrides and model_name in overrides:
+        return overrides[model_name]
+    for prefix, encoding_name in MODEL_PREFIX_ENCODINGS:
+        if model_name.startswith(prefix):
+            return encoding_name
+    try:
+        return tiktoken.encoding_name_for_model(model_name)
+    except (KeyError, AttributeError):
+        return DEFAULT_ENCODING
+
 
 class Tokennizer(object):
 
-    def __init__(self,model_name):
+    def __init__(self,model_name,cache_entries=4096,cache_bytes=4*1024*1024,batch_threads=4,encoding_name=None,
+                 ids_cache_bytes=8*1024*1024):
         super().__init__()
-        self.encoding = tiktoken.encoding_for_model(model_name)
+        self.model_name = model_name
+        # an explicit encoding name skips the model lookup (used by TokenizerRegistry)
+        self.encoding_name = encoding_name
+        self.batch_threads = batch_threads
+
+        # the encoding is built on first use (or by prewarm), keeping it off the import path
+        self._encoding = None
+        self._encoding_lock = threading.Lock()
+
+        # memoized counts keyed on a content hash, so the texts themselves are not retained
+        self.cache = LRUCache(max_entries=cache_entries, max_bytes=cache_bytes,
+                              sizeof=lambda key, value: _COUNT_ENTRY_BYTES)
+        # token ids of recently counted strings, used to truncate messages without re-encoding
+        self.ids_cache = LRUCache(max_entries=cache_entries, max_bytes=ids_cache_bytes,
+                                  sizeof=lambda key, value: _IDS_ENTRY_BYTES + 4 * len(value))
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            with self._encoding_lock:
+                if self._encoding is None:
+                    if self.encoding_name:
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    else:
+                        self._encoding = tiktoken.encoding_for_model(self.model_name)
+        return self._encoding
+
+    def prewarm(self):
+        """Load the encoding in a background thread so the first request does not pay for it"""
+        def load():
+            try:
+                self.encoding
+            except Exception as e:
+                log.warning("tokenizer.prewarm_failed", model=self.model_name, error=str(e))
+
+        thread = threading.Thread(target=load, name="tokenizer-prewarm", daemon=True)
+        thread.start()
+        return thread
 
     def num_tokens_from_string(self,query_string: str) -> int:
         """Returns the number of tokens in a text string."""
-        num_tokens = len(self.encoding.encode(query_string))
+        key = _content_key(query_string)
+        num_tokens = self.cache.get(key)
+        if num_tokens is None:
+            num_tokens = len(self._encode(key, query_string))
+            self.cache.put(key, num_tokens)
         return num_tokens
 
+    def encode(self, query_string: str) -> array:
+        """Token ids of a string, served from the ids cache when it was counted recently"""
+        key = _content_key(query_string)
+        ids = self.ids_cache.get(key)
+        if ids is None:
+            ids = self._encode(key, query_string)
+        return ids
+
+    def decode(self, ids) -> str:
+        return self.encoding.decode(list(ids))
+
+    def _encode(self, key, query_string):
+        ids = array('I', self.encoding.encode(query_string))
+        self.ids_cache.put(key, ids)
+        return ids
+
+    def count_many(self, query_strings) -> list:
+        """Returns the token counts of many strings, encoding the uncached ones as one threaded batch."""
+        keys = [_content_key(query_string) for query_string in query_strings]
+        counts = [self.cache.get(key) for key in keys]
+
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            encoded = self.encoding.encode_batch([query_strings[i] for i in missing], num_threads=self.batch_threads)
+            for i, tokens in zip(missing, encoded):
+                counts[i] = len(tokens)
+                self.cache.put(keys[i], counts[i])
+                self.ids_cache.put(keys[i], array('I', tokens))
+        return counts
+
+    def message_overhead(self, role: str, name: str = None) -> int:
+        """Tokens a chat message costs on top of its content"""
+        overhead = TOKENS_PER_MESSAGE + self.num_tokens_from_string(role)
+        if name:
+            overhead += TOKENS_PER_NAME + self.num_tokens_from_string(name)
+        return overhead
+
+    def num_tokens_from_message(self, message: dict) -> int:
+        """Returns the number of tokens a chat message adds to the prompt."""
+        content = message.get('content') or ''
+        if not isinstance(content, str):
+            # multimodal parts, only the text parts are counted
+            content = "".join(part.get('text', '') for part in content if isinstance(part, dict))
+        return self.num_tokens_from_string(content) + self.message_overhead(message['role'], message.get('name'))
+
+    def num_tokens_from_messages(self, messages) -> int:
+        """Returns the prompt tokens of a chat completion request."""
+        return sum(self.num_tokens_from_message(message) for message in messages) + REPLY_PRIMING_TOKENS
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+
+class TokenizerRegistry(object):
+    """
+    One lazily built Tokennizer per tiktoken encoding, looked up by model name.
+
+    Models sharing an encoding (e.g. gpt-4o and gpt-4o-mini) share the
+    tokenizer and its count cache. `model_encodings` overrides the built-in
+    model to encoding mapping.
+    """
+
+    def __init__(self, default_model, cache_entries=4096, cache_bytes=4*1024*1024, batch_threads=4,
+                 model_encodings=None, ids_cache_bytes=8*1024*1024):
+        super().__init__()
+        self.default_model = default_model
+        self.cache_entries = cache_entries
+        self.cache_bytes = cache_bytes
+        self.ids_cache_bytes = ids_cache_bytes
+        self.batch_threads = batch_threads
+        self.model_encodings = dict(model_encodings or {})
+
+        self._tokenizers = {}  # encoding name -> Tokennizer
+        self._lock = threading.Lock()
+
+    def encoding_name(self, model_name=None):
+        return encoding_name_for_model(model_name or self.default_model, self.model_encodings)
+
+    def for_model(self, model_name=None) -> Tokennizer:
+        encoding_name = self.encoding_name(model_name)
+        tokenizer = self._tokenizers.get(encoding_name)
+        if tokenizer is None:
+            with self._lock:
+                tokenizer = self._tokenizers.get(encoding_name)
+                if tokenizer is None:
+                    tokenizer = Tokennizer(model_name or self.default_model,
+                                           cache_entries=self.cache_entries,
+                                           cache_bytes=self.cache_bytes,
+                                           batch_threads=self.batch_threads,
+                                           encoding_name=encoding_name,
+                                           ids_cache_bytes=self.ids_cache_bytes)
+                    self._tokenizers[encoding_name] = tokenizer
+        return tokenizer
+
+    def prewarm(self, *model_names):
+        """Load the encodings of the given models (default: the default model) in the background"""
+        encodings = {self.encoding_name(model_name): model_name for model_name in model_names or (None,)}
+        return [self.for_model(model_name).prewarm() for model_name in encodings.values()]
+
+    def cache_stats(self) -> dict:
+        return {encoding_name: tokenizer.cache_stats() for encoding_name, tokenizer in list(self._tokenizers.items())}
+
+
+class StreamTokenCounter(object):
+    """
+    Incremental token counter for streamed completions.
+
+    Deltas are buffered in a list and joined once at the end. Text is encoded
+    in segments as soon as a token boundary is certain (a single space between
+    two non-space characters starts a new pretoken), so every character is
+    encoded about once and the running count is available mid-stream. Text
+    without spaces (e.g. Chinese) is cut every `max_tail_chars`, which can
+    shift the count by a token at each cut. When the API sends a usage chunk
+    (`stream_options.include_usage`) its completion count is used instead.
+    """
+
+    def __init__(self, tokenizer, max_tokens=None, max_tail_chars=256):
+        super().__init__()
+        self.encoding = tokenizer.encoding
+        self.max_tokens = max_tokens
+        self.max_tail_chars = max_tail_chars
+
+        self.parts = []
+        self.usage = None
+        self._committed_tokens = 0
+        self._tail = ""
+
+    def feed(self, delta):
+        self.parts.append(delta)
+        tail = self._tail + delta
+
+        # positions before the old tail end were already rejected, only scan the new text
+        cut = 0
+        for i in range(len(tail) - 2, max(1, len(self._tail) - 1) - 1, -1):
+            if tail[i] == ' ' and not tail[i - 1].isspace() and not tail[i + 1].isspace():
+                cut = i
+                break
+        if not cut and len(tail) > self.max_tail_chars:
+            cut = len(tail) - 1
+
+        if cut > 0:
+            self._committed_tokens += len(self.encoding.encode(tail[:cut]))
+            tail = tail[cut:]
+        self._tail = tail
+
+    def set_usage(self, usage):
+        self.usage = usage
+
+    @property
+    def tokens(self):
+        """Completion tokens so far"""
+        if self.usage and 'completion_tokens' in self.usage:
+            return self.usage['completion_tokens']
+        return self._committed_tokens + (len(self.encoding.encode(self._tail)) if self._tail else 0)
+
+    @property
+    def over_budget(self):
+        return self.max_tokens is not None and self.tokens >= self.max_tokens
+
+    @property
+    def text(self):
+        return "".join(self.parts)
@@ -0,0 +1,412 @@
+"""
+Span based request tracing.
+
+A request handler starts a root span with `tracer.start_span(name, root=True)`
+and activates it; the stages below open child spans with
+`with tracer.span("stage"):`. Child spans are only recorded under an active,
+sampled root, so background work (compaction, span export) never starts
+traces of its own, and with tracing disabled every call is a no-op.
+
+Finished spans are OpenTelemetry shaped (128 bit trace ids, 64 bit span ids,
+nanosecond timestamps, kinds, attributes, events, status) and handed to a
+span exporter: in memory (tests), the structured log, or OTLP/HTTP JSON to a
+collector.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import json
+import queue
+import random
+import threading
+import time
+
+from tools.log import get_logger
+
+log = get_logger(__name__)
+
+# span kinds and status codes as numbered by OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span(object):
+    """One timed operation; end() hands it to the tracer's processor"""
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        super().__init__()
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes) if attributes else {}
+        self.events = []
+        self.status = STATUS_UNSET
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    recording = True
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def set_error(self, error):
+        self.status = STATUS_ERROR
+        self.status_message = str(error)
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.status == STATUS_UNSET:
+            self.status = STATUS_OK
+        self.tracer.processor.on_end(self)
+
+    @property
+    def duration(self):
+        """Seconds between start and end"""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_otlp(self):
+        """The span as an OTLP/JSON span object"""
+        span = {
+            'traceId': f"{self.trace_id:032x}",
+            'spanId': f"{self.span_id:016x}",
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': _otlp_attributes(self.attributes),
+            'events': [{'timeUnixNano': str(ts), 'name': name, 'attributes': _otlp_attributes(attributes)}
+                       for ts, name, attributes in self.events],
+            'status': {'code': self.status},
+        }
+        if self.parent_id is not None:
+            span['parentSpanId'] = f"{self.parent_id:016x}"
+        if self.status_message:
+            span['status']['message'] = self.status_message
+        return span
+
+
+class _NoopSpan(object):
+    """Stands in for a span that is not recorded (tracing off, not sampled, no active root)"""
+
+    recording = False
+    name = None
+    attributes = {}
+    events = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def set_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def attach(span):
+    """Make `span` the active span until detach(token), for hooks that begin and end a request separately"""
+    return _current_span.set(span if span.recording else None)
+
+
+def detach(token):
+    _current_span.reset(token)
+
+
+@contextlib.contextmanager
+def use_span(span):
+    """Make `span` the parent of spans started in this block"""
+    token = attach(span)
+    try:
+        yield span
+    finally:
+        detach(token)
+
+
+class Tracer(object):
+    """
+    Starts spans. Roots are sampled with `sample_rate`; children follow the
+    decision of the active span.
+    """
+
+    def __init__(self, processor=None, sample_rate=1.0, enabled=True):
+        super().__init__()
+        self.processor = processor
+        self.sample_rate = sample_rate
+        self.enabled = enabled and processor is not None
+
+    def start_span(self, name, kind=KIND_INTERNAL, attributes=None, root=False):
+        """A started span; a root when `root`, otherwise a child of the active span"""
+        if not self.enabled:
+            return NOOP_SPAN
+        if root:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return NOOP_SPAN
+            return Span(self, name, random.getrandbits(128), kind=kind, attributes=attributes)
+        parent = _current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, kind=kind, attributes=attributes)
+
+    @contextlib.contextmanager
+    def span(self, name, kind=KIND_INTERNAL, attributes=None, root=False):
+        """Context manager of an active span, ended (with the error, if any) on exit"""
+        span = self.start_span(name, kind, attributes, root)
+        if not span.recording:
+            yield span
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                span.set_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def shutdown(self):
+        if self.processor is not None:
+            self.processor.shutdown()
+
+
+class TracingMiddleware(object):
+    """ASGI middleware running every HTTP request under a root server span"""
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        tracer = get_tracer()
+        if scope['type'] != 'http' or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        attributes = {'http.method': scope['method'], 'http.target': scope['path']}
+        # a streaming response returns once its last frame went out, the span covers the whole stream
+        with tracer.span(f"{scope['method']} {scope['path']}", KIND_SERVER, attributes, root=True) as span:
+            async def traced_send(message):
+                if message['type'] == 'http.response.start':
+                    span.set_attribute('http.status_code', message['status'])
+                await send(message)
+
+            await self.app(scope, receive, traced_send)
+
+
+# -----------------------------------------------------------------------------
+# processors and exporters
+# -----------------------------------------------------------------------------
+
+class SimpleSpanProcessor(object):
+    """Exports every span as it ends, in the ending thread"""
+
+    def __init__(self, exporter):
+        super().__init__()
+        self.exporter = exporter
+
+    def on_end(self, span):
+        self.exporter.export([span])
+
+    def shutdown(self):
+        self.exporter.shutdown()
+
+
+class BatchSpanProcessor(object):
+    """
+    Queues ended spans and exports them in batches from a background thread,
+    every `export_interval` seconds or once `batch_size` spans are waiting.
+    Spans beyond `max_queue` are dropped.
+    """
+
+    def __init__(self, exporter, batch_size=512, export_interval=5.0, max_queue=8192):
+        super().__init__()
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.export_interval = export_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take(self.export_interval)
+            if batch:
+                self._export(batch)
+        batch = self._take(0)
+        while batch:
+            self._export(batch)
+            batch = self._take(0)
+
+    def _take(self, timeout):
+        batch = []
+        deadline = time.monotonic() + timeout
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)) if timeout
+                             else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch):
+        try:
+            self.exporter.export(batch)
+        except Exception as e:
+            log.warning("tracing.export_failed", spans=len(batch), error=str(e))
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join(timeout=self.export_interval + 5)
+        self.exporter.shutdown()
+
+
+class InMemorySpanExporter(object):
+    """Keeps finished spans in a list, for tests"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def export(self, spans):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def get_finished_spans(self, name=None):
+        with self._lock:
+            return [span for span in self.spans if name is None or span.name == name]
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def shutdown(self):
+        pass
+
+
+class LogSpanExporter(object):
+    """Writes each span as a `span` event of the structured log"""
+
+    def export(self, spans):
+        for span in spans:
+            log.info("span", name=span.name, trace_id=f"{span.trace_id:032x}", span_id=f"{span.span_id:016x}",
+                     parent_id=f"{span.parent_id:016x}" if span.parent_id is not None else None,
+                     duration_ms=round(span.duration * 1000, 3), status=span.status,
+                     events=[(name, round((ts - span.start_ns) / 1e6, 3)) for ts, name, _ in span.events] or None,
+                     **span.attributes)
+
+    def shutdown(self):
+        pass
+
+
+class OTLPHttpSpanExporter(object):
+    """Posts batches as OTLP/HTTP JSON (`/v1/traces`) to an OpenTelemetry collector"""
+
+    def __init__(self, endpoint, service_name, timeout=10):
+        super().__init__()
+        import requests
+
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        # own session, spans of the exporter's requests must not be traced
+        self.session = requests.Session()
+
+    def export(self, spans):
+        body = {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': 'chatflow'}, 'spans': [span.to_otlp() for span in spans]}],
+        }]}
+        response = self.session.post(self.endpoint, data=json.dumps(body), timeout=self.timeout,
+                                     headers={'Content-Type': 'application/json'})
+        if response.status_code >= 300:
+            raise RuntimeError(f"collector answered {response.status_code}")
+
+    def shutdown(self):
+        self.session.close()
+
+
+_tracer = Tracer(enabled=False)
+
+
+def get_tracer():
+    return _tracer
+
+
+def configure_tracing(tracing_config, exporter=None):
+    """Install the process-wide tracer for Tracing_config; `exporter` overrides the configured one"""
+    global _tracer
+    shutdown_tracing()
+    if not tracing_config.enabled:
+        _tracer = Tracer(enabled=False)
+        return _tracer
+
+    if exporter is not None:
+        processor = SimpleSpanProcessor(exporter)
+    else:
+        if tracing_config.exporter == "otlp":
+            exporter = OTLPHttpSpanExporter(tracing_config.otlp_endpoint, tracing_config.service_name)
+        elif tracing_config.exporter == "memory":
+            exporter = InMemorySpanExporter()
+        else:
+            exporter = LogSpanExporter()
+        processor = BatchSpanProcessor(exporter, tracing_config.batch_size, tracing_config.export_interval)
+    _tracer = Tracer(processor, sample_rate=tracing_config.sample_rate)
+    return _tracer
+
+
+def shutdown_tracing():
+    """Export the spans still queued and stop the exporter thread"""
+    _tracer.shutdown()
+
+
+atexit.register(shutdown_tracing)
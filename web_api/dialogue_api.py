@@ -1,16 +1,38 @@
 from config.chatgpt_config import config_dict
+from config.prompt_templates import PromptTemplates
 from src.openai_request import OpenAI_Request
+from src.async_openai_request import AsyncOpenAI_Request
+from src.http_transport import get_shared_transport, get_shared_async_transport, endpoint_path, UPSTREAM_RETRIES
 
 from tools.cfg_wrapper import load_config
 from tools.context import ContextHandler
-from tools.tokennizer import Tokennizer
+from tools.context_compactor import ContextCompactor
+from tools.session_store import SessionStore
+from tools.context_storage import build_context_storage, WriteBehindWriter
+from tools.tokennizer import TokenizerRegistry, StreamTokenCounter, configure_encoding_cache
 from tools.prompt_manager import PromptManager
+from tools.intent_classifier import IntentClassifier, IntentCache, IntentDecision
+from tools.response_cache import ResponseCache
+from tools.sse_decoder import iter_deltas, aiter_deltas, response_chunks
+from tools.stream_cancellation import CancellationTracker, DeferredCommit
+from tools.log import get_logger
+from tools.tracing import get_tracer, current_span, KIND_CLIENT
+from tools import metrics
 
+import asyncio
+import atexit
+import contextvars
 import time
-import json
-import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import base64
 
+log = get_logger(__name__)
+
+TOKENS = metrics.counter("chatflow_tokens_total",
+                         "Tokens by model, kind (prompt, completion, input) and source (usage chunk or local tokenizer)",
+                         ("model", "kind", "source"))
+CONTEXT_CUTS = metrics.counter("chatflow_context_cuts_total", "Contexts trimmed to fit the context budget")
+
 class dialogue_api_handler(object):
 
     def __init__(self,context_max=3200):
@@ -24,205 +46,423 @@ class dialogue_api_handler(object):
         vision_model_name = config.Model_config.vision_model_name
         dalle_model_name = config.Model_config.dalle_model_name
         dalle_request_address = config.Model_config.dalle_request_address
+        audio_addresses = dict(transcription_request_address=config.Model_config.transcription_request_address,
+                               tts_request_address=config.Model_config.tts_request_address)
 
         # load context
         context_manage_config = config.Context_manage_config
         del_config = context_manage_config.del_config
         max_context = context_manage_config.max_context
-        self.context_handler = ContextHandler(max_context=max_context, context_del_config=del_config)
         self.context_max = context_max
 
-        # load tokenizer
-        self.tokenizer = Tokennizer(model_name)
+        # load tokenizers, one per encoding, picked by the model of each request
+        tokenizer_config = config.Tokenizer_config
+        self.tokenizers = TokenizerRegistry(model_name,
+                                            cache_entries=tokenizer_config.cache_entries,
+                                            cache_bytes=tokenizer_config.cache_bytes,
+                                            batch_threads=tokenizer_config.batch_threads,
+                                            model_encodings=vars(tokenizer_config.model_encodings))
+        self.tokenizer = self.tokenizers.for_model(model_name)
+        self.vision_model_name = vision_model_name
+        configure_encoding_cache(tokenizer_config.encoding_cache_dir,
+                                 vars(tokenizer_config.encoding_files))
+        if tokenizer_config.prewarm:
+            self.tokenizers.prewarm()
 
         # load api generate parameter
         generate_config = config.generate_config
 
+        # streaming: usage chunk and per-request completion token budget
+        stream_config = config.Stream_config
+        self.max_completion_tokens = stream_config.max_completion_tokens
+        # streams whose client went away before the completion finished
+        self.stream_cancellations = CancellationTracker()
+
         # initialize prompt manager
         self.prompt_manager = PromptManager()
+        # local intent stage of /request_smart, the LLM check is only the fallback
+        self.intent_classifier = IntentClassifier()
+        # LLM intent decisions of recent inputs, keyed on the normalized input
+        intent_cache_config = config.Intent_cache_config
+        self.intent_cache = IntentCache(max_entries=intent_cache_config.max_entries, ttl=intent_cache_config.ttl)
+        # runs the LLM intent check and the reads of the speculative text stream
+        intent_detection_config = config.Intent_detection_config
+        self.intent_executor = ThreadPoolExecutor(max_workers=intent_detection_config.speculative_workers,
+                                                  thread_name_prefix="intent-check")
+        if tokenizer_config.prewarm:
+            self.prompt_manager.prewarm()
+        if intent_detection_config.prewarm:
+            self.intent_classifier.prewarm()
+
+        # one ContextHandler per conversation (after the tokenizer and prompts, which new contexts use)
+        session_config = self.session_config = config.Session_config
+        max_memory_mb = session_config.max_memory_mb
+        # contexts are persisted write-behind so the streaming path never waits on disk
+        storage = build_context_storage(session_config.storage, session_config.storage_path)
+        writer = None
+        if storage is not None:
+            writer = WriteBehindWriter(storage,
+                                       flush_interval=session_config.write_behind_interval,
+                                       batch_size=session_config.write_behind_batch)
+        # prefix-stable layout for upstream prompt caching
+        self.prefix_cache_config = context_manage_config.prefix_cache
+        self._system_prompt = None
+        self.sessions = SessionStore(
+            lambda: self._new_context(max_context, del_config),
+            max_sessions=session_config.max_sessions,
+            idle_ttl=session_config.idle_ttl,
+            max_memory_bytes=max_memory_mb * 1024 * 1024 if max_memory_mb else None,
+            writer=writer,
+            lazy_load=session_config.lazy_load,
+            check_versions=session_config.check_versions,
+        )
+        # write pending contexts out on interpreter exit
+        atexit.register(self.sessions.close)
+
+        # shared pooled transports
+        transport = get_shared_transport(config.Transport_config)
+        async_transport = get_shared_async_transport(config.Transport_config)
+
+        # cache of repeated chat completions, used by the routes that opt in
+        response_cache_config = config.Response_cache_config
+        self.response_cache = ResponseCache.from_config(response_cache_config)
+        self.cache_routes = response_cache_config.routes
+        if self.response_cache is not None:
+            atexit.register(self.response_cache.close)
 
         # initialize
-        if generate_config.use_cotomize_param:
-            self.requestor = OpenAI_Request(keys, model_name, request_address, generate_config, vision_model_name, dalle_model_name, dalle_request_address)
+        if not generate_config.use_cotomize_param:
+            generate_config = None
+        self.requestor = OpenAI_Request(keys, model_name, request_address, generate_config, vision_model_name, dalle_model_name, dalle_request_address, transport, stream_config.include_usage, self.response_cache, **audio_addresses)
+        # asyncio twin used by the async generation methods
+        self.async_requestor = AsyncOpenAI_Request(keys, model_name, request_address, generate_config, vision_model_name, dalle_model_name, dalle_request_address, async_transport, stream_config.include_usage, self.response_cache, **audio_addresses)
+
+        # background summarization of old turns
+        self.compactor = None
+        if context_manage_config.compaction.enabled:
+            self.compactor = ContextCompactor.from_config(self.requestor, self.prompt_manager, context_manage_config.compaction)
+            atexit.register(self.compactor.close)
+
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Scrape-time metrics of the state this handler owns"""
+        metrics.register_callback("chatflow_sessions", "Conversations held in memory", "gauge",
+                                  lambda: len(self.sessions))
+        metrics.register_callback("chatflow_session_memory_bytes", "Accounted memory of the held conversations",
+                                  "gauge", lambda: self.sessions.memory_bytes)
+        metrics.register_callback("chatflow_cache_lookups_total", "Cache lookups by cache and result", "counter",
+                                  self._cache_lookups, ("cache", "result"))
+        metrics.register_callback("chatflow_cache_hit_ratio", "Hits over lookups since start, by cache", "gauge",
+                                  self._cache_hit_ratios, ("cache",))
+        metrics.register_callback("chatflow_streams_cancelled_total", "Completion streams closed by the client",
+                                  "counter", lambda: self.stream_cancellations.stats()['cancelled'])
+        metrics.register_callback("chatflow_cancelled_saved_tokens_total",
+                                  "Estimated completion tokens not generated because of cancelled streams",
+                                  "counter", lambda: self.stream_cancellations.stats()['saved_tokens'])
+        if self.compactor is not None:
+            metrics.register_callback("chatflow_context_compactions_total", "Old turns summarized", "counter",
+                                      lambda: self.compactor.stats()['compactions'])
+
+    def _cache_lookups(self):
+        lookups = {}
+        for stats in self.tokenizers.cache_stats().values():
+            lookups[('tokenizer', 'hit')] = lookups.get(('tokenizer', 'hit'), 0) + stats['hits']
+            lookups[('tokenizer', 'miss')] = lookups.get(('tokenizer', 'miss'), 0) + stats['misses']
+        caches = [('intent', self.intent_cache.stats())]
+        if self.response_cache is not None:
+            caches.append(('response', self.response_cache.stats()))
+        for name, stats in caches:
+            lookups[(name, 'hit')] = stats['hits']
+            lookups[(name, 'miss')] = stats['misses']
+        return lookups
+
+    def _cache_hit_ratios(self):
+        lookups = self._cache_lookups()
+        ratios = {}
+        for (name, result), count in lookups.items():
+            if result == 'hit':
+                total = count + lookups[(name, 'miss')]
+                ratios[(name,)] = count / total if total else 0.0
+        return ratios
+
+    @property
+    def context_handler(self):
+        """Context of the default session, used by callers without a session id"""
+        return self.sessions.get()
+
+    def _new_context(self, max_context, del_config):
+        prefix_cache_config = self.prefix_cache_config
+        if not prefix_cache_config.enabled:
+            return ContextHandler(max_context=max_context, context_del_config=del_config)
+
+        if self._system_prompt is None:
+            system_prompt = self.prompt_manager.get_system_prompts()[prefix_cache_config.system_prompt]
+            self._system_prompt = (system_prompt, self.tokenizer.num_tokens_from_message({"role": "system", "content": system_prompt}))
+        system_prompt, system_prompt_length = self._system_prompt
+        return ContextHandler(max_context=max_context, context_del_config=del_config,
+                              system_prompt=system_prompt, system_prompt_length=system_prompt_length,
+                              block_size=prefix_cache_config.block_size)
+
+    def _record_usage(self, context_handler, usage, latency, model=None):
+        if not usage:
+            return
+        context_handler.record_usage(usage, latency)
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        model = model or "default"
+        TOKENS.inc(model, "prompt", "usage", amount=usage.get('prompt_tokens') or 0)
+        TOKENS.inc(model, "completion", "usage", amount=usage.get('completion_tokens') or 0)
+        log.info("completion.usage", prompt_tokens=usage.get('prompt_tokens'), cached_tokens=cached_tokens,
+                 completion_tokens=usage.get('completion_tokens'), latency=round(latency, 3))
+
+    def _commit_stream(self, context_handler, tokenizer, counter, latency, cancelled=False, model=None, discarded=False):
+        """
+        Record a text stream that finished or was cancelled by the client and
+        append its completion to the context; a cancelled completion is kept
+        with a truncated marker so the next turn knows it was cut short. A
+        discarded stream, a speculative answer replaced by an image, only
+        counts its tokens: its turn is rolled back by the caller.
+        """
+        if discarded:
+            TOKENS.inc(model or "default", "completion", "tokenizer", amount=counter.tokens)
+            log.info("stream.discarded", completion_tokens=counter.tokens)
+            return
+        self._record_usage(context_handler, counter.usage, latency, model)
+        if not counter.usage:
+            TOKENS.inc(model or "default", "completion", "tokenizer", amount=counter.tokens)
+        full_response = counter.text
+        completion_length = counter.tokens
+        if cancelled:
+            saved_tokens = self.stream_cancellations.record_cancelled(counter.tokens, counter.max_tokens)
+            log.info("stream.cancelled", completion_tokens=counter.tokens, saved_tokens=saved_tokens)
+            if full_response:
+                full_response += PromptTemplates.STREAM_TRUNCATED_MARKER
+                completion_length += tokenizer.num_tokens_from_string(PromptTemplates.STREAM_TRUNCATED_MARKER)
+        else:
+            self.stream_cancellations.record_completed(counter.tokens)
+
+        if full_response:
+            completion_length += tokenizer.message_overhead("assistant")
+            self._append_completion(context_handler, tokenizer, full_response, completion_length)
+
+    def _commit_or_defer(self, speculation, *args):
+        """_commit_stream(*args) now, or through `speculation` (a DeferredCommit) once the intent is known"""
+        if speculation is None:
+            self._commit_stream(*args)
         else:
-            self.requestor = OpenAI_Request(keys, model_name, request_address, None, vision_model_name, dalle_model_name, dalle_request_address)
+            speculation.submit(lambda discarded: self._commit_stream(*args, discarded=discarded))
 
-    def generate_massage(self,user_input):
+    def _append_completion(self, context_handler, tokenizer, response, completion_length):
+        """Append the assistant turn, then compact and trim the context to its budget"""
+        with get_tracer().span("context.trim") as span:
+            context_handler.append_cur_to_context(response, completion_length, tag=1)
+            self._maybe_compact(context_handler, tokenizer)
+
+            # the whole context is resent on the next turn
+            trimmed = not context_handler.fits(self.context_max)
+            if trimmed:
+                CONTEXT_CUTS.inc()
+                context_handler.cut_context(tokenizer)
+            span.set_attribute('context.trimmed', trimmed)
+
+    def _assemble_context(self, context_handler, tokenizer, user_input, model=None):
+        """Count the user turn, append it and return the messages to send"""
+        tracer = get_tracer()
+        with tracer.span("tokenize") as span:
+            inputs_length = tokenizer.num_tokens_from_message({"role": "user", "content": user_input})
+            span.set_attribute('tokens', inputs_length)
+        TOKENS.inc(model or "default", "input", "tokenizer", amount=inputs_length)
+        with tracer.span("context.assemble") as span:
+            context_handler.append_cur_to_context(user_input, inputs_length)
+            messages = context_handler.messages()
+            span.set_attribute('context.messages', len(messages))
+        return messages
+
+    def _use_cache(self, route):
+        """Whether completions requested for `route` may be served from the response cache"""
+        return self.response_cache is not None and getattr(self.cache_routes, route, False)
+
+    def _maybe_compact(self, context_handler, tokenizer):
+        if self.compactor is not None:
+            self.compactor.maybe_compact(context_handler, tokenizer)
+
+    def generate_massage(self,user_input,session_id=None):
+
+        context_handler = self.sessions.get(session_id)
 
         if user_input == "clear":
-            self.context_handler.clear()
-            print('start a new session')
+            context_handler.clear()
+            log.info("session.cleared")
+            messages = context_handler.messages()
         else:
-            inputs_length = self.tokenizer.num_tokens_from_string(user_input)
-            self.context_handler.append_cur_to_context(user_input,inputs_length)
+            messages = self._assemble_context(context_handler, self.tokenizer, user_input)
 
         st_time = time.time()
 
-        res = self.requestor.post_request(self.context_handler.context)
+        with get_tracer().span("upstream.request", KIND_CLIENT) as span:
+            res = self.requestor.post_request(messages)
+            span.set_attribute('http.status_code', res.status_code)
         ed_time = time.time()
 
-        print(f'post request time cost = {ed_time - st_time}')
+        log.debug("completion.request", latency=round(ed_time - st_time, 3))
 
         if res.status_code == 200:
 
-            print(res.json())
+            log.debug("completion.body", body=res.text)
             response = res.json()['choices'][0]['message']['content']
             # cut \n for show
             response = response.lstrip("\n")
 
             completion_length = res.json()['usage']['completion_tokens']
-            total_length = res.json()['usage']['total_tokens']
-            print(f"\nresponse : {response}")
+            self._record_usage(context_handler, res.json()['usage'], ed_time - st_time, res.json().get('model'))
+            log.debug("completion.response", response=response)
 
-            self.context_handler.append_cur_to_context(response,completion_length,tag=1)
-            if total_length > self.context_max:
-                self.context_handler.cut_context(total_length,self.tokenizer)
+            completion_length += self.tokenizer.message_overhead("assistant")
+            self._append_completion(context_handler, self.tokenizer, response, completion_length)
 
-            print(f'append context time cost = {time.time() - ed_time}')
+            log.debug("context.appended", latency=round(time.time() - ed_time, 3))
 
             return response
         else:
-            print(res.json())
+            log.error("completion.failed", status=res.status_code, error=res.text)
             return '!!! The api call is abnormal, please check the backend log'
         
 
-    def generate_massage_stream(self, user_input, model=None):
-        print(f"Starting generate_massage_stream with input: {user_input}, model: {model}")  # 调试日志
+    def generate_massage_stream(self, user_input, model=None, session_id=None, max_tokens=None, route="request_openai",
+                                speculation=None):
+        log.debug("stream.start", user_input=user_input, model=model, session_id=session_id)
+
+        context_handler = self.sessions.get(session_id)
         
         if user_input == "clear":
-            self.context_handler.clear()
+            context_handler.clear()
             yield "Starting a new session"
             return
         
-        inputs_length = self.tokenizer.num_tokens_from_string(user_input)
-        self.context_handler.append_cur_to_context(user_input, inputs_length)
+        # count with the encoding of the model this request goes to
+        tokenizer = self.tokenizers.for_model(model)
+        messages = self._assemble_context(context_handler, tokenizer, user_input, model)
         
-        print("Making API request...")  # 调试日志
-        response = self.requestor.post_request_stream(self.context_handler.context, model)
-        print(f"API response status: {response.status_code}")  # 调试日志
+        st_time = time.time()
+        tracer = get_tracer()
+        # ends when the response headers arrive: time to first byte
+        with tracer.span("upstream.request", KIND_CLIENT) as span:
+            response = self.requestor.post_request_stream(messages, model, cache=self._use_cache(route))
+            span.set_attribute('http.status_code', response.status_code)
+        log.debug("stream.response", status=response.status_code)
         
-        full_response = ""
+        # counts completion tokens as deltas arrive, enforcing the per-request budget
+        counter = StreamTokenCounter(tokenizer, max_tokens or self.max_completion_tokens)
         
         if response.status_code == 200:
+            cancelled = False
+            stream_span = tracer.start_span("upstream.stream")
             try:
-                for line in response.iter_lines():
-                    if not line:
-                        continue
-                        
-                    line = line.decode('utf-8')
-                    print(f"Raw line: {line}")  # 调试日志
-                    
-                    if line.startswith('data: '):
-                        line = line[6:]
-                        if line.strip() == "[DONE]":
-                            print("Received DONE signal")  # 调试日志
-                            continue
-                            
-                        try:
-                            json_line = json.loads(line)
-                            if len(json_line['choices']) > 0:
-                                content = json_line['choices'][0].get('delta', {}).get('content', '')
-                                if content:
-                                    print(f"Yielding content: {content}")  # 调试日志
-                                    full_response += content
-                                    yield content
-                        except json.JSONDecodeError as e:
-                            print(f"JSON decode error: {e} for line: {line}")  # 调试日志
-                            continue
-                            
+                for delta in iter_deltas(response_chunks(response)):
+                    if delta.usage:
+                        counter.set_usage(delta.usage)
+                    if delta.content:
+                        log.sampled("stream.delta", chars=len(delta.content))
+                        if not counter.parts:
+                            stream_span.add_event("first_token")
+                        counter.feed(delta.content)
+                        yield delta.content
+                        if counter.over_budget:
+                            log.info("stream.budget_reached", max_tokens=counter.max_tokens)
+                            break
+            except GeneratorExit:
+                # the client went away, closing the response below closes the upstream connection
+                cancelled = True
+                raise
             except Exception as e:
-                print(f"Error in stream processing: {e}")  # 调试日志
+                log.exception("stream.error", error=str(e))
                 yield f"Error: {str(e)}"
-                
-            # 更新上下文
-            if full_response:
-                print(f"Final full response: {full_response}")  # 调试日志
-                completion_length = self.tokenizer.num_tokens_from_string(full_response)
-                self.context_handler.append_cur_to_context(full_response, completion_length, tag=1)
-                
-                total_length = inputs_length + completion_length
-                if total_length > self.context_max:
-                    self.context_handler.cut_context(total_length, self.tokenizer)
+            finally:
+                response.close()
+                self._end_stream_span(stream_span, counter, cancelled)
+                # 更新上下文
+                self._commit_or_defer(speculation, context_handler, tokenizer, counter, time.time() - st_time,
+                                      cancelled, model)
         else:
-            print(f"API error: {response.text}")  # 调试日志
+            log.error("stream.failed", status=response.status_code, error=response.text)
             yield '!!! The api call is abnormal, please check the backend log'
 
+    @staticmethod
+    def _end_stream_span(span, counter, cancelled):
+        span.set_attribute('completion_tokens', counter.tokens)
+        span.set_attribute('cancelled', cancelled)
+        span.end()
+
     def generate_vision_response(self, user_input, image_url):
         """
         Handle image understanding requests
         """
         st_time = time.time()
         
-        res = self.requestor.post_vision_request(user_input, image_url)
+        with get_tracer().span("upstream.request", KIND_CLIENT) as span:
+            res = self.requestor.post_vision_request(user_input, image_url)
+            span.set_attribute('http.status_code', res.status_code)
         ed_time = time.time()
         
-        print(f'vision request time cost = {ed_time - st_time}')
+        log.debug("vision.request", latency=round(ed_time - st_time, 3))
         
         if res.status_code == 200:
             response_data = res.json()
             response = response_data['choices'][0]['message']['content']
             response = response.lstrip("\n")
             
-            print(f"\nvision response : {response}")
+            log.debug("vision.response", response=response)
             return response
         else:
-            print(res.json())
+            log.error("vision.failed", status=res.status_code, error=res.text)
             return '!!! The vision api call is abnormal, please check the backend log'
 
     def generate_vision_response_stream(self, user_input, image_url):
         """
         Handle streaming image understanding requests
         """
-        print(f"Starting vision stream with input: {user_input[:50]}..., image URL length: {len(image_url) if image_url else 0}")
+        log.debug("vision.stream_start", user_input=user_input, image_url=image_url)
         
         try:
-            response = self.requestor.post_vision_request_stream(user_input, image_url)
-            print(f"Vision API response status: {response.status_code}")
+            with get_tracer().span("upstream.request", KIND_CLIENT) as span:
+                response = self.requestor.post_vision_request_stream(user_input, image_url)
+                span.set_attribute('http.status_code', response.status_code)
+            log.debug("vision.stream_response", status=response.status_code)
             
             if response.status_code != 200:
                 error_text = response.text
-                print(f"Vision API error response: {error_text}")
+                log.error("vision.stream_failed", status=response.status_code, error=error_text)
                 yield f"Vision API call failed: {response.status_code} - {error_text}"
                 return
         except Exception as e:
-            print(f"Vision API request failed: {e}")
+            log.exception("vision.request_failed", error=str(e))
             yield f"Vision request failed: {str(e)}"
             return
         
-        full_response = ""
+        counter = StreamTokenCounter(self.tokenizers.for_model(self.vision_model_name), self.max_completion_tokens)
         
         if response.status_code == 200:
             try:
-                for line in response.iter_lines():
-                    if not line:
-                        continue
-                        
-                    line = line.decode('utf-8')
-                    print(f"Vision raw line: {line}")
-                    
-                    if line.startswith('data: '):
-                        line = line[6:]
-                        if line.strip() == "[DONE]":
-                            print("Vision received DONE signal")
-                            continue
-                            
-                        try:
-                            json_line = json.loads(line)
-                            if len(json_line['choices']) > 0:
-                                content = json_line['choices'][0].get('delta', {}).get('content', '')
-                                if content:
-                                    print(f"Vision yielding content: {content}")
-                                    full_response += content
-                                    yield content
-                        except json.JSONDecodeError as e:
-                            print(f"Vision JSON decode error: {e} for line: {line}")
-                            continue
-                            
+                for delta in iter_deltas(response_chunks(response)):
+                    if delta.usage:
+                        counter.set_usage(delta.usage)
+                    if delta.content:
+                        log.sampled("stream.delta", chars=len(delta.content))
+                        counter.feed(delta.content)
+                        yield delta.content
+                        if counter.over_budget:
+                            log.info("vision.budget_reached", max_tokens=counter.max_tokens)
+                            break
+            except GeneratorExit:
+                self.stream_cancellations.record_cancelled(counter.tokens, counter.max_tokens)
+                raise
             except Exception as e:
-                print(f"Error in vision stream processing: {e}")
+                log.exception("vision.stream_error", error=str(e))
                 yield f"Error: {str(e)}"
+            finally:
+                response.close()
         else:
-            print(f"Vision API error: {response.text}")
+            log.error("vision.stream_failed", status=response.status_code, error=response.text)
             yield '!!! The vision api call is abnormal, please check the backend log'
 
     def generate_dalle_image(self, prompt, size="1024x1024", quality="standard"):
@@ -231,23 +471,25 @@ class dialogue_api_handler(object):
         """
         st_time = time.time()
         
-        res = self.requestor.post_dalle_request(prompt, size, quality)
+        with get_tracer().span("upstream.request", KIND_CLIENT) as span:
+            res = self.requestor.post_dalle_request(prompt, size, quality)
+            span.set_attribute('http.status_code', res.status_code)
         ed_time = time.time()
         
-        print(f'dalle request time cost = {ed_time - st_time}')
+        log.debug("dalle.request", latency=round(ed_time - st_time, 3))
         
         if res.status_code == 200:
             response_data = res.json()
             image_url = response_data['data'][0]['url']
             
-            print(f"\ndalle generated image url: {image_url}")
+            log.info("dalle.generated", image_url=image_url)
             return {
                 'success': True,
                 'image_url': image_url,
                 'revised_prompt': response_data['data'][0].get('revised_prompt', prompt)
             }
         else:
-            print(res.json())
+            log.error("dalle.failed", status=res.status_code, error=res.text)
             return {
                 'success': False,
                 'error': '!!! The dalle api call is abnormal, please check the backend log'
@@ -257,7 +499,7 @@ class dialogue_api_handler(object):
         """
         Generate DALL-E image with streaming-like response
         """
-        print(f"Generating DALL-E image with prompt: {prompt}")
+        log.debug("dalle.start", prompt=prompt)
         
         try:
             # 首先生成图像
@@ -271,7 +513,7 @@ class dialogue_api_handler(object):
                 yield f"Image generation failed: {result['error']}"
                 
         except Exception as e:
-            print(f"Error in generate_dalle_image_stream: {e}")
+            log.exception("dalle.error", error=str(e))
             yield f"Error generating image: {str(e)}"
 
     def transcribe_audio(self, file_obj, language=None):
@@ -280,16 +522,18 @@ class dialogue_api_handler(object):
         retry_count = 0
         
         while retry_count < max_retries:
+            if retry_count:
+                UPSTREAM_RETRIES.inc(endpoint_path(self.requestor.transcription_request_address))
             try:
                 res = self.requestor.post_whisper_transcription(file_obj, language=language)
                 
                 if res.status_code == 200:
                     result = res.json()
                     text = result.get('text', '').strip()
-                    print(f"ASR success - Text: {text[:100]}{'...' if len(text) > 100 else ''}")
+                    log.info("asr.done", text=text)
                     return text
                 else:
-                    print(f"ASR API error - Status: {res.status_code}, Response: {res.text}")
+                    log.error("asr.failed", status=res.status_code, error=res.text)
                     if res.status_code == 429:  # Rate limit
                         time.sleep(1)
                         retry_count += 1
@@ -297,7 +541,7 @@ class dialogue_api_handler(object):
                     return None
                     
             except Exception as e:
-                print(f"ASR exception attempt {retry_count + 1}: {e}")
+                log.warning("asr.error", attempt=retry_count + 1, error=str(e))
                 retry_count += 1
                 if retry_count < max_retries:
                     time.sleep(1)
@@ -317,22 +561,24 @@ class dialogue_api_handler(object):
         # Handle long text
         if len(text) > 4000:
             text = text[:4000] + "..."
-            print(f"TTS text truncated to 4000 characters")
+            log.info("tts.truncated", max_chars=4000)
         
         while retry_count < max_retries:
+            if retry_count:
+                UPSTREAM_RETRIES.inc(endpoint_path(self.requestor.tts_request_address))
             try:
                 res = self.requestor.post_tts_request(text, voice)
                 
                 if res.status_code == 200:
                     audio_data = res.content
                     if len(audio_data) > 1000:  # Check audio data validity
-                        print(f"TTS success - Audio size: {len(audio_data)} bytes, Voice: {voice}")
+                        log.info("tts.done", audio_bytes=len(audio_data), voice=voice)
                         return audio_data
                     else:
-                        print(f"TTS returned invalid audio data: {len(audio_data)} bytes")
+                        log.error("tts.invalid_audio", audio_bytes=len(audio_data))
                         return None
                 else:
-                    print(f"TTS API error - Status: {res.status_code}, Response: {res.text}")
+                    log.error("tts.failed", status=res.status_code, error=res.text)
                     if res.status_code == 429:  # Rate limit
                         time.sleep(1)
                         retry_count += 1
@@ -340,7 +586,7 @@ class dialogue_api_handler(object):
                     return None
                     
             except Exception as e:
-                print(f"TTS exception attempt {retry_count + 1}: {e}")
+                log.warning("tts.error", attempt=retry_count + 1, error=str(e))
                 retry_count += 1
                 if retry_count < max_retries:
                     time.sleep(1)
@@ -358,26 +604,14 @@ class dialogue_api_handler(object):
         # Handle long text
         if len(text) > 4000:
             text = text[:4000] + "..."
-            print(f"TTS streaming text truncated to 4000 characters")
-        
-        # Use requests directly for streaming
-        url = "https://api.openai.com/v1/audio/speech"
-        headers = self.requestor.headers.copy()  # Use existing headers with API key
-        
-        data = {
-            "model": "tts-1",  # Use tts-1 for better streaming performance
-            "input": text,
-            "voice": voice,
-            "response_format": "mp3",  # MP3 works better for streaming
-            "speed": 1.0
-        }
+            log.info("tts.truncated", max_chars=4000)
         
         try:
-            print(f"Starting TTS streaming for text: {text[:50]}...")
+            log.debug("tts.stream_start", text=text)
             
-            with requests.post(url, headers=headers, json=data, stream=True) as response:
+            # Use tts-1 for better streaming performance, MP3 works better for streaming
+            with self.requestor.post_tts_request(text, voice, model="tts-1", speed=1.0, stream=True) as response:
                 if response.status_code == 200:
-                    print(f"TTS streaming started successfully")
                     
                     # Stream audio chunks
                     for chunk in response.iter_content(chunk_size=4096):
@@ -390,62 +624,183 @@ class dialogue_api_handler(object):
                                 'format': 'mp3'
                             }
                     
-                    print(f"TTS streaming completed")
+                    log.debug("tts.stream_done")
                     yield {
                         'type': 'audio_end',
                         'message': 'Audio streaming completed'
                     }
                 else:
-                    print(f"TTS streaming failed - Status: {response.status_code}")
+                    log.error("tts.stream_failed", status=response.status_code)
                     yield {
                         'type': 'error',
                         'message': f'TTS API error: {response.status_code}'
                     }
                     
         except Exception as e:
-            print(f"TTS streaming exception: {e}")
+            log.exception("tts.stream_error", error=str(e))
             yield {
                 'type': 'error',
                 'message': f'TTS streaming failed: {str(e)}'
             }
 
-    def detect_intent_and_generate(self, user_input, image_url=None, model=None):
+    def detect_intent_and_generate(self, user_input, image_url=None, model=None, session_id=None):
         """
         Detect user intent and route to appropriate generation method
         """
-        print(f"Detecting intent for input: {user_input[:50]}..., model: {model}")
+        log.debug("intent.start", user_input=user_input, model=model)
         
         try:
+            decision = self._classify_intent(user_input)
+
             # 检查是否明确请求图像生成
-            if any(keyword in user_input.lower() for keyword in ['generate image', 'create image', 'draw', 'paint', 'generate a picture', 'create a picture']):
-                print("Direct image generation request detected")
-                for chunk in self.generate_dalle_image_stream(user_input):
-                    yield chunk
+            if decision is not None and decision.is_image and decision.tier != 'model':
+                log.info("intent.decided", route="dalle", source=decision.tier)
+                yield from self.generate_dalle_image_stream(user_input)
                 return
             
             # 如果用户上传了图像，使用视觉模型
             if image_url:
-                print("Image provided, using vision model")
-                for chunk in self.generate_vision_response_stream(user_input, image_url):
-                    yield chunk
+                log.info("intent.decided", route="vision", source="image_url")
+                yield from self.generate_vision_response_stream(user_input, image_url)
                 return
             
-            # 使用LLM检测意图
-            is_image_request = self._detect_intent_with_llm(user_input)
+            # 本地分类器不确定时使用LLM检测意图
+            if decision is None:
+                decision = self._cached_intent(user_input)
+            if decision is not None:
+                # the model tier or an earlier LLM check of the same input
+                is_image_request, source = decision.is_image, decision.tier
+            elif self.prompt_manager.get_intent_detection_settings().get('speculative', True):
+                yield from self._speculative_generate(user_input, model, session_id)
+                return
+            else:
+                is_image_request, source = self._detect_intent_with_llm(user_input), "llm"
             
             if is_image_request:
-                print("Image generation intent detected by LLM")
-                for chunk in self.generate_dalle_image_stream(user_input):
-                    yield chunk
+                log.info("intent.decided", route="dalle", source=source)
+                yield from self.generate_dalle_image_stream(user_input)
             else:
-                print("Text conversation intent detected")
-                for chunk in self.generate_massage_stream(user_input, model):
-                    yield chunk
+                log.info("intent.decided", route="text", source=source)
+                yield from self.generate_massage_stream(user_input, model, session_id, route="request_smart")
                     
         except Exception as e:
-            print(f"Error in detect_intent_and_generate: {e}")
+            log.exception("intent.error", error=str(e))
             yield f"Error: {str(e)}"
 
+    def _speculative_generate(self, user_input, model=None, session_id=None):
+        """
+        Start the text stream while the LLM intent check runs. Text chunks are
+        read on the intent executor and buffered until the intent is known;
+        then they are flushed and the stream continues, or the stream is
+        closed (closing the upstream response), its turn is rolled back and
+        the image is generated instead. The image does not wait for a read
+        that is still pending, the stream is closed once that read returns.
+        The answer is committed to the context only once the intent is text,
+        also when the stream finished before the check did.
+        """
+        context_handler = self.sessions.get(session_id)
+        mark = context_handler.mark()
+        # the check and the reads run under this request's trace; the reads share one context,
+        # so spans the text stream opens are closed in the context that opened them
+        intent_future = self.intent_executor.submit(contextvars.copy_context().run, self._detect_intent_with_llm, user_input)
+        stream_context = contextvars.copy_context()
+        speculation = DeferredCommit()
+        text_stream = self.generate_massage_stream(user_input, model, session_id, route="request_smart",
+                                                   speculation=speculation)
+
+        def close():
+            stream_context.run(text_stream.close)
+
+        def discard():
+            close()
+            context_handler.rollback(mark)
+
+        def release(action):
+            """Run `action` now, or once the pending read returned: a running generator cannot be closed"""
+            if pending is None:
+                action()
+            else:
+                pending.add_done_callback(lambda _: action())
+
+        buffer = []
+        pending = None
+        finished = released = False
+        try:
+            while not intent_future.done() and not finished:
+                if pending is None:
+                    pending = self.intent_executor.submit(stream_context.run, next, text_stream)
+                wait((intent_future, pending), return_when=FIRST_COMPLETED)
+                if pending.done():
+                    try:
+                        buffer.append(pending.result())
+                    except StopIteration:
+                        finished = True
+                    pending = None
+
+            if intent_future.result():
+                log.info("intent.decided", route="dalle", source="llm", speculative_chunks=len(buffer))
+                # the answer leaves the context and the cancellation stats alone
+                speculation.resolve(False)
+                release(discard)
+                released = True
+                for chunk in self.generate_dalle_image_stream(user_input):
+                    yield chunk
+                return
+
+            log.info("intent.decided", route="text", source="llm", speculative_chunks=len(buffer))
+            speculation.resolve(True)
+            for chunk in buffer:
+                yield chunk
+            if pending is not None:
+                try:
+                    yield pending.result()
+                except StopIteration:
+                    finished = True
+                pending = None
+            while not finished:
+                try:
+                    chunk = stream_context.run(next, text_stream)
+                except StopIteration:
+                    break
+                yield chunk
+        finally:
+            if not released:
+                # the client went away before the intent was known: committed as a cancelled answer
+                speculation.resolve(True)
+                # releases the upstream response when the client went away
+                release(close)
+
+    def _classify_intent(self, user_input):
+        """
+        Local intent decision, None when the input has to go to the LLM check
+        """
+        settings = self.prompt_manager.get_intent_detection_settings()
+        if not settings.get('local_classifier', True):
+            return None
+
+        with get_tracer().span("intent.classify") as span:
+            decision = self.intent_classifier.classify(user_input)
+            span.set_attribute('intent.tier', decision.tier)
+            span.set_attribute('intent.confidence', float(decision.confidence))
+        threshold = settings.get('confidence_threshold', self.intent_classifier.confidence_threshold)
+        if settings.get('debug_logging'):
+            log.debug("intent.local", is_image=decision.is_image, confidence=round(decision.confidence, 2), tier=decision.tier)
+        if decision.confidence < threshold:
+            return None
+        return decision
+
+    def _cached_intent(self, user_input):
+        """
+        Decision of an earlier LLM check of the same input, None on a miss;
+        looked up before anything is speculated
+        """
+        cached = self.intent_cache.get(user_input)
+        if cached is None:
+            return None
+        current_span().add_event("intent.cache_hit")
+        log.debug("intent.cache_hit", is_image=cached)
+        return IntentDecision(cached, 1.0, 'cache')
+
     def _detect_intent_with_llm(self, user_input):
         """
         Use LLM to detect if the user input is requesting image generation
@@ -458,29 +813,414 @@ class dialogue_api_handler(object):
             intent_context = [{"role": "user", "content": intent_detection_prompt}]
             
             # Use the existing requestor to make the API call
-            response = self.requestor.post_request(intent_context)
+            with get_tracer().span("intent.llm", KIND_CLIENT) as span:
+                response = self.requestor.post_request(intent_context, cache=self._use_cache("intent_detection"))
+                span.set_attribute('http.status_code', response.status_code)
             
             if response.status_code == 200:
                 result = response.json()['choices'][0]['message']['content'].strip().upper()
-                print(f"Intent detection response: {result}")
+                log.debug("intent.llm_response", result=result)
                 
                 # Parse the response
                 if "YES" in result:
+                    self.intent_cache.put(user_input, True)
                     return True
                 elif "NO" in result:
+                    self.intent_cache.put(user_input, False)
                     return False
                 else:
-                    print(f"Unexpected intent detection response: {result}, defaulting to NO")
+                    log.warning("intent.unexpected_response", result=result)
                     return False
             else:
-                print(f"Intent detection API failed: {response.status_code}")
+                log.error("intent.failed", status=response.status_code)
                 return False
                 
         except Exception as e:
-            print(f"Intent detection error: {e}")
+            log.exception("intent.error", error=str(e))
+            return False
+
+    # =========================================================================
+    # asyncio variants, used by the ASGI entry point
+    # =========================================================================
+
+    async def agenerate_massage_stream(self, user_input, model=None, session_id=None, max_tokens=None, route="request_openai",
+                                       speculation=None):
+        """
+        Async generator twin of generate_massage_stream
+        """
+        context_handler = await self.sessions.aget(session_id)
+
+        if user_input == "clear":
+            context_handler.clear()
+            yield "Starting a new session"
+            return
+
+        # count with the encoding of the model this request goes to
+        tokenizer = self.tokenizers.for_model(model)
+        messages = self._assemble_context(context_handler, tokenizer, user_input, model)
+
+        st_time = time.time()
+        tracer = get_tracer()
+        # ends when the response headers arrive: time to first byte
+        with tracer.span("upstream.request", KIND_CLIENT) as span:
+            response = await self.async_requestor.post_request_stream(messages, model, cache=self._use_cache(route))
+            span.set_attribute('http.status_code', response.status_code)
+
+        counter = StreamTokenCounter(tokenizer, max_tokens or self.max_completion_tokens)
+
+        if response.status_code != 200:
+            await response.aread()
+            await response.aclose()
+            log.error("stream.failed", status=response.status_code, error=response.text)
+            yield '!!! The api call is abnormal, please check the backend log'
+            return
+
+        cancelled = False
+        stream_span = tracer.start_span("upstream.stream")
+        try:
+            async for delta in aiter_deltas(response.aiter_bytes()):
+                if delta.usage:
+                    counter.set_usage(delta.usage)
+                if delta.content:
+                    log.sampled("stream.delta", chars=len(delta.content))
+                    if not counter.parts:
+                        stream_span.add_event("first_token")
+                    counter.feed(delta.content)
+                    yield delta.content
+                    if counter.over_budget:
+                        break
+        except (GeneratorExit, asyncio.CancelledError):
+            # the client went away, closing the response below closes the upstream connection
+            cancelled = True
+            raise
+        except Exception as e:
+            log.exception("stream.error", error=str(e))
+            yield f"Error: {str(e)}"
+        finally:
+            await response.aclose()
+            self._end_stream_span(stream_span, counter, cancelled)
+            # 更新上下文
+            self._commit_or_defer(speculation, context_handler, tokenizer, counter, time.time() - st_time,
+                                  cancelled, model)
+
+    async def agenerate_vision_response_stream(self, user_input, image_url):
+        """
+        Async generator twin of generate_vision_response_stream
+        """
+        try:
+            with get_tracer().span("upstream.request", KIND_CLIENT) as span:
+                response = await self.async_requestor.post_vision_request_stream(user_input, image_url)
+                span.set_attribute('http.status_code', response.status_code)
+        except Exception as e:
+            log.exception("vision.request_failed", error=str(e))
+            yield f"Vision request failed: {str(e)}"
+            return
+
+        counter = StreamTokenCounter(self.tokenizers.for_model(self.vision_model_name), self.max_completion_tokens)
+
+        try:
+            if response.status_code != 200:
+                await response.aread()
+                error_text = response.text
+                log.error("vision.stream_failed", status=response.status_code, error=error_text)
+                yield f"Vision API call failed: {response.status_code} - {error_text}"
+                return
+
+            try:
+                async for delta in aiter_deltas(response.aiter_bytes()):
+                    if delta.usage:
+                        counter.set_usage(delta.usage)
+                    if delta.content:
+                        log.sampled("stream.delta", chars=len(delta.content))
+                        counter.feed(delta.content)
+                        yield delta.content
+                        if counter.over_budget:
+                            break
+            except (GeneratorExit, asyncio.CancelledError):
+                self.stream_cancellations.record_cancelled(counter.tokens, counter.max_tokens)
+                raise
+            except Exception as e:
+                log.exception("vision.stream_error", error=str(e))
+                yield f"Error: {str(e)}"
+        finally:
+            await response.aclose()
+
+    async def agenerate_dalle_image(self, prompt, size="1024x1024", quality="standard"):
+        """
+        Async twin of generate_dalle_image
+        """
+        with get_tracer().span("upstream.request", KIND_CLIENT) as span:
+            res = await self.async_requestor.post_dalle_request(prompt, size, quality)
+            span.set_attribute('http.status_code', res.status_code)
+
+        if res.status_code == 200:
+            response_data = res.json()
+            image_url = response_data['data'][0]['url']
+            return {
+                'success': True,
+                'image_url': image_url,
+                'revised_prompt': response_data['data'][0].get('revised_prompt', prompt)
+            }
+        else:
+            log.error("dalle.failed", status=res.status_code, error=res.text)
+            return {
+                'success': False,
+                'error': '!!! The dalle api call is abnormal, please check the backend log'
+            }
+
+    async def agenerate_dalle_image_stream(self, prompt):
+        """
+        Async generator twin of generate_dalle_image_stream
+        """
+        try:
+            result = await self.agenerate_dalle_image(prompt)
+
+            if result['success']:
+                yield "I've generated an image for you."
+                yield f"[IMAGE:{result['image_url']}]"  # Special marker for frontend recognition
+            else:
+                yield f"Image generation failed: {result['error']}"
+
+        except Exception as e:
+            log.exception("dalle.error", error=str(e))
+            yield f"Error generating image: {str(e)}"
+
+    async def adetect_intent_and_generate(self, user_input, image_url=None, model=None, session_id=None):
+        """
+        Async generator twin of detect_intent_and_generate
+        """
+        try:
+            if self.intent_classifier.trained:
+                decision = self._classify_intent(user_input)
+            else:
+                # the first decision trains the model, not on the event loop
+                decision = await asyncio.to_thread(self._classify_intent, user_input)
+            if decision is None and not image_url:
+                decision = self._cached_intent(user_input)
+            if decision is not None and decision.is_image and decision.tier != 'model':
+                log.info("intent.decided", route="dalle", source=decision.tier)
+                stream = self.agenerate_dalle_image_stream(user_input)
+            elif image_url:
+                log.info("intent.decided", route="vision", source="image_url")
+                stream = self.agenerate_vision_response_stream(user_input, image_url)
+            elif decision is None and self.prompt_manager.get_intent_detection_settings().get('speculative', True):
+                stream = self._aspeculative_generate(user_input, model, session_id)
+            else:
+                if decision is not None:
+                    is_image_request, source = decision.is_image, decision.tier
+                else:
+                    is_image_request, source = await self._adetect_intent_with_llm(user_input), "llm"
+                log.info("intent.decided", route="dalle" if is_image_request else "text", source=source)
+                if is_image_request:
+                    stream = self.agenerate_dalle_image_stream(user_input)
+                else:
+                    stream = self.agenerate_massage_stream(user_input, model, session_id, route="request_smart")
+
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                # async generators are not closed with their consumer, the upstream response would linger
+                await stream.aclose()
+
+        except Exception as e:
+            log.exception("intent.error", error=str(e))
+            yield f"Error: {str(e)}"
+
+    async def _aspeculative_generate(self, user_input, model=None, session_id=None):
+        """
+        Async twin of _speculative_generate; a pending upstream read is
+        cancelled as soon as the intent check says image
+        """
+        context_handler = await self.sessions.aget(session_id)
+        mark = context_handler.mark()
+        intent_task = asyncio.ensure_future(self._adetect_intent_with_llm(user_input))
+        speculation = DeferredCommit()
+        text_stream = self.agenerate_massage_stream(user_input, model, session_id, route="request_smart",
+                                                    speculation=speculation)
+
+        buffer = []
+        pending = None
+        finished = False
+        try:
+            while not intent_task.done():
+                if pending is None:
+                    pending = asyncio.ensure_future(text_stream.__anext__())
+                await asyncio.wait({intent_task, pending}, return_when=asyncio.FIRST_COMPLETED)
+                if pending.done():
+                    try:
+                        buffer.append(pending.result())
+                    except StopAsyncIteration:
+                        finished = True
+                        await intent_task
+                    pending = None
+
+            if intent_task.result():
+                log.info("intent.decided", route="dalle", source="llm", speculative_chunks=len(buffer))
+                speculation.resolve(False)
+                if pending is not None:
+                    pending.cancel()
+                    await asyncio.gather(pending, return_exceptions=True)
+                    pending = None
+                await text_stream.aclose()
+                context_handler.rollback(mark)
+                async for chunk in self.agenerate_dalle_image_stream(user_input):
+                    yield chunk
+                return
+
+            log.info("intent.decided", route="text", source="llm", speculative_chunks=len(buffer))
+            speculation.resolve(True)
+            for chunk in buffer:
+                yield chunk
+            if pending is not None:
+                try:
+                    yield await pending
+                except StopAsyncIteration:
+                    finished = True
+                pending = None
+            if not finished:
+                async for chunk in text_stream:
+                    yield chunk
+        finally:
+            # the client went away before the intent was known: committed as a cancelled answer
+            speculation.resolve(True)
+            if pending is not None:
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+            if not intent_task.done():
+                intent_task.cancel()
+            # releases the upstream response when the client went away
+            await text_stream.aclose()
+
+    async def _adetect_intent_with_llm(self, user_input):
+        """
+        Async twin of _detect_intent_with_llm
+        """
+        try:
+            intent_detection_prompt = self.prompt_manager.get_intent_detection_prompt(user_input)
+            intent_context = [{"role": "user", "content": intent_detection_prompt}]
+
+            with get_tracer().span("intent.llm", KIND_CLIENT) as span:
+                response = await self.async_requestor.post_request(intent_context, cache=self._use_cache("intent_detection"))
+                span.set_attribute('http.status_code', response.status_code)
+
+            if response.status_code == 200:
+                result = response.json()['choices'][0]['message']['content'].strip().upper()
+                is_image = "YES" in result
+                if is_image or "NO" in result:
+                    self.intent_cache.put(user_input, is_image)
+                return is_image
+            else:
+                log.error("intent.failed", status=response.status_code)
+                return False
+
+        except Exception as e:
+            log.exception("intent.error", error=str(e))
             return False
 
+    async def atranscribe_audio(self, file_obj, language=None):
+        """Async twin of transcribe_audio"""
+        max_retries = 2
+        retry_count = 0
+
+        while retry_count < max_retries:
+            if retry_count:
+                UPSTREAM_RETRIES.inc(endpoint_path(self.requestor.transcription_request_address))
+            try:
+                res = await self.async_requestor.post_whisper_transcription(file_obj, language=language)
+
+                if res.status_code == 200:
+                    return res.json().get('text', '').strip()
+
+                log.error("asr.failed", status=res.status_code, error=res.text)
+                if res.status_code == 429:  # Rate limit
+                    await asyncio.sleep(1)
+                    retry_count += 1
+                    continue
+                return None
+
+            except Exception as e:
+                log.warning("asr.error", attempt=retry_count + 1, error=str(e))
+                retry_count += 1
+                if retry_count < max_retries:
+                    await asyncio.sleep(1)
+
+        return None
+
+    async def atext_to_speech(self, text, voice="alloy"):
+        """Async twin of text_to_speech"""
+        max_retries = 2
+        retry_count = 0
+
+        text = text.strip()
+        if not text:
+            return None
+        if len(text) > 4000:
+            text = text[:4000] + "..."
+
+        while retry_count < max_retries:
+            if retry_count:
+                UPSTREAM_RETRIES.inc(endpoint_path(self.requestor.tts_request_address))
+            try:
+                res = await self.async_requestor.post_tts_request(text, voice)
+
+                if res.status_code == 200:
+                    audio_data = res.content
+                    if len(audio_data) > 1000:  # Check audio data validity
+                        return audio_data
+                    log.error("tts.invalid_audio", audio_bytes=len(audio_data))
+                    return None
+
+                log.error("tts.failed", status=res.status_code, error=res.text)
+                if res.status_code == 429:  # Rate limit
+                    await asyncio.sleep(1)
+                    retry_count += 1
+                    continue
+                return None
+
+            except Exception as e:
+                log.warning("tts.error", attempt=retry_count + 1, error=str(e))
+                retry_count += 1
+                if retry_count < max_retries:
+                    await asyncio.sleep(1)
 
+        return None
 
+    async def atext_to_speech_stream(self, text, voice="alloy"):
+        """Async generator twin of text_to_speech_stream"""
+        text = text.strip()
+        if not text:
+            return
+        if len(text) > 4000:
+            text = text[:4000] + "..."
 
+        try:
+            response = await self.async_requestor.post_tts_request(text, voice, model="tts-1", speed=1.0, stream=True)
+            try:
+                if response.status_code == 200:
+                    async for chunk in response.aiter_bytes(4096):
+                        if chunk:
+                            yield {
+                                'type': 'audio_chunk',
+                                'data': base64.b64encode(chunk).decode('utf-8'),
+                                'format': 'mp3'
+                            }
+                    yield {
+                        'type': 'audio_end',
+                        'message': 'Audio streaming completed'
+                    }
+                else:
+                    log.error("tts.stream_failed", status=response.status_code)
+                    yield {
+                        'type': 'error',
+                        'message': f'TTS API error: {response.status_code}'
+                    }
+            finally:
+                await response.aclose()
 
+        except Exception as e:
+            log.exception("tts.stream_error", error=str(e))
+            yield {
+                'type': 'error',
+                'message': f'TTS streaming failed: {str(e)}'
+            }